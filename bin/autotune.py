@@ -0,0 +1,231 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Search for the CBMC flags that check a proof fastest.
+
+The search space is a list of dimensions, and each dimension is a list
+of alternative CBMC flags: slicing options, unwinding bounds, solver
+backends.  A variant of the CBMC flags for a proof takes one
+alternative from each dimension and adds it to the flags for the
+proof.  Each variant is run on the goto binary for the proof, and its
+wall time, peak memory, and verdict are measured.  Variants that
+change the verdict are rejected, and the remaining variants are ranked
+by time.
+"""
+
+import difflib
+import itertools
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+from multiprocessing.pool import ThreadPool
+
+import options
+import results
+
+################################################################
+
+class AutotuneException(Exception):
+    """Exception thrown by autotune methods."""
+
+    def __init__(self, msg):
+        super(AutotuneException, self).__init__()
+        self.message = msg
+
+    def __str__(self):
+        return self.message
+
+    def __repr__(self):
+        return self.message
+
+def abort(msg):
+    """Abort an autotune method."""
+    raise AutotuneException(msg)
+
+################################################################
+# The search space
+#
+# A dimension is written on the command line as alternatives
+# separated by '|', each alternative encoded like --cbmcflags.  An
+# empty alternative leaves the flags unchanged.
+
+ALTERNATIVE_SEPARATOR = '|'
+
+SLICING = '|--slice-formula|--reachability-slice|--slice-formula;--reachability-slice'
+DEFAULT_DIMENSIONS = [SLICING]
+
+def parse_dimension(string):
+    """Parse a dimension into a list of alternative flag dictionaries."""
+
+    return [options.options_str2dict(alternative) if alternative else {}
+            for alternative in string.split(ALTERNATIVE_SEPARATOR)]
+
+def variants(cbmcflags, dimensions, limit=None):
+    """The variants of the CBMC flags, starting with the flags themselves."""
+
+    cbmcflags = cbmcflags or {}
+    found = [cbmcflags]
+    for alternatives in itertools.product(*dimensions):
+        variant = dict(cbmcflags)
+        for alternative in alternatives:
+            variant.update(alternative)
+        if variant not in found:
+            found.append(variant)
+        if limit and len(found) >= limit:
+            break
+    return found
+
+################################################################
+# Measuring a variant
+
+TIMEOUT = 'TIMEOUT'
+ERROR = 'ERROR'
+
+def wait_variant(popen, start, timeout):
+    """Wait for a variant to exit, killing it after timeout seconds, and
+    return its resource usage and whether it timed out."""
+
+    timed_out = False
+    while True:
+        pid, status, rusage = os.wait4(popen.pid, os.WNOHANG)
+        if pid:
+            break
+        if timeout and time.time() - start > timeout:
+            popen.kill()
+            pid, status, rusage = os.wait4(popen.pid, 0)
+            timed_out = True
+            break
+        time.sleep(0.1)
+    # The process has been reaped by wait4 and not by popen
+    popen.returncode = status
+    return rusage, timed_out
+
+def run_variant(args):
+    """Run CBMC with a variant of the flags and measure the run."""
+
+    goto, cbmcflags, timeout, outfile = args
+    cmd = ['cbmc', goto] + options.options_dict2words(cbmcflags)
+
+    start = time.time()
+    with open(outfile, 'w') as outobj:
+        popen = subprocess.Popen(cmd, stdout=outobj, stderr=subprocess.STDOUT)
+        rusage, timed_out = wait_variant(popen, start, timeout)
+    runtime = time.time() - start
+
+    index = results.index_output(outfile)
+    verdict = index['status'] or ERROR
+    if timed_out:
+        verdict = TIMEOUT
+    return {
+        'cbmcflags': cbmcflags,
+        'command': ' '.join(cmd),
+        'time': runtime,
+        # ru_maxrss is in kilobytes on Linux
+        'memory': rusage.ru_maxrss / 1024.0,
+        'status': verdict,
+        'failed': results.failing_properties(index)
+    }
+
+def autotune(goto, cbmcflags, dimensions, jobs=1, timeout=None, limit=None):
+    """Measure the variants of the flags and rank them.
+
+    Return the measurement of the unmodified flags and the ranked
+    measurements of the variants that agree with its verdict.
+    """
+    # pylint: disable=too-many-arguments
+
+    if not os.path.isfile(goto):
+        abort("Goto binary not found: {}".format(goto))
+
+    candidates = variants(cbmcflags, dimensions, limit)
+    tmpdir = tempfile.mkdtemp()
+    work = [(goto, variant, timeout,
+             os.path.join(tmpdir, 'cbmc-{}.txt'.format(num)))
+            for num, variant in enumerate(candidates)]
+
+    print("Running {} variants of the CBMC flags with {} jobs"
+          .format(len(work), jobs))
+    pool = ThreadPool(jobs)
+    try:
+        measures = pool.map(run_variant, work)
+    finally:
+        pool.close()
+        pool.join()
+        shutil.rmtree(tmpdir)
+
+    baseline = measures[0]
+    if baseline['status'] in [TIMEOUT, ERROR]:
+        abort("CBMC with the current flags did not reach a verdict: {}"
+              .format(baseline['status']))
+
+    for measure in measures:
+        measure['agrees'] = (measure['status'] == baseline['status'] and
+                             measure['failed'] == baseline['failed'])
+        measure['speedup'] = (baseline['time'] / measure['time']
+                              if measure['time'] else None)
+    ranked = sorted([measure for measure in measures if measure['agrees']],
+                    key=lambda measure: (measure['time'], measure['memory']))
+    return baseline, ranked, measures
+
+################################################################
+# Reporting
+
+def report(baseline, measures):
+    """A ranked report of the measurements as a list of lines."""
+
+    lines = ["{:>4}  {:>9}  {:>7}  {:>9}  {:<10}  {}"
+             .format('rank', 'time (s)', 'speedup', 'mem (MB)', 'verdict',
+                     'cbmcflags')]
+    ranked = sorted(measures,
+                    key=lambda measure: (not measure['agrees'],
+                                         measure['time'], measure['memory']))
+    for rank, measure in enumerate(ranked, 1):
+        verdict = measure['status']
+        if not measure['agrees']:
+            verdict = 'CHANGED' if verdict not in [TIMEOUT, ERROR] else verdict
+        lines.append("{:>4}  {:>9.1f}  {:>6.2f}x  {:>9.0f}  {:<10}  {}{}"
+                     .format(rank if measure['agrees'] else '-',
+                             measure['time'], measure['speedup'] or 0,
+                             measure['memory'], verdict,
+                             options.options_dict2str(measure['cbmcflags']),
+                             ' (current)' if measure is baseline else ''))
+    return lines
+
+def write_report(filename, baseline, ranked, measures):
+    """Write the measurements as a JSON report."""
+
+    with open(filename, 'w') as fileobj:
+        json.dump({'baseline': baseline, 'ranked': ranked,
+                   'measures': measures},
+                  fileobj, indent=2, sort_keys=True)
+
+CBMCFLAGS_REGEXP = re.compile(r'^cbmcflags:[ \t]*\S.*$', re.MULTILINE)
+
+def yaml_patch(cbmcflags, yamlfile=None):
+    """A patch setting cbmcflags in a cbmc-batch.yaml file.
+
+    Return a unified diff against the file if it sets cbmcflags on a
+    single line, and the YAML setting cbmcflags otherwise.
+    """
+
+    # A JSON string is a double-quoted YAML string
+    setting = 'cbmcflags: {}'.format(
+        json.dumps(options.options_dict2str(cbmcflags)))
+    if yamlfile is None:
+        return setting + '\n'
+
+    with open(yamlfile) as fileobj:
+        original = fileobj.read()
+    if not CBMCFLAGS_REGEXP.search(original):
+        return setting + '\n'
+    patched = CBMCFLAGS_REGEXP.sub(lambda _: setting, original, count=1)
+    return ''.join(difflib.unified_diff(original.splitlines(True),
+                                        patched.splitlines(True),
+                                        yamlfile, yamlfile))
+
+################################################################
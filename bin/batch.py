@@ -47,9 +47,10 @@ def abort(msg1, msg2=None, data=None, verbose=False):
 class Batch:
     """An AWS Batch environment with methods to inspect and submit jobs."""
 
-    def __init__(self, jobname=None, queuename=None, region=None):
+    def __init__(self, jobname=None, queuename=None, region=None,
+                 client=None):
         # Client is used to submit, kill, and query jobs
-        self.client = boto3.client('batch', region_name=region)
+        self.client = client or boto3.client('batch', region_name=region)
         self.region = region
 
         # Job queue is used to submit and query jobs
@@ -122,7 +123,8 @@ class Batch:
         return found
 
     def submit_job(self, jobname=None, jobqueue=None, jobdefinition=None,
-                   command=None, memory=None, dependson=None):
+                   command=None, memory=None, vcpus=None, timeout=None,
+                   dependson=None):
         """Run the job given by cmd in the batch environment."""
 
         # pylint: disable=too-many-arguments
@@ -137,15 +139,21 @@ class Batch:
             overrides['command'].extend(['--region', self.region])
         if memory is not None:
             overrides['memory'] = memory
+        if vcpus is not None:
+            overrides['vcpus'] = vcpus
         # Should test that depends is a list of strings
         dependson = [{'jobId': jid} for jid in dependson or []]
+        extra = {}
+        if timeout is not None:
+            extra['timeout'] = {'attemptDurationSeconds': timeout}
 
         try:
             result = self.client.submit_job(jobName=jobname,
                                             jobQueue=jobqueue,
                                             jobDefinition=jobdefinition,
                                             dependsOn=dependson,
-                                            containerOverrides=overrides)
+                                            containerOverrides=overrides,
+                                            **extra)
         except ClientError as exc:
             abort("Failed to run cbmc ('{}')".format(' '.join(command)),
                   data=exc)
@@ -0,0 +1,131 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Run several proofs in one container.
+
+CBMC is mostly single-threaded, but the containers Batch launches
+often have several cores and lots of memory.  A bundle is a set of
+proofs packed by memory and vCPU demand into one container.  The
+bundle job runs each proof in its own subprocess and workspace, one
+phase after another, and each phase copies its output to the usual
+paths in the bucket.  When a proof is done, the bundle writes a
+completion marker giving the status of each phase to the output
+bucket of the proof, so consumers of the output see ordinary results.
+
+The options for the proofs in a bundle are written to a manifest in
+the bucket, and the bundle job is given the path to the manifest.
+"""
+
+import json
+import os
+
+import executor
+import s3
+import sizing
+
+################################################################
+
+BUNDLE = 'bundle'
+MANIFEST = 'bundle.json'
+DONE = 'done.json'
+
+SUCCEEDED = 'SUCCEEDED'
+FAILED = 'FAILED'
+
+# Directories in the options that are rerooted in a member workspace
+DIRECTORIES = ['srcdir', 'wsdir', 'outdir', 'blddir']
+
+################################################################
+# Packing proofs into bundles
+
+def demand(opts):
+    """The memory (MB) and vCPUs needed by the phases of a proof.
+
+    The phases of a proof run one after another in a bundle, so the
+    demand of a proof is the largest demand of its phases.
+    """
+
+    memory = 0
+    vcpus = 1
+    for phase in sizing.PHASES:
+        if opts.get(phase):
+            phase_memory, phase_vcpus, _ = sizing.choose(opts, phase)
+            memory = max(memory, phase_memory)
+            vcpus = max(vcpus, phase_vcpus or 1)
+    return memory, vcpus
+
+def pack(items, memory, vcpus):
+    """Pack (item, memory, vcpus) triples into bundles first fit
+    decreasing by memory and return the bundles as lists of items.
+
+    An item too big for a bundle is put in a bundle by itself.
+    """
+
+    bins = []
+    for item, item_memory, item_vcpus in sorted(
+            items, key=lambda triple: (triple[1], triple[2]), reverse=True):
+        for bundle in bins:
+            if (bundle['memory'] + item_memory <= memory and
+                    bundle['vcpus'] + item_vcpus <= vcpus):
+                break
+        else:
+            bundle = {'items': [], 'memory': 0, 'vcpus': 0}
+            bins.append(bundle)
+        bundle['items'].append(item)
+        bundle['memory'] += item_memory
+        bundle['vcpus'] += item_vcpus
+    return [bundle['items'] for bundle in bins]
+
+################################################################
+# The manifest and completion markers
+
+def manifest_path(opts, jobname):
+    """The S3 path to the manifest of a bundle."""
+
+    return "{}/{}/{}".format(opts['bucket'].rstrip('/'), jobname, MANIFEST)
+
+def read_manifest(path, region=None):
+    """The options for the proofs in a bundle."""
+
+    return s3.get_json(path, region=region)['members']
+
+def write_done(opts, phases):
+    """Write the completion marker for a proof in a bundle."""
+
+    status = SUCCEEDED
+    if [phase for phase in phases if phases[phase] != SUCCEEDED]:
+        status = FAILED
+    s3.put_json("{}/{}".format(opts['outbucket'], DONE),
+                {'jobname': opts['jobname'], 'status': status,
+                 'phases': phases},
+                region=opts['region'])
+
+def reroot(opts, workdir):
+    """The options for a proof with its directories under workdir."""
+
+    opts = dict(opts)
+    for key in DIRECTORIES:
+        if opts.get(key):
+            opts[key] = os.path.join(workdir, opts[key].lstrip(os.sep))
+    return opts
+
+################################################################
+# Submitting a bundle
+
+def submit(members, jobname, memory, vcpus):
+    """Submit a bundle job running the proofs with the given options."""
+
+    opts = members[0]
+    path = manifest_path(opts, jobname)
+    s3.put_json(path, {'members': members}, region=opts['region'])
+
+    # The bundle job installs the packages used by the proofs it runs
+    bundle_opts = dict(opts, jobname=jobname, bundled=False)
+    return executor.make_executor(opts).submit_job(
+        jobname="{}-{}".format(jobname, BUNDLE),
+        command=['--jsons', json.dumps(bundle_opts),
+                 '--dobundle', '--bundle', path, '--jobname', jobname],
+        memory=memory, vcpus=vcpus)
+
+################################################################
@@ -7,7 +7,9 @@ from pprint import pprint
 import json
 
 import clienterror
-from batch import Batch
+import executor
+import sizing
+import worker
 
 ################################################################
 
@@ -50,7 +52,7 @@ class CBMC:
     # pylint: disable=too-many-instance-attributes
     # pylint: disable=too-few-public-methods
 
-    def __init__(self, opts, quiet=True):
+    def __init__(self, opts, quiet=True, batch=None):
         self.srcdir = opts['srcdir']
         self.wsdir = opts['wsdir']
         self.outdir = opts['outdir']
@@ -71,9 +73,8 @@ class CBMC:
         self.report = opts['report']
 
         self.opts = opts
-        self.batch = Batch(
-            jobname=self.jobdef, queuename=self.jobqueue,
-            region=opts['region'])
+        # AWS Batch or the local executor
+        self.batch = batch or executor.make_executor(opts)
 
     def launch_build(self, flags=None, dependson=None):
         """Build the goto program from source"""
@@ -81,10 +82,11 @@ class CBMC:
         flags = flags or []
         jobname = "{}-build".format(self.jobname)
         full_flags = flags +  ['--dobuild', '--jobname', jobname]
-        memory = self.opts['build_memory']
+        memory, vcpus, timeout = sizing.choose(self.opts, 'build')
 
         return self.batch.submit_job(jobname=jobname, command=full_flags,
-                                     memory=memory, dependson=dependson)
+                                     memory=memory, vcpus=vcpus,
+                                     timeout=timeout, dependson=dependson)
 
     def launch_property(self, flags=None, dependson=None):
         """Run CBMC to check program properties"""
@@ -92,10 +94,11 @@ class CBMC:
         flags = flags or []
         jobname = "{}-property".format(self.jobname)
         full_flags = flags +  ['--doproperty', '--jobname', jobname]
-        memory = self.opts['property_memory']
+        memory, vcpus, timeout = sizing.choose(self.opts, 'property')
 
         return self.batch.submit_job(jobname=jobname, command=full_flags,
-                                     memory=memory, dependson=dependson)
+                                     memory=memory, vcpus=vcpus,
+                                     timeout=timeout, dependson=dependson)
 
     def launch_coverage(self, flags=None, dependson=None):
         """Run CBMC to compute coverage statistics"""
@@ -103,10 +106,11 @@ class CBMC:
         flags = flags or []
         jobname = "{}-coverage".format(self.jobname)
         full_flags = flags +  ['--docoverage', '--jobname', jobname]
-        memory = self.opts['coverage_memory']
+        memory, vcpus, timeout = sizing.choose(self.opts, 'coverage')
 
         return self.batch.submit_job(jobname=jobname, command=full_flags,
-                                     memory=memory, dependson=dependson)
+                                     memory=memory, vcpus=vcpus,
+                                     timeout=timeout, dependson=dependson)
 
     def launch_report(self, flags=None, dependson=None):
         """Run cbmc-viewer to construct the final CBMC report"""
@@ -114,16 +118,48 @@ class CBMC:
         flags = flags or []
         jobname = "{}-report".format(self.jobname)
         full_flags = flags +  ['--doreport', '--jobname', jobname]
-        memory = self.opts['report_memory']
+        memory, vcpus, timeout = sizing.choose(self.opts, 'report')
 
         return self.batch.submit_job(jobname=jobname, command=full_flags,
-                                     memory=memory, dependson=dependson)
+                                     memory=memory, vcpus=vcpus,
+                                     timeout=timeout, dependson=dependson)
+
+    def launch_workers(self, flags=None):
+        """Launch workers running the phases sent to the worker queue"""
+
+        flags = flags or []
+        jobs = []
+        for num in range(self.opts['workers']):
+            jobname = "{}-worker{}".format(self.jobname, num)
+            full_flags = flags + ['--doworker', '--jobname', jobname]
+            memory = max(self.opts['{}_memory'.format(phase)]
+                         for phase in sizing.PHASES)
+            jobs.append(self.batch.submit_job(jobname=jobname,
+                                              command=full_flags,
+                                              memory=memory))
+        return jobs
+
+    def submit_to_workers(self):
+        """
+        Send the CBMC phases to workers through the worker queue
+        """
+
+        phases = worker.submit(self.opts, self.opts['worker_queue'])
+        self.launch_workers(['--jsons', json.dumps(self.opts)])
+
+        results = {'jobname': self.jobname}
+        for phase in sizing.PHASES:
+            results[phase] = {'jobid': None, 'jobname': phases.get(phase)}
+        return results
 
     def submit_jobs(self):
         """
         Submit CBMC jobs to CBMC patch
         """
 
+        if self.opts['worker_queue']:
+            return self.submit_to_workers()
+
         command = ['--jsons', json.dumps(self.opts)]
 
         build_job = {'jobid': None, 'jobname': None}
@@ -0,0 +1,124 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Resources allotted to the container by its control groups.
+
+The number of cores reported by the kernel is the number of cores on
+the host, not the number allotted to the container.  AWS Batch limits
+the CPU used by a container with a CFS quota or with CPU shares
+(1024 shares per vCPU), and these limits are found in the cgroup v1
+hierarchy under /sys/fs/cgroup/cpu or in the cgroup v2 file
+/sys/fs/cgroup/cpu.max.  The shares of a process in the root cgroup
+(like a phase run by the local executor) are not a limit.
+"""
+
+import multiprocessing
+import os
+
+################################################################
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+
+# cgroup v2
+CPU_MAX = 'cpu.max'
+
+# cgroup v1
+CPU_DIRS = ['cpu', 'cpu,cpuacct', 'cpuacct,cpu']
+CFS_QUOTA = 'cpu.cfs_quota_us'
+CFS_PERIOD = 'cpu.cfs_period_us'
+CPU_SHARES = 'cpu.shares'
+SHARES_PER_CPU = 1024
+PROC_CGROUP = '/proc/self/cgroup'
+
+def read_words(path):
+    """The whitespace-separated words in a cgroup file, or None."""
+
+    try:
+        with open(path) as fileobj:
+            return fileobj.read().split()
+    except (IOError, OSError):
+        return None
+
+def in_root_cpu_cgroup(proc_cgroup=PROC_CGROUP):
+    """Whether the process is in the root cgroup of the cgroup v1 cpu
+    controller."""
+
+    try:
+        with open(proc_cgroup) as fileobj:
+            lines = fileobj.read().splitlines()
+    except (IOError, OSError):
+        return False
+    for line in lines:
+        # Each line is hierarchy-id:controllers:path
+        parts = line.split(':', 2)
+        if len(parts) == 3 and 'cpu' in parts[1].split(','):
+            return parts[2] == '/'
+    return False
+
+def cpu_quota(root=CGROUP_ROOT, proc_cgroup=PROC_CGROUP):
+    """The CPU quota of the container in cores, or None if unlimited."""
+
+    words = read_words(os.path.join(root, CPU_MAX))
+    if words and words[0] != 'max':
+        return float(words[0]) / float(words[1])
+
+    for cpudir in CPU_DIRS:
+        quota = read_words(os.path.join(root, cpudir, CFS_QUOTA))
+        period = read_words(os.path.join(root, cpudir, CFS_PERIOD))
+        if quota and period and int(quota[0]) > 0:
+            return float(quota[0]) / float(period[0])
+
+        shares = read_words(os.path.join(root, cpudir, CPU_SHARES))
+        # Batch gives a container 1024 shares for each vCPU
+        if (shares and int(shares[0]) >= SHARES_PER_CPU and
+                not in_root_cpu_cgroup(proc_cgroup)):
+            return float(shares[0]) / SHARES_PER_CPU
+
+    return None
+
+def cpus(root=CGROUP_ROOT, proc_cgroup=PROC_CGROUP):
+    """The number of cores the container can use."""
+
+    count = multiprocessing.cpu_count()
+    quota = cpu_quota(root, proc_cgroup)
+    if quota is None:
+        return count
+    return max(1, min(count, int(quota + 0.5)))
+
+################################################################
+# Memory
+#
+# The peak memory use of the container is in the cgroup v2 file
+# /sys/fs/cgroup/memory.peak or in the cgroup v1 file
+# /sys/fs/cgroup/memory/memory.max_usage_in_bytes, and the memory limit
+# of the container is in memory.max or memory/memory.limit_in_bytes.
+
+MEMORY_PEAK_FILES = ['memory.peak',
+                     os.path.join('memory', 'memory.max_usage_in_bytes')]
+MEMORY_LIMIT_FILES = ['memory.max',
+                      os.path.join('memory', 'memory.limit_in_bytes')]
+# cgroup v1 reports no limit as a number near 2**63
+UNLIMITED_MEMORY = 2**60
+
+def memory_peak(root=CGROUP_ROOT):
+    """The peak memory use of the container in MB, or None if unknown."""
+
+    for name in MEMORY_PEAK_FILES:
+        words = read_words(os.path.join(root, name))
+        if words:
+            return int(words[0]) / (1024.0 * 1024.0)
+    return None
+
+def memory_limit(root=CGROUP_ROOT):
+    """The memory limit of the container in MB, or None if unlimited."""
+
+    for name in MEMORY_LIMIT_FILES:
+        words = read_words(os.path.join(root, name))
+        if words:
+            if words[0] == 'max' or int(words[0]) >= UNLIMITED_MEMORY:
+                return None
+            return int(words[0]) / (1024.0 * 1024.0)
+    return None
+
+################################################################
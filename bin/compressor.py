@@ -0,0 +1,175 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Compression of large artifacts copied between phases and to buckets.
+
+Goto binaries and CBMC output with full traces are large and highly
+compressible.  Artifacts are compressed with zstd using all cores when
+zstd 1.3 or later is installed, and with gzip otherwise: the zstd 0.5
+packaged with Ubuntu 16.04 has no multithreading and can't read what
+later versions write.  An object
+written compressed carries the metadata tag cbmc-encoding naming the
+codec, and readers use the tag to decompress the object on read.
+"""
+
+import gzip
+import os
+import re
+import shutil
+import subprocess
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+################################################################
+
+class CompressionException(Exception):
+    """Exception thrown by compression methods."""
+
+    def __init__(self, msg):
+        super(CompressionException, self).__init__()
+        self.message = msg
+
+    def __str__(self):
+        return self.message
+
+    def __repr__(self):
+        return self.message
+
+def abort(msg):
+    """Abort a compression method."""
+    raise CompressionException(msg)
+
+################################################################
+
+# The metadata tag giving the encoding of a compressed object
+ENCODING_METADATA = 'cbmc-encoding'
+
+ZSTD = 'zstd'
+GZIP = 'gzip'
+
+# Artifacts smaller than this are not worth compressing
+THRESHOLD = 1024 * 1024
+
+# The oldest zstd command used, the first with the -T option
+ZSTD_MIN_VERSION = (1, 3)
+ZSTD_VERSION_REGEXP = re.compile(r'v(\d+)\.(\d+)')
+
+# The zstd command found by zstd_command, once looked for
+ZSTD_COMMAND = []
+
+def which(command):
+    """Find a command on the search path."""
+
+    for path in os.environ.get('PATH', '').split(os.pathsep):
+        candidate = os.path.join(path, command)
+        if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+            return candidate
+    return None
+
+def zstd_version(command):
+    """The (major, minor) version of a zstd command, or None if unknown."""
+
+    try:
+        output = subprocess.check_output([command, '--version'],
+                                         stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    match = ZSTD_VERSION_REGEXP.search(output.decode('utf-8', 'replace'))
+    if match is None:
+        return None
+    return tuple(int(number) for number in match.groups())
+
+def zstd_command():
+    """The zstd command, or None if it is missing or too old."""
+
+    if not ZSTD_COMMAND:
+        command = which(ZSTD)
+        version = command and zstd_version(command)
+        if version is None or version < ZSTD_MIN_VERSION:
+            command = None
+        ZSTD_COMMAND.append(command)
+    return ZSTD_COMMAND[0]
+
+def codec():
+    """The best codec available for compression."""
+
+    if zstd_command():
+        return ZSTD
+    return GZIP
+
+def encoding(metadata):
+    """The encoding named by object metadata, or None if not compressed."""
+
+    return (metadata or {}).get(ENCODING_METADATA)
+
+################################################################
+
+def compress_file(src, dst, method):
+    """Compress file src into file dst with the codec method."""
+
+    if method == ZSTD:
+        # -T0 uses one compression thread per core
+        subprocess.check_call([ZSTD, '-T0', '-q', '-f', src, '-o', dst])
+        return
+    if method == GZIP:
+        with open(src, 'rb') as srcobj:
+            with gzip.open(dst, 'wb') as dstobj:
+                shutil.copyfileobj(srcobj, dstobj)
+        return
+    abort("Unknown compression codec: {}".format(method))
+
+def decompress_file(src, dst, method):
+    """Decompress file src into file dst with the codec method."""
+
+    if method == ZSTD:
+        if zstd_command():
+            subprocess.check_call([ZSTD, '-d', '-q', '-f', src, '-o', dst])
+            return
+        if zstandard is None:
+            abort("Can't decompress {}: no zstandard module or zstd command"
+                  .format(src))
+        with open(src, 'rb') as srcobj:
+            with open(dst, 'wb') as dstobj:
+                zstandard.ZstdDecompressor().copy_stream(srcobj, dstobj)
+        return
+    if method == GZIP:
+        with gzip.open(src, 'rb') as srcobj:
+            with open(dst, 'wb') as dstobj:
+                shutil.copyfileobj(srcobj, dstobj)
+        return
+    abort("Unknown compression codec: {}".format(method))
+
+def decompress(data, method):
+    """Decompress the bytes data with the codec method."""
+
+    if method is None:
+        return data
+    if method == GZIP:
+        return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+    if method != ZSTD:
+        abort("Unknown compression codec: {}".format(method))
+    if zstandard is not None:
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    if not zstd_command():
+        abort("Can't decompress zstd data: no zstandard module or zstd command")
+    popen = subprocess.Popen([ZSTD, '-d', '-q', '-c'],
+                             stdin=subprocess.PIPE,
+                             stdout=subprocess.PIPE)
+    output, _ = popen.communicate(data)
+    if popen.returncode:
+        abort("Failed to decompress zstd data")
+    return output
+
+def ratio_report(name, size, compressed_size, method):
+    """A one-line report of the compression ratio achieved for an artifact."""
+
+    ratio = float(size) / compressed_size if compressed_size else 0.0
+    return ("Compressed {} with {}: {} bytes to {} bytes ({:.1f}x)"
+            .format(name, method, size, compressed_size, ratio))
+
+################################################################
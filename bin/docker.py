@@ -5,6 +5,7 @@
 
 import datetime
 import json
+from multiprocessing.pool import ThreadPool
 import subprocess
 import os
 import sys
@@ -12,14 +13,27 @@ from pprint import pprint
 import time
 import shutil
 import re
+import resource
+import traceback
+import uuid
 
 import boto3
 
+import bundle
+import cgroup
+import compressor
+import executor
+import gotocache
+import history
 import s3
 import options
 import package
+import results
+import runoptions
+import sizing
+import store
+import worker
 
-PUBLIC_WEBSITE_METADATA = {"public-website-contents": "True"}
 def abort(msg):
     """Abort a docker container"""
     sys.stdout.flush()
@@ -29,46 +43,39 @@ def abort(msg):
 
 def install_cbmc(opts):
     """Install CBMC binaries"""
+    if opts['bundled']:
+        # Installed once by the bundle for all of its proofs
+        return
+    if opts['executor'] == executor.LOCAL:
+        # Local jobs use the tools on the search path
+        return
     package.copy('cbmc', opts['pkgbucket'], opts['cbmcpkg'])
     package.install('cbmc', opts['cbmcpkg'], 'cbmc')
 
 def install_viewer(opts):
     """Install the cbmc-viewer tool"""
+    if opts['bundled'] or opts['executor'] == executor.LOCAL:
+        return
     package.copy('cbmc-viewer', opts['pkgbucket'], opts['viewerpkg'])
     package.install('cbmc-viewer', opts['viewerpkg'], 'cbmc-viewer')
 
 def get_buckets(opts, copysrc=True):
     """Copy input buckets to container."""
 
-    if copysrc:
-        if opts['srctarfile']:
-            tarfile = s3.key_name(opts['srctarfile'])
-            tardir = os.path.dirname(opts['srcdir'].rstrip('/'))
-            s3.copy_object_to_file(
-                opts['srctarfile'], tarfile, region=opts['region'])
-            try:
-                os.makedirs(tardir)
-            except OSError:
-                abort("Failed to make directory {}".format(tardir))
-            cmd = ['tar', 'fx', tarfile, '-C', tardir]
-            try:
-                subprocess.check_call(cmd)
-            except subprocess.CalledProcessError:
-                abort("Failed to run command {}".format(' '.join(cmd)))
-            if not os.path.isdir(opts['srcdir']):
-                abort("Failed to create {} by untarring {}"
-                      .format(opts['srcdir'], opts['srctarfile']))
-        else:
-            s3.sync_bucket_to_directory(opts['srcbucket'], opts['srcdir'])
-            # make scripts in the source tree executable
-            subprocess.check_call(['chmod', '+x', '-R', opts['srcdir']])
-    s3.sync_bucket_to_directory(opts['wsbucket'], opts['wsdir'])
-    s3.sync_bucket_to_directory(opts['outbucket'], opts['wsdir'])
+    return store.make_store(opts).get(opts, copysrc)
+
+def phase_name(opts):
+    """Name of the phase run by the container"""
 
-def put_buckets(opts):
+    for phase in ['build', 'property', 'coverage', 'report']:
+        if opts.get('do' + phase):
+            return phase
+    return 'output'
+
+def put_buckets(opts, snapshot, publish=None):
     """Copy container output to bucket."""
 
-    s3.sync_directory_to_bucket(opts['wsdir'], opts['outbucket'], metadata=PUBLIC_WEBSITE_METADATA)
+    store.make_store(opts).put(opts, snapshot, phase_name(opts), publish)
 
 def checkpoint_file(filename, fileobj, s3path, region):
     """Write a checkpoint of an open file to a bucket"""
@@ -165,37 +172,395 @@ def run_command(command, outfile, errfile, psfile, opts, delay=10):
         taskname = opts['taskname']
         region = opts['region']
         while popen.poll() is None:
-            checkpoint_file(outfile, outobj, path, region)
-            checkpoint_file(errfile, errobj, path, region)
-            checkpoint_performance(psfile, path, taskname, region)
+            if opts['executor'] != executor.LOCAL:
+                checkpoint_file(outfile, outobj, path, region)
+                checkpoint_file(errfile, errobj, path, region)
+                checkpoint_performance(psfile, path, taskname, region)
             time.sleep(delay)
 
     print("Command returned error code {}: {}".format(popen.returncode,
                                                       ' '.join(command)))
     os.chdir(cwd)
 
+GOTOCACHE_SHIM = """#!/bin/sh
+exec python {} "$@"
+"""
+
+def install_gotocache(opts):
+    """Put a goto-cc shim caching object files on the search path and
+    return the file logging cache lookups"""
+
+    gotocc = compressor.which('goto-cc')
+    if gotocc is None:
+        print("No goto-cc found: not caching object files")
+        return None
+
+    shimdir = os.path.abspath('gotocache-bin')
+    if not os.path.isdir(shimdir):
+        os.makedirs(shimdir)
+    shim = os.path.join(shimdir, 'goto-cc')
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'gotocache.py')
+    with open(shim, 'w') as shimobj:
+        shimobj.write(GOTOCACHE_SHIM.format(script))
+    os.chmod(shim, 0o755)
+
+    stats = os.path.abspath('gotocache-stats.txt')
+    version = subprocess.check_output([gotocc, '--version'])
+    os.environ[gotocache.REAL_ENV] = gotocc
+    os.environ[gotocache.VERSION_ENV] = version.decode().strip()
+    os.environ[gotocache.DIRECTORY_ENV] = opts['gotocache_dir'] or ''
+    os.environ[gotocache.BUCKET_ENV] = opts['gotocache_bucket'] or ''
+    os.environ[gotocache.STATS_ENV] = stats
+    os.environ['PATH'] = shimdir + os.pathsep + os.environ['PATH']
+    return stats
+
 def launch_build(opts):
     """Launch the build step"""
 
     install_cbmc(opts)
-    get_buckets(opts)
+    snapshot = get_buckets(opts)
+    stats = install_gotocache(opts) if opts['gotocache'] else None
     print("Launching Build")
-    cmd = ['make', 'goto']
+    # Compile translation units in parallel on the cores allotted
+    jobs = opts['build_vcpus'] or cgroup.cpus()
+    print("Building with {} jobs".format(jobs))
+    cmd = ['make', '-j', str(jobs), 'goto']
     run_command(cmd, 'build.txt', 'build-err.txt', 'build-ps.txt', opts)
+    if stats:
+        report = gotocache.summary(stats)
+        print(report)
+        with open(os.path.join(opts['wsdir'], 'build.txt'), 'a') as buildobj:
+            buildobj.write("\n{}\n".format(report))
     print("Finished Build")
-    put_buckets(opts)
+    put_buckets(opts, snapshot)
+
+def write_results_index(opts, runtime):
+    """Index the results in the CBMC output for consumers of the output"""
+
+    index = results.write_index(
+        os.path.join(opts['wsdir'], results.CBMC_OUTPUT),
+        os.path.join(opts['wsdir'], results.RESULTS_INDEX),
+        runtime)
+    print("Indexed CBMC output: {} ({} properties)"
+          .format(index['verdict'], len(index['properties'])))
+
+def trace_jobs(opts, count):
+    """The number of traces to generate at once: the number asked for
+    (default: one per core allotted), no more than the count of traces,
+    and no more than fit in the memory of the container at the peak
+    memory of the CBMC run checking the properties"""
+
+    jobs = min(opts['trace_jobs'] or cgroup.cpus(), count)
+    limit = cgroup.memory_limit()
+    # ru_maxrss is in kilobytes on Linux
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024.0
+    if limit and peak:
+        jobs = min(jobs, max(1, int(limit // peak)))
+    return jobs
+
+def run_trace(args):
+    """Run CBMC with --trace on a single property and return the trace"""
+
+    cmd, name, outfile, errfile = args
+    with open(outfile, "w") as outobj, open(errfile, "w") as errobj:
+        subprocess.call(cmd + ['--trace', '--property', name],
+                        universal_newlines=True,
+                        stdout=outobj, stderr=errobj)
+    return results.read_local_trace(outfile, name)
+
+def generate_traces(opts):
+    """Generate the traces for failing properties and splice them into
+    the CBMC output"""
+
+    cwd = os.getcwd()
+    os.chdir(opts['wsdir'])
+
+    failing = results.failing_properties(
+        results.index_output(results.CBMC_OUTPUT))
+    if not failing:
+        print("No failing properties: no traces to generate")
+        os.chdir(cwd)
+        return
+
+    cmd = ['cbmc', opts['goto']]
+    cmd += [opt
+            for opt in options.options_dict2words(opts['cbmcflags'])
+            if opt not in ['--trace', '--stop-on-fail']]
+    work = [(cmd, name,
+             'cbmc-trace-{}.txt'.format(num),
+             'cbmc-trace-{}-err.txt'.format(num))
+            for num, name in enumerate(failing)]
+
+    jobs = trace_jobs(opts, len(work))
+    print("Generating traces for {} failing properties with {} jobs"
+          .format(len(failing), jobs))
+    pool = ThreadPool(jobs)
+    try:
+        traces = pool.map(run_trace, work)
+    finally:
+        pool.close()
+        pool.join()
+
+    with open('cbmc-err.txt', 'a') as errobj:
+        for _, name, outfile, errfile in work:
+            with open(errfile) as traceerr:
+                errobj.write(traceerr.read())
+            os.remove(outfile)
+            os.remove(errfile)
+    missing = [name for name, trace in zip(failing, traces) if trace is None]
+    if missing:
+        print("Failed to generate traces: {}".format(', '.join(missing)))
+
+    results.splice_traces(results.CBMC_OUTPUT,
+                          [trace for trace in traces if trace is not None])
+    os.chdir(cwd)
+
+################################################################
+# Portfolio mode
+#
+# Proof runtime varies widely with the solver backend and CBMC flags
+# used.  A portfolio is a list of variants of the CBMC flags.  The
+# property phase races the variants on the cores of the container,
+# keeps the output of the first variant to reach a verdict, and
+# records the winner in the history of the proof.  Later runs use the
+# recorded winner by default.
+
+PORTFOLIO = 'portfolio'
+
+def property_command(opts, cbmcflags):
+    """The CBMC command checking properties with the given flags"""
+
+    cmd = ['cbmc', opts['goto']]
+    cmd += [opt
+            for opt in options.options_dict2words(cbmcflags)
+            if opt != '--trace']
+    if opts['property_mode'] == runoptions.PROPERTY_FULL:
+        cmd += ['--trace']
+    return cmd
+
+def portfolio_variants(opts):
+    """The CBMC flags for each variant in the portfolio, or for just
+    the winner of a past race"""
+
+    variants = []
+    for variant in opts['portfolio']:
+        cbmcflags = dict(opts['cbmcflags'] or {})
+        cbmcflags.update(variant)
+        variants.append(cbmcflags)
+    if len(variants) < 2 or opts['portfolio_race']:
+        return variants
+
+    record = history.read_record(opts['bucket'], opts['taskname'], PORTFOLIO,
+                                 region=opts['region'])
+    if (record and record.get('cbmcflags') == (opts['cbmcflags'] or {}) and
+            record.get('winner') in variants):
+        print("Using portfolio winner from {} run: {}"
+              .format(time.ctime(record['time']),
+                      ' '.join(options.options_dict2words(record['winner']))))
+        return [record['winner']]
+    return variants
+
+def conclusive(outfile):
+    """The CBMC output in a file reaches a verdict"""
+
+    status = results.index_output(outfile)['status']
+    return status in ['SUCCESSFUL', 'FAILED']
+
+def start_variants(opts, variants):
+    """Start a CBMC process for each variant in the race"""
+
+    runs = []
+    for num, cbmcflags in enumerate(variants):
+        cmd = property_command(opts, cbmcflags)
+        outfile = 'cbmc-portfolio-{}.txt'.format(num)
+        errfile = 'cbmc-portfolio-{}-err.txt'.format(num)
+        print("Racing variant {}: {}".format(num, ' '.join(cmd)))
+        with open(outfile, "w") as outobj, open(errfile, "w") as errobj:
+            popen = subprocess.Popen(cmd, universal_newlines=True,
+                                     stdout=outobj, stderr=errobj)
+        runs.append({'num': num, 'cbmcflags': cbmcflags, 'popen': popen,
+                     'outfile': outfile, 'errfile': errfile})
+    sys.stdout.flush()
+    return runs
+
+def await_winner(opts, runs, delay):
+    """Wait for the first variant to reach a verdict, kill the others,
+    and return the winner (or None if no variant reached a verdict)"""
+
+    checked = []
+    winner = None
+    while winner is None and len(checked) < len(runs):
+        for run in runs:
+            if run in checked or run['popen'].poll() is None:
+                continue
+            checked.append(run)
+            if conclusive(run['outfile']):
+                winner = run
+                break
+        else:
+            if opts['executor'] != executor.LOCAL:
+                checkpoint_performance('cbmc-ps.txt', opts['outbucket'],
+                                       opts['taskname'], opts['region'])
+            time.sleep(delay)
+
+    for run in runs:
+        if run['popen'].poll() is None:
+            run['popen'].kill()
+            run['popen'].wait()
+    return winner
+
+def race_portfolio(opts, variants, delay=10):
+    """Race the variants and return the flags of the winner"""
+
+    cwd = os.getcwd()
+    os.chdir(opts['wsdir'])
+
+    runs = start_variants(opts, variants)
+    start = time.time()
+    winner = await_winner(opts, runs, delay)
+    runtime = time.time() - start
+
+    if winner is None:
+        print("No variant in the portfolio reached a verdict")
+        winner = runs[0]
+    else:
+        print("Variant {} won the portfolio race in {:.1f}s"
+              .format(winner['num'], runtime))
+        history.write_record(opts['bucket'], opts['taskname'], PORTFOLIO, {
+            'cbmcflags': opts['cbmcflags'] or {},
+            'winner': winner['cbmcflags'],
+            'runtime': runtime,
+            'variants': variants
+        }, region=opts['region'])
+    sys.stdout.flush()
+
+    os.rename(winner['outfile'], 'cbmc.txt')
+    os.rename(winner['errfile'], 'cbmc-err.txt')
+    for run in runs:
+        if run is not winner:
+            os.remove(run['outfile'])
+            os.remove(run['errfile'])
+
+    os.chdir(cwd)
+    return winner['cbmcflags']
+
+################################################################
+# Incremental unwinding
+#
+# Harnesses often use a large --unwind bound to be safe.  Incremental
+# property mode checks the properties with unwinding assertions at an
+# increasing sequence of bounds up to the bound given.  If every
+# unwinding assertion holds at a bound, the program is completely
+# unwound and a larger bound gives the same results, so the check
+# stops at that bound, and the bound is recorded in the history of the
+# proof as the first bound tried by later runs.  The results reported
+# are those of the flags given at that bound, so unwinding assertions
+# appear in the results only if the flags given ask for them.  If any
+# other property fails at a bound, the failure is a real failure, but
+# other properties may fail only at larger bounds, so the properties
+# are checked again with exactly the flags given.
+
+UNWIND = 'unwind'
+UNWINDING_ASSERTIONS = '--unwinding-assertions'
+
+def unwind_bounds(start, limit):
+    """The increasing sequence of bounds from start up to limit"""
+
+    bounds = []
+    bound = max(1, min(start, limit))
+    while bound < limit:
+        bounds.append(bound)
+        bound *= 2
+    return bounds + [limit]
+
+def check_properties(opts, flags):
+    """Check properties with the flags"""
+
+    print("Checking properties with --unwind {}".format(flags['--unwind']))
+    cmd = property_command(opts, flags)
+    run_command(cmd, 'cbmc.txt', 'cbmc-err.txt', 'cbmc-ps.txt', opts)
+    sys.stdout.flush()
+
+def unwind_incrementally(opts):
+    """Check properties with increasing unwinding bounds and return the
+    flags used for the last check"""
+
+    cbmcflags = dict(opts['cbmcflags'] or {})
+    limit = cbmcflags.get('--unwind')
+    if not isinstance(limit, int):
+        print("No --unwind bound to increase: checking properties once")
+        cmd = property_command(opts, cbmcflags)
+        run_command(cmd, 'cbmc.txt', 'cbmc-err.txt', 'cbmc-ps.txt', opts)
+        return cbmcflags
+
+    start = opts['unwind_start']
+    record = history.read_record(opts['bucket'], opts['taskname'], UNWIND,
+                                 region=opts['region'])
+    if start is None and record and record.get('cbmcflags') == cbmcflags:
+        start = record['bound']
+        print("Starting at --unwind {} found by {} run"
+              .format(start, time.ctime(record['time'])))
+
+    for bound in unwind_bounds(start or 1, limit)[:-1]:
+        check_properties(opts, dict(cbmcflags, **{'--unwind': bound,
+                                                  UNWINDING_ASSERTIONS: None}))
+        index = results.index_output(
+            os.path.join(opts['wsdir'], results.CBMC_OUTPUT))
+        if index['status'] not in ['SUCCESSFUL', 'FAILED']:
+            print("No verdict with --unwind {}".format(bound))
+            continue
+        failing = results.failing_properties(index)
+        if [name for name in failing
+                if not results.is_unwinding_property(name)]:
+            print("Property failed with --unwind {}: checking all properties "
+                  "with --unwind {}".format(bound, limit))
+            break
+        if not failing:
+            print("Unwinding assertions hold with --unwind {}".format(bound))
+            history.write_record(opts['bucket'], opts['taskname'], UNWIND, {
+                'cbmcflags': cbmcflags,
+                'bound': bound
+            }, region=opts['region'])
+            flags = dict(cbmcflags, **{'--unwind': bound})
+            if UNWINDING_ASSERTIONS not in cbmcflags:
+                # Check again without the unwinding assertions added
+                check_properties(opts, flags)
+            return flags
+
+    # Check with exactly the flags given at the bound given
+    check_properties(opts, cbmcflags)
+    return cbmcflags
+
+################################################################
 
 def launch_property(opts):
     """Launch the property step"""
 
     install_cbmc(opts)
-    get_buckets(opts, copysrc=False)
+    snapshot = get_buckets(opts, copysrc=False)
     print("Launching Property")
 
-    cmd = ['cbmc', opts['goto']]
-    cmd += options.options_dict2words(opts['cbmcflags'])
-    cmd += ['--trace']
-    run_command(cmd, 'cbmc.txt', 'cbmc-err.txt', 'cbmc-ps.txt', opts)
+    variants = portfolio_variants(opts)
+    # The number of CBMC processes run at once, recorded by main with
+    # the resources used by the phase
+    opts['processes'] = max(1, len(variants))
+    start = time.time()
+    if len(variants) > 1:
+        opts = dict(opts, cbmcflags=race_portfolio(opts, variants))
+    else:
+        if variants:
+            opts = dict(opts, cbmcflags=variants[0])
+        if opts['property_mode'] == runoptions.PROPERTY_INCREMENTAL:
+            opts = dict(opts, cbmcflags=unwind_incrementally(opts))
+        else:
+            cmd = property_command(opts, opts['cbmcflags'])
+            run_command(cmd, 'cbmc.txt', 'cbmc-err.txt', 'cbmc-ps.txt', opts)
+    if opts['property_mode'] != runoptions.PROPERTY_FULL:
+        # The properties were checked without traces: generate traces
+        # only for the properties that fail
+        generate_traces(opts)
+    write_results_index(opts, time.time() - start)
 
     cmd = ['cbmc', opts['goto']]
     cmd += options.options_dict2words(opts['cbmcflags'])
@@ -204,13 +569,13 @@ def launch_property(opts):
                 opts)
 
     print("Finished Property")
-    put_buckets(opts)
+    put_buckets(opts, snapshot)
 
 def launch_coverage(opts):
     """Launch the coverage step"""
 
     install_cbmc(opts)
-    get_buckets(opts, copysrc=False)
+    snapshot = get_buckets(opts, copysrc=False)
     print("Launching Coverage")
 
     cmd = ['cbmc', opts['goto']]
@@ -225,14 +590,14 @@ def launch_coverage(opts):
                 opts)
 
     print("Finished Coverage")
-    put_buckets(opts)
+    put_buckets(opts, snapshot)
 
 def launch_report(opts):
     """Launch the report step"""
 
     install_cbmc(opts)
     install_viewer(opts)
-    get_buckets(opts)
+    snapshot = get_buckets(opts)
     print("Launching Report")
 
     cmd = ['cbmc-viewer',
@@ -248,7 +613,7 @@ def launch_report(opts):
     run_command(cmd, 'report.txt', 'report-err.txt', 'report-ps.txt', opts)
 
     print("Finished Report")
-    put_buckets(opts)
+    put_buckets(opts, snapshot, publish='html/')
 
     summary = None
     with open(os.path.join(opts['wsdir'], 'summary.json'), 'r') as j:
@@ -256,6 +621,8 @@ def launch_report(opts):
     if not summary.get('coverage'):
         print("Incomplete summary: " + str(summary))
         return
+    if opts['executor'] == executor.LOCAL:
+        return
 
     lines = summary['coverage']['statically-reachable']['lines']
     coverage = (
@@ -281,6 +648,192 @@ def launch_report(opts):
         ])
 
 
+################################################################
+# Bundles
+#
+# A bundle runs several proofs in one container.  Each proof runs in
+# its own subprocess and workspace under BUNDLE_DIR, one phase at a
+# time, and each phase is this script run with the options for the
+# proof.  See bundle.py.
+
+BUNDLE_DIR = 'bundle'
+
+def run_member(args):
+    """Run the phases of a proof in a bundle and return their status"""
+
+    opts, workdir = args
+    opts = bundle.reroot(opts, workdir)
+    os.makedirs(workdir)
+
+    phases = {}
+    for phase in sizing.PHASES:
+        if not opts[phase]:
+            continue
+        if [other for other in worker.upstream_phases(opts, phase)
+                if phases[other] != bundle.SUCCEEDED]:
+            phases[phase] = bundle.FAILED
+            continue
+
+        logfile = os.path.join(workdir, '{}-log.txt'.format(phase))
+        cmd = [sys.executable, os.path.abspath(__file__),
+               '--jsons', json.dumps(opts),
+               '--do' + phase,
+               '--jobname', '{}-{}'.format(opts['jobname'], phase)]
+        with open(logfile, 'w') as logobj:
+            code = subprocess.call(cmd, cwd=workdir, universal_newlines=True,
+                                   stdout=logobj, stderr=subprocess.STDOUT)
+        phases[phase] = bundle.SUCCEEDED if code == 0 else bundle.FAILED
+        print("Bundled {} phase of {}: {}"
+              .format(phase, opts['jobname'], phases[phase]))
+        sys.stdout.flush()
+        s3.copy_file_to_object(
+            logfile, '{}/{}'.format(opts['outbucket'],
+                                    os.path.basename(logfile)),
+            region=opts['region'])
+
+    bundle.write_done(opts, phases)
+    return phases
+
+def launch_bundle(opts):
+    """Launch the proofs in a bundle"""
+
+    install_cbmc(opts)
+    install_viewer(opts)
+    members = bundle.read_manifest(opts['bundle'], region=opts['region'])
+    work = [(dict(member, bundled=True),
+             os.path.abspath(os.path.join(BUNDLE_DIR, member['jobname'])))
+            for member in members]
+    if not work:
+        print("No proofs in bundle {}".format(opts['jobname']))
+        return
+
+    print("Launching {} proofs in bundle {}"
+          .format(len(work), opts['jobname']))
+    sys.stdout.flush()
+    pool = ThreadPool(len(work))
+    try:
+        statuses = pool.map(run_member, work)
+    finally:
+        pool.close()
+        pool.join()
+
+    for member, phases in zip(members, statuses):
+        print("  {}: {}".format(member['jobname'], ', '.join(
+            '{} {}'.format(phase, phases[phase])
+            for phase in sizing.PHASES if phase in phases)))
+    print("Finished Bundle")
+
+################################################################
+# Workers
+#
+# A worker runs phase tasks pulled from a queue with the launch
+# functions above until the queue has been idle for a while.  Each
+# task runs in a fresh workspace under WORKER_DIR.  See worker.py.
+
+WORKER_DIR = 'worker'
+
+def run_task(queue, message):
+    """Run the phase task in a message received from a queue"""
+
+    task = json.loads(message['body'])
+    phase = task['phase']
+    opts = task['opts']
+
+    upstream = [worker.read_marker(opts, other)
+                for other in worker.upstream_phases(opts, phase)]
+    if None in upstream:
+        print("Requeuing {} phase of {}: waiting for upstream phases"
+              .format(phase, opts['jobname']))
+        queue.send(message['body'], delay=worker.REQUEUE_DELAY)
+        queue.delete(message)
+        return
+    if [status for status in upstream if status != worker.SUCCEEDED]:
+        print("Skipping {} phase of {}: an upstream phase failed"
+              .format(phase, opts['jobname']))
+        worker.write_marker(opts, phase, worker.FAILED)
+        queue.delete(message)
+        return
+
+    workdir = os.path.abspath(os.path.join(WORKER_DIR, uuid.uuid4().hex))
+    # The packages are installed once by the worker, and the container
+    # is shared by the tasks the worker runs, as in a bundle
+    phase_opts = dict(opts, bundled=True, dobundle=False,
+                      jobname='{}-{}'.format(opts['jobname'], phase))
+    for other in sizing.PHASES:
+        phase_opts['do' + other] = other == phase
+    phase_opts = bundle.reroot(phase_opts, workdir)
+
+    # The resources used are not recorded for sizing: the usage of
+    # child processes accumulates over the life of the worker
+    print("Running {} phase of {}".format(phase, opts['jobname']))
+    sys.stdout.flush()
+    cwd = os.getcwd()
+    environ = dict(os.environ)
+    os.makedirs(workdir)
+    os.chdir(workdir)
+    status = worker.FAILED
+    try:
+        with worker.Heartbeat(queue, message):
+            LAUNCHERS[phase](phase_opts)
+        status = worker.SUCCEEDED
+    except Exception:  # pylint: disable=broad-except
+        traceback.print_exc()
+    finally:
+        os.chdir(cwd)
+        os.environ.clear()
+        os.environ.update(environ)
+        shutil.rmtree(workdir, ignore_errors=True)
+    print("Finished {} phase of {}: {}"
+          .format(phase, opts['jobname'], status))
+    sys.stdout.flush()
+
+    worker.write_marker(opts, phase, status)
+    if status == worker.SUCCEEDED:
+        for other in worker.followup_phases(opts, phase):
+            queue.send(worker.task_body(opts, other))
+    queue.delete(message)
+
+def launch_worker(opts):
+    """Run phase tasks from a queue until the queue is idle"""
+
+    install_cbmc(opts)
+    install_viewer(opts)
+    queue = worker.open_queue(opts['worker_queue'], opts['region'])
+
+    print("Worker pulling tasks from {}".format(opts['worker_queue']))
+    sys.stdout.flush()
+    count = 0
+    idle = time.time()
+    while time.time() - idle < opts['idle_timeout']:
+        message = queue.receive()
+        if message is None:
+            continue
+        run_task(queue, message)
+        count += 1
+        idle = time.time()
+    print("Worker ran {} tasks and was idle for {}s"
+          .format(count, opts['idle_timeout']))
+
+################################################################
+
+LAUNCHERS = {
+    'build': launch_build,
+    'property': launch_property,
+    'coverage': launch_coverage,
+    'report': launch_report
+}
+
+def record_usage(opts, start):
+    """Record the resources used by the phase for sizing later runs"""
+
+    # The container is shared by the proofs in a bundle
+    sample = sizing.usage(start, time.time(), container=not opts['bundled'],
+                          processes=opts.get('processes', 1))
+    print("Phase used {:.0f} MB peak memory, {:.0f} s, {:.1f} cores"
+          .format(sample['memory'], sample['duration'],
+                  sample['parallelism']))
+    sizing.record_usage(opts, phase_name(opts), sample)
+
 def main():
     """Run the job"""
 
@@ -292,33 +845,36 @@ def main():
         return count > 1
 
     opts = options.docker_options()
+    if opts['executor'] == executor.LOCAL:
+        # The source and workspace directories named in the options are
+        # the developer's own: run in copies under the job's workspace
+        opts = bundle.reroot(opts, os.getcwd())
 
     print("docker options")
     pprint(opts)
 
     if more_than_one([opts['dobuild'], opts['doproperty'],
-                      opts['docoverage'], opts['doreport']]):
+                      opts['docoverage'], opts['doreport'],
+                      opts['dobundle'], opts['doworker']]):
         print("Too many commands passed to docker container.")
         return
 
-    if opts['dobuild']:
-        print("docker doing build")
-        launch_build(opts)
-        return
-
-    if opts['doproperty']:
-        print("docker doing property")
-        launch_property(opts)
+    if opts['dobundle']:
+        print("docker doing bundle")
+        launch_bundle(opts)
         return
 
-    if opts['docoverage']:
-        print("docker doing coverage")
-        launch_coverage(opts)
+    if opts['doworker']:
+        print("docker doing worker")
+        launch_worker(opts)
         return
 
-    if opts['doreport']:
-        print("docker doing report")
-        launch_report(opts)
+    phase = phase_name(opts)
+    if phase in LAUNCHERS:
+        print("docker doing {}".format(phase))
+        start = time.time()
+        LAUNCHERS[phase](opts)
+        record_usage(opts, start)
         return
 
     print("docker done")
@@ -0,0 +1,362 @@
+#!/usr/bin/env python
+
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Executors running the phases of a CBMC job.
+
+An executor submits, inspects, and kills the jobs running the phases
+of a CBMC job.  The Batch executor is AWS Batch itself.  The local
+executor runs the phases as processes on the local machine with the
+same interface, so a developer can check a proof on a workstation
+without waiting on cloud queues.
+
+The local executor keeps its state in a directory: a JSON record for
+each job under jobs/, a log for each job under logs/, a workspace for
+each job under work/, and directories standing in for buckets under
+buckets/.  Submitting a job starts a runner process that waits for
+the jobs it depends on, waits for one of a fixed number of slots, and
+runs the phase with its memory limit and timeout.  The runner is this
+script.
+"""
+
+import argparse
+import errno
+import fcntl
+import json
+import os
+import re
+import resource
+import signal
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+from batch import Batch
+import cgroup
+
+################################################################
+
+class ExecutorException(Exception):
+    """Exception thrown by executor methods."""
+
+    def __init__(self, msg):
+        super(ExecutorException, self).__init__()
+        self.message = msg
+
+    def __str__(self):
+        return self.message
+
+    def __repr__(self):
+        return self.message
+
+def abort(msg):
+    """Abort an executor method."""
+    raise ExecutorException(msg)
+
+################################################################
+
+BATCH = 'batch'
+LOCAL = 'local'
+EXECUTORS = [BATCH, LOCAL]
+
+DEFAULT_LOCAL_DIR = os.path.join('~', '.cbmc-batch')
+
+# Executors made, shared by the callers launching many jobs
+MADE = {}
+MADE_LOCK = threading.Lock()
+
+def make_executor(opts, session=None):
+    """The executor for the jobs described by the options.
+
+    Making a Batch executor checks that the job definition and job
+    queue exist, so an executor is made once for each job definition
+    and job queue and shared by every job launched with them.  The
+    Batch client is made with the boto3 session, if given.
+    """
+
+    key = (opts['executor'], opts.get('local_dir'), opts.get('local_slots'),
+           opts.get('jobdef'), opts['jobqueue'], opts['region'])
+    with MADE_LOCK:
+        if key not in MADE:
+            if opts['executor'] == LOCAL:
+                MADE[key] = LocalExecutor(opts['local_dir'],
+                                          opts['local_slots'])
+            else:
+                client = session and session.client(
+                    'batch', region_name=opts['region'])
+                MADE[key] = Batch(jobname=opts.get('jobdef'),
+                                  queuename=opts['jobqueue'],
+                                  region=opts['region'], client=client)
+        return MADE[key]
+
+def local_buckets(local_dir):
+    """The directory standing in for buckets in a local executor."""
+
+    return os.path.join(local_dir, 'buckets')
+
+################################################################
+# The local executor
+
+SUBMITTED = 'SUBMITTED'
+PENDING = 'PENDING'
+RUNNABLE = 'RUNNABLE'
+RUNNING = 'RUNNING'
+SUCCEEDED = 'SUCCEEDED'
+FAILED = 'FAILED'
+FINISHED = [SUCCEEDED, FAILED]
+
+POLL_INTERVAL = 1
+
+class LocalExecutor:
+    """Run the phases of CBMC jobs as processes on the local machine."""
+
+    def __init__(self, root=None, slots=None):
+        self.root = os.path.abspath(os.path.expanduser(root or
+                                                       DEFAULT_LOCAL_DIR))
+        self.slots = slots or cgroup.cpus()
+        for name in ['jobs', 'logs', 'work', 'slots']:
+            path = os.path.join(self.root, name)
+            if not os.path.isdir(path):
+                os.makedirs(path)
+
+    def path(self, name, jobid, suffix=''):
+        """The path to the job file of a kind under the state directory."""
+        return os.path.join(self.root, name, jobid + suffix)
+
+    def read_job(self, jobid):
+        """The record of a job."""
+        with open(self.path('jobs', jobid, '.json')) as fileobj:
+            return json.load(fileobj)
+
+    def write_job(self, job):
+        """Write the record of a job."""
+        path = self.path('jobs', job['jobId'], '.json')
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as fileobj:
+            json.dump(job, fileobj, indent=2, sort_keys=True)
+        os.rename(tmp, path)
+
+    def update_job(self, jobid, status, reason=None, **fields):
+        """Update the status of a job unless it has already finished."""
+        job = self.read_job(jobid)
+        if job['status'] in FINISHED:
+            return job
+        job.update(fields)
+        job['status'] = status
+        if reason:
+            job['statusReason'] = reason
+        if status in FINISHED:
+            job['stoppedAt'] = time.time()
+        self.write_job(job)
+        return job
+
+    def jobs(self):
+        """The records of all jobs."""
+        jobdir = os.path.join(self.root, 'jobs')
+        return [self.read_job(name[:-len('.json')])
+                for name in sorted(os.listdir(jobdir))
+                if name.endswith('.json')]
+
+    def submit_job(self, jobname=None, jobqueue=None, jobdefinition=None,
+                   command=None, memory=None, vcpus=None, timeout=None,
+                   dependson=None):
+        """Run the job given by command on the local machine."""
+
+        # pylint: disable=too-many-arguments,unused-argument
+
+        jobid = uuid.uuid4().hex
+        jobname = jobname or "cbmc"
+        self.write_job({
+            'jobId': jobid,
+            'jobName': jobname,
+            'status': SUBMITTED,
+            'command': command or [],
+            'memory': memory,
+            'vcpus': vcpus,
+            'timeout': timeout,
+            'dependsOn': dependson or [],
+            'createdAt': time.time()
+        })
+
+        with open(self.path('logs', jobid, '.txt'), 'w') as logobj:
+            # The runner leads a process group of its own so killing
+            # the job kills the phase too.  start_new_session is not in
+            # Python 2, and the runner is started before any threads.
+            # pylint: disable=subprocess-popen-preexec-fn
+            subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                              '--root', self.root,
+                              '--slots', str(self.slots), jobid],
+                             stdout=logobj, stderr=subprocess.STDOUT,
+                             close_fds=True, preexec_fn=os.setsid)
+        return {'jobid': jobid, 'jobname': jobname}
+
+    def job_status(self, jobid=None, jobname=None):
+        """Get the job status of every job matching a job id or job name."""
+
+        return [{'jobId': job['jobId'],
+                 'jobName': job['jobName'],
+                 'status': job['status']}
+                for job in self.jobs()
+                if (jobid and re.search(jobid, job['jobId']) or
+                    jobname and re.search(jobname, job['jobName']))]
+
+    def kill_job(self, jobid=None, jobname=None):
+        """Kill every job matching a job id or job name."""
+
+        for job in self.job_status(jobid, jobname):
+            if job['status'] in FINISHED:
+                continue
+            job = self.update_job(job['jobId'], FAILED,
+                                  'Terminated by cbmc-batch command line')
+            if job.get('pid'):
+                try:
+                    os.killpg(job['pid'], signal.SIGTERM)
+                except OSError as exc:
+                    if exc.errno != errno.ESRCH:
+                        raise
+
+    ################################################################
+    # The runner
+    #
+    # The phase runs in a session of its own, so the processes it starts
+    # (make, goto-cc, cbmc) can be killed together with it when the job
+    # times out or is killed, before the slot of the job is released.
+
+    def wait_for_dependencies(self, job):
+        """Wait for the jobs a job depends on and return True if they
+        all succeeded."""
+
+        self.update_job(job['jobId'], PENDING)
+        while True:
+            statuses = [self.read_job(jobid)['status']
+                        for jobid in job['dependsOn']]
+            if FAILED in statuses:
+                return False
+            if all(status == SUCCEEDED for status in statuses):
+                return True
+            time.sleep(POLL_INTERVAL)
+
+    def acquire_slot(self, job):
+        """Wait for a free slot and return the open slot file locking it."""
+
+        self.update_job(job['jobId'], RUNNABLE)
+        while True:
+            for num in range(self.slots):
+                slot = open(os.path.join(self.root, 'slots', str(num)), 'w')
+                try:
+                    fcntl.flock(slot, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return slot
+                except IOError:
+                    slot.close()
+            time.sleep(POLL_INTERVAL)
+
+    def run(self, jobid):
+        """Run a job once its dependencies succeed and a slot is free."""
+
+        job = self.read_job(jobid)
+        self.update_job(jobid, job['status'], pid=os.getpid())
+        if not self.wait_for_dependencies(job):
+            self.update_job(jobid, FAILED, 'Dependent Job failed')
+            return
+
+        slot = self.acquire_slot(job)
+        try:
+            workdir = self.path('work', jobid)
+            if not os.path.isdir(workdir):
+                os.makedirs(workdir)
+            job = self.update_job(jobid, RUNNING, startedAt=time.time())
+            if job['status'] != RUNNING:
+                return
+
+            cmd = self.phase_command(job)
+            print("Running {}: {}".format(job['jobName'], ' '.join(cmd)))
+            sys.stdout.flush()
+
+            phases = []
+            def terminate(signum, _frame):
+                """Kill the phase when the job is killed (see kill_job)."""
+                for phase in phases:
+                    kill_group(phase.pid)
+                sys.exit(128 + signum)
+            signal.signal(signal.SIGTERM, terminate)
+
+            # start_new_session is not in Python 2
+            # pylint: disable=subprocess-popen-preexec-fn
+            popen = subprocess.Popen(cmd, cwd=workdir,
+                                     preexec_fn=phase_setup(job['memory']))
+            phases.append(popen)
+            start = time.time()
+            while popen.poll() is None:
+                if job['timeout'] and time.time() - start > job['timeout']:
+                    kill_group(popen.pid)
+                    popen.wait()
+                    self.update_job(jobid, FAILED,
+                                    'Job attempt duration exceeded timeout')
+                    return
+                time.sleep(POLL_INTERVAL)
+        finally:
+            slot.close()
+
+        if popen.returncode == 0:
+            self.update_job(jobid, SUCCEEDED, exitCode=0)
+        else:
+            self.update_job(jobid, FAILED,
+                            'Essential container in task exited',
+                            exitCode=popen.returncode)
+
+    @staticmethod
+    def phase_command(job):
+        """The command running the phase of a job."""
+
+        return [sys.executable,
+                os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'docker.py')] + job['command']
+
+def phase_setup(memory):
+    """A function starting a phase process in a session of its own and
+    setting its memory limit (MB)."""
+
+    def set_limits():
+        """Lead a new session and limit the address space of the process."""
+        os.setsid()
+        if memory:
+            size = int(memory) * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (size, size))
+    return set_limits
+
+def kill_group(pid):
+    """Kill the process group led by a process."""
+
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except OSError as exc:
+        if exc.errno != errno.ESRCH:
+            raise
+
+################################################################
+
+def main():
+    """Run a job submitted to a local executor."""
+
+    parser = argparse.ArgumentParser(
+        description='Run a job submitted to a local executor')
+    parser.add_argument('--root', metavar='DIR', required=True,
+                        help='State directory of the local executor')
+    parser.add_argument('--slots', metavar='N', type=int,
+                        help='Number of jobs to run at once')
+    parser.add_argument('jobid', help='Job to run')
+    args = parser.parse_args()
+
+    local = LocalExecutor(args.root, args.slots)
+    try:
+        local.run(args.jobid)
+    except Exception:
+        local.update_job(args.jobid, FAILED, 'Local executor failed')
+        raise
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+A cache of object files built by goto-cc.
+
+The build phase puts a goto-cc shim on the search path that runs this
+script in place of goto-cc.  A compilation of a single source file
+into an object file is looked up in the cache by a key that hashes the
+preprocessed source, the compiler flags, the working directory, and
+the goto-cc version.  The cache has two tiers: a local directory
+(usually a directory on the host shared by containers) and a bucket
+shared by all builds.  Every other invocation of goto-cc is passed
+through to goto-cc unchanged.
+
+The shim is configured with environment variables giving the real
+goto-cc, the cache directory and bucket, and a file to which each
+lookup is logged for the hit rate reported at the end of the build.
+"""
+
+import hashlib
+import os
+import subprocess
+import sys
+import tempfile
+
+import boto3
+from botocore.exceptions import ClientError
+
+import s3
+
+################################################################
+
+REAL_ENV = 'GOTOCACHE_GOTO_CC'
+VERSION_ENV = 'GOTOCACHE_VERSION'
+DIRECTORY_ENV = 'GOTOCACHE_DIR'
+BUCKET_ENV = 'GOTOCACHE_BUCKET'
+STATS_ENV = 'GOTOCACHE_STATS'
+
+HIT_LOCAL = 'hit-local'
+HIT_REMOTE = 'hit-remote'
+MISS = 'miss'
+UNCACHEABLE = 'uncacheable'
+
+SOURCE_SUFFIXES = ('.c', '.i')
+
+# Compiler options whose argument is the next word on the command line
+ARGUMENT_OPTIONS = ['-o', '-I', '-D', '-U', '-include', '-imacros',
+                    '-isystem', '-iquote', '-x', '-MF', '-MT', '-MQ',
+                    '--function', '--native-compiler', '--native-linker']
+
+# Compiler options producing output other than the object file
+UNCACHEABLE_OPTIONS = ['-E', '-S', '-M', '-MM', '-MD', '-MMD', '-MF',
+                       '--export-function-local-symbols']
+
+################################################################
+
+def compilation(args):
+    """The source and object file of a cacheable compilation, or None."""
+
+    if '-c' not in args:
+        return None
+    if [arg for arg in args if arg in UNCACHEABLE_OPTIONS]:
+        return None
+
+    sources = []
+    output = None
+    previous = None
+    for arg in args:
+        if previous == '-o':
+            output = arg
+        elif previous not in ARGUMENT_OPTIONS and not arg.startswith('-'):
+            sources.append(arg)
+        previous = arg
+
+    if output is None or len(sources) != 1:
+        return None
+    if not sources[0].endswith(SOURCE_SUFFIXES):
+        return None
+    return sources[0], output
+
+def without_output(args):
+    """The compiler arguments without -c and -o and its argument."""
+
+    words = []
+    skip = False
+    for arg in args:
+        if skip:
+            skip = False
+        elif arg == '-o':
+            skip = True
+        elif arg != '-c':
+            words.append(arg)
+    return words
+
+def cache_key(gotocc, args):
+    """The key for a compilation: a hash of its preprocessed source,
+    flags, working directory, and compiler version."""
+
+    args = without_output(args)
+    preprocessed = subprocess.check_output([gotocc, '-E'] + args)
+    version = os.environ.get(VERSION_ENV)
+    if version is None:
+        version = subprocess.check_output([gotocc, '--version']).decode()
+
+    digest = hashlib.sha256()
+    for word in [version, os.getcwd()] + args:
+        digest.update(word.encode('utf-8'))
+        digest.update(b'\0')
+    digest.update(preprocessed)
+    return digest.hexdigest()
+
+################################################################
+# The cache tiers
+
+def local_path(key):
+    """The path to an object file in the local cache."""
+
+    return os.path.join(os.environ[DIRECTORY_ENV], key[:2], key)
+
+def fetch_local(key, output):
+    """Copy an object file from the local cache, if present."""
+
+    if not os.environ.get(DIRECTORY_ENV):
+        return False
+    path = local_path(key)
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as src, open(output, 'wb') as dst:
+        dst.write(src.read())
+    return True
+
+def store_local(key, output):
+    """Copy an object file into the local cache."""
+
+    if not os.environ.get(DIRECTORY_ENV):
+        return
+    path = local_path(key)
+    directory = os.path.dirname(path)
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # Rename into place so concurrent builds never see a partial file
+        handle, tmp = tempfile.mkstemp(dir=directory)
+        with os.fdopen(handle, 'wb') as dst, open(output, 'rb') as src:
+            dst.write(src.read())
+        os.rename(tmp, path)
+    except (IOError, OSError) as exc:
+        sys.stderr.write("goto-cc cache: can't store {}: {}\n"
+                         .format(path, exc))
+
+def remote_path(key):
+    """The S3 path to an object file in the shared cache."""
+
+    return "{}/{}/{}".format(os.environ[BUCKET_ENV].rstrip('/'), key[:2], key)
+
+def fetch_remote(key, output):
+    """Copy an object file from the shared cache, if present."""
+
+    if not os.environ.get(BUCKET_ENV):
+        return False
+    path = remote_path(key)
+    try:
+        boto3.client('s3').download_file(s3.bucket_name(path),
+                                         s3.key_name(path), output)
+    except ClientError:
+        return False
+    return True
+
+def store_remote(key, output):
+    """Copy an object file into the shared cache."""
+
+    if not os.environ.get(BUCKET_ENV):
+        return
+    path = remote_path(key)
+    try:
+        boto3.client('s3').upload_file(output, s3.bucket_name(path),
+                                       s3.key_name(path))
+    except ClientError as exc:
+        sys.stderr.write("goto-cc cache: can't store {}: {}\n"
+                         .format(path, exc))
+
+################################################################
+# Hit rates
+
+def record(event, source):
+    """Log a cache lookup to the statistics file."""
+
+    stats = os.environ.get(STATS_ENV)
+    if stats:
+        with open(stats, 'a') as fileobj:
+            fileobj.write("{} {}\n".format(event, source))
+
+def summary(stats):
+    """A one-line summary of the cache lookups logged to a file."""
+
+    counts = {HIT_LOCAL: 0, HIT_REMOTE: 0, MISS: 0, UNCACHEABLE: 0}
+    try:
+        with open(stats) as fileobj:
+            for line in fileobj:
+                event = line.split()[0]
+                counts[event] = counts.get(event, 0) + 1
+    except (IOError, OSError):
+        pass
+
+    hits = counts[HIT_LOCAL] + counts[HIT_REMOTE]
+    lookups = hits + counts[MISS]
+    rate = 100.0 * hits / lookups if lookups else 0.0
+    return ("goto-cc cache: {} compilations, {} hits ({} local, {} remote), "
+            "{} misses, {} uncacheable ({:.0f}% hit rate)"
+            .format(lookups, hits, counts[HIT_LOCAL], counts[HIT_REMOTE],
+                    counts[MISS], counts[UNCACHEABLE], rate))
+
+################################################################
+
+def main():
+    """Run goto-cc, using the cache for compilations of a source file."""
+
+    gotocc = os.environ[REAL_ENV]
+    args = sys.argv[1:]
+
+    found = compilation(args)
+    if found is None:
+        record(UNCACHEABLE, '-')
+        os.execv(gotocc, [gotocc] + args)
+    source, output = found
+
+    try:
+        key = cache_key(gotocc, args)
+    except subprocess.CalledProcessError:
+        # Let goto-cc itself report the error
+        record(UNCACHEABLE, source)
+        os.execv(gotocc, [gotocc] + args)
+
+    if fetch_local(key, output):
+        record(HIT_LOCAL, source)
+        return 0
+    if fetch_remote(key, output):
+        store_local(key, output)
+        record(HIT_REMOTE, source)
+        return 0
+
+    code = subprocess.call([gotocc] + args)
+    if code == 0 and os.path.isfile(output):
+        store_local(key, output)
+        store_remote(key, output)
+    record(MISS, source)
+    return code
+
+if __name__ == "__main__":
+    sys.exit(main())
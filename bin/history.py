@@ -0,0 +1,113 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+A history of past runs of each proof kept in a bucket.
+
+The history of a proof is a set of small JSON records stored as
+objects {bucket}/history/{taskname}/{name}.json, one object per kind
+of record.  For jobs run by the local executor, the bucket is a local
+directory and the records are files.  Keeping each kind of record in
+its own object lets phases running concurrently update the history
+without overwriting each other's records.  The history is advisory: a record that can't be
+read or written is reported and otherwise ignored.
+"""
+
+import json
+import os
+import sys
+import time
+
+import boto3
+from botocore.exceptions import ClientError
+
+import clienterror
+import s3
+
+################################################################
+
+HISTORY_PREFIX = 'history'
+RECORD_SUFFIX = '.json'
+
+def record_path(bucket, taskname, name):
+    """The S3 path to a record in the history of a proof."""
+
+    return "{}/{}/{}/{}{}".format(bucket.rstrip('/'), HISTORY_PREFIX,
+                                  taskname, name, RECORD_SUFFIX)
+
+def read_record(bucket, taskname, name, client=None, region=None):
+    """Read a record in the history of a proof, or None if there is none."""
+
+    path = record_path(bucket, taskname, name)
+    if not s3.is_path(bucket):
+        return read_local_record(path)
+
+    if client is None:
+        client = boto3.client('s3', region_name=region)
+
+    try:
+        response = client.get_object(Bucket=s3.bucket_name(path),
+                                     Key=s3.key_name(path))
+        return json.loads(response['Body'].read().decode('utf-8'))
+    except ClientError as exc:
+        if clienterror.code(exc) not in ['NoSuchKey', 'NoSuchBucket']:
+            print("Failed to read history {}: {}"
+                  .format(path, clienterror.message(exc)))
+            sys.stdout.flush()
+        return None
+    except ValueError:
+        print("Ignoring malformed history {}".format(path))
+        sys.stdout.flush()
+        return None
+
+def write_record(bucket, taskname, name, record, client=None, region=None):
+    """Write a record in the history of a proof."""
+    # pylint: disable=too-many-arguments
+
+    path = record_path(bucket, taskname, name)
+    record = dict(record, time=int(time.time()))
+    if not s3.is_path(bucket):
+        write_local_record(path, record)
+        return
+
+    if client is None:
+        client = boto3.client('s3', region_name=region)
+
+    try:
+        client.put_object(Bucket=s3.bucket_name(path), Key=s3.key_name(path),
+                          Body=json.dumps(record, indent=2, sort_keys=True),
+                          ContentType='application/json')
+    except ClientError as exc:
+        print("Failed to write history {}: {}"
+              .format(path, clienterror.message(exc)))
+        sys.stdout.flush()
+
+################################################################
+# Histories kept in a local directory
+
+def read_local_record(path):
+    """Read a record from a local file, or None if there is none."""
+
+    try:
+        with open(path) as fileobj:
+            return json.load(fileobj)
+    except (IOError, OSError):
+        return None
+    except ValueError:
+        print("Ignoring malformed history {}".format(path))
+        sys.stdout.flush()
+        return None
+
+def write_local_record(path, record):
+    """Write a record to a local file."""
+
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fileobj:
+            json.dump(record, fileobj, indent=2, sort_keys=True)
+    except (IOError, OSError) as exc:
+        print("Failed to write history {}: {}".format(path, exc))
+        sys.stdout.flush()
+
+################################################################
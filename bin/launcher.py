@@ -0,0 +1,141 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Launch CBMC jobs from within a Python process.
+
+The cbmc-batch script parses its command line, checks that the
+buckets, packages, job definition, and job queue exist, copies the
+input directories to the buckets, and submits the jobs.  A launcher
+does the same for many jobs at once.  It is made once with the
+options common to the jobs and a boto3 session, and then launches
+each job from a dict of the options for the job (as in a
+configuration file).  Each bucket, package, job definition, and job
+queue is checked once, by the first job using it, and the clients
+are made once and shared by the jobs.  A launcher can launch jobs
+from several threads at once.
+"""
+
+import threading
+
+import boto3
+
+from cbmc import CBMC
+import executor
+import options
+import s3
+import store
+
+################################################################
+
+class LauncherException(Exception):
+    """Exception thrown by launcher methods."""
+
+    def __init__(self, msg):
+        super(LauncherException, self).__init__()
+        self.message = msg
+
+    def __str__(self):
+        return self.message
+
+    def __repr__(self):
+        return self.message
+
+def abort(msg):
+    """Abort a launcher method."""
+    raise LauncherException(msg)
+
+################################################################
+# Input directories
+
+def copy_paths(opts, quiet=True):
+    """Copy the input directories to their buckets."""
+
+    # We mark CBMC metadata flag as true so that Cloudfront will know to
+    # make those files publicly accessible
+    artifacts = store.make_store(opts)
+    if opts['copysrc']:
+        artifacts.put_directory(opts, opts['srcdir'], opts['srcbucket'],
+                                'source', quiet)
+    if opts['copyws']:
+        artifacts.put_directory(opts, opts['wsdir'], opts['wsbucket'],
+                                'workspace', quiet)
+    if opts['copyout']:
+        artifacts.put_directory(opts, opts['outdir'], opts['outbucket'],
+                                'output', quiet)
+
+################################################################
+
+class Launcher:
+    """Launch CBMC jobs sharing their common options and clients"""
+
+    def __init__(self, common=None, session=None):
+        """Make a launcher for jobs with the common options.
+
+        The common options take precedence over the options for a job,
+        as command line options take precedence over a configuration
+        file.
+        """
+
+        self.common = options.cleanup_config(common or {})
+        self.session = session or boto3.session.Session()
+        self.args = options.batch_parser().parse_args([])
+        self.lock = threading.Lock()
+        self.s3 = self.session.client('s3',
+                                      region_name=self.common.get('region'))
+        # The S3 paths known to exist
+        self.checked = set()
+
+    def options(self, config):
+        """The options for the job given by a dict of options"""
+
+        config = dict(options.cleanup_config(config), **self.common)
+        opts = options.batch_merge(self.args, config, validate=False)
+        self.validate(opts)
+        return opts
+
+    def check(self, path):
+        """Check that an S3 bucket or object exists, once"""
+
+        with self.lock:
+            if path in self.checked:
+                return
+            if not s3.path_exists(path, client=self.s3):
+                abort("S3 path does not exist: {}".format(path))
+            self.checked.add(path)
+
+    def validate(self, opts):
+        """Check that the buckets, packages, job definition, and job
+        queue used by a job exist"""
+
+        if opts['executor'] == executor.LOCAL:
+            return
+        for path in [opts['srcbucket'], opts['wsbucket'], opts['outbucket'],
+                     opts['pkgbucket']]:
+            self.check(s3.bucket_name(path))
+        for name in ['cbmcpkg', 'batchpkg', 'viewerpkg']:
+            self.check('{}/{}'.format(opts['pkgbucket'], opts[name]))
+        if not opts['bundled']:
+            # Making the executor checks the job definition and job
+            # queue, once for all the jobs using them
+            executor.make_executor(opts, self.session)
+
+    def launch(self, config):
+        """Launch the job given by a dict of options and return the job
+        options, with the names and ids of the jobs submitted under
+        'tasks'.
+
+        A job to run in a bundle is only prepared: its input
+        directories are copied, and no jobs are submitted.
+        """
+
+        opts = self.options(config)
+        copy_paths(opts)
+        if opts['bundled']:
+            return opts
+
+        batch = executor.make_executor(opts, self.session)
+        opts['tasks'] = CBMC(opts, batch=batch).submit_jobs()
+        return opts
+
+################################################################
@@ -14,7 +14,10 @@ import yaml
 
 import boto3
 
+import executor
+import runoptions
 import s3
+import store
 
 ################################################################
 
@@ -25,8 +28,20 @@ def abort(msg):
 ################################################################
 # The main methods of this module
 
-def batch_options():
-    """Parse options for cbmc-batch"""
+def batch_options(argv=None, validate=True):
+    """Parse options for cbmc-batch from argv (default: sys.argv).
+
+    Checking that the buckets and packages exist takes several S3
+    requests, and a caller launching many jobs with the same buckets
+    and packages can check them once and then skip the checks.
+    """
+
+    args = batch_parser().parse_args(argv)
+    config = parse_config(args)
+    return batch_merge(args, config, validate)
+
+def batch_parser():
+    """The parser for cbmc-batch options"""
 
     parser = argparse.ArgumentParser(description='Run CBMC on AWS Batch')
     parser = directory_parser(parser)
@@ -36,18 +51,21 @@ def batch_options():
     parser = cbmcflags_parser(parser)
     parser = build_parser(parser)
     parser = aws_batch_parser(parser)
+    parser = runoptions.executor_parser(parser)
     parser = other_parser(parser)
     parser = config_parser(parser)
+    return parser
 
-    args = parser.parse_args()
-    config = parse_config(args)
+def batch_merge(args, config, validate=True):
+    """Merge cbmc-batch options from parsed arguments and a config"""
 
     opts = {}
-    # Do aws_batch before bucket
+    # Do aws_batch and executor before bucket
     opts = aws_batch_merge(opts, args, config)
+    opts = runoptions.executor_merge(opts, args, config)
     opts = directory_merge(opts, args, config)
-    opts = bucket_merge(opts, args, config)
-    opts = package_merge(opts, args, config)
+    opts = bucket_merge(opts, args, config, validate)
+    opts = package_merge(opts, args, config, validate)
     opts = phase_merge(opts, args, config)
     opts = cbmcflags_merge(opts, args, config)
     opts = build_merge(opts, args, config)
@@ -62,6 +80,7 @@ def status_options():
                                      'running on AWS Batch.')
     parser = cbmc_status_parser(parser)
     parser = region_parser(parser)
+    parser = runoptions.executor_parser(parser)
     parser = config_parser(parser)
 
     args = parser.parse_args()
@@ -70,6 +89,7 @@ def status_options():
     opts = {}
     opts = region_merge(opts, args, config)
     opts = cbmc_status_merge(opts, args, config)
+    opts = runoptions.executor_merge(opts, args, config)
 
     return opts
 
@@ -80,6 +100,7 @@ def kill_options():
                                      'running on AWS Batch.')
     parser = cbmc_status_parser(parser)
     parser = region_parser(parser)
+    parser = runoptions.executor_parser(parser)
     parser = config_parser(parser)
 
     args = parser.parse_args()
@@ -88,11 +109,32 @@ def kill_options():
     opts = {}
     opts = region_merge(opts, args, config)
     opts = cbmc_status_merge(opts, args, config)
+    opts = runoptions.executor_merge(opts, args, config)
+
+    return opts
+
+def autotune_options():
+    """Parse options for cbmc-autotune"""
+
+    parser = argparse.ArgumentParser(description='Search for the CBMC flags '
+                                     'that check a proof fastest')
+    parser = cbmcflags_parser(parser)
+    parser = runoptions.autotune_parser(parser)
+    parser = config_parser(parser)
+
+    args = parser.parse_args()
+    config = parse_config(args)
+
+    opts = {}
+    opts = cbmcflags_merge(opts, args, config)
+    opts = runoptions.autotune_merge(opts, args, config)
+    opts['yaml'] = args.yaml
 
     return opts
 
-def docker_options():
-    """Parse options for docker script driving the docker container"""
+def docker_options(argv=None):
+    """Parse options for docker script driving the docker container from
+    argv (default: sys.argv)"""
 
     parser = argparse.ArgumentParser(description='Run CBMC in a container')
     parser = directory_parser(parser)
@@ -101,15 +143,17 @@ def docker_options():
     parser = cbmcflags_parser(parser)
     parser = build_parser(parser)
     parser = aws_batch_parser(parser)
+    parser = runoptions.executor_parser(parser)
     parser = container_parser(parser)
     parser = config_parser(parser)
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     config = parse_config(args)
 
     opts = {}
-    # Do aws_batch before bucket
+    # Do aws_batch and executor before bucket
     opts = aws_batch_merge(opts, args, config)
+    opts = runoptions.executor_merge(opts, args, config)
     opts = directory_merge(opts, args, config)
     opts = bucket_merge(opts, args, config)
     opts = package_merge(opts, args, config)
@@ -188,10 +232,56 @@ def bucket_parser(parser):
                         help='S3 path to bucket for output directory')
     parser.add_argument('--srctarfile', metavar="OBJ",
                         help='S3 path to tar file for source directory')
+    parser.add_argument('--packed', dest='packed', default=None,
+                        action="store_true",
+                        help='Copy directories to and from buckets as packs')
+    parser.add_argument('--no-packed', dest='packed', default=None,
+                        action="store_false",
+                        help="Copy directories to and from buckets file by file")
+    parser.add_argument('--compress', dest='compress', default=None,
+                        action="store_true",
+                        help='Compress large artifacts copied to buckets')
+    parser.add_argument('--no-compress', dest='compress', default=None,
+                        action="store_false",
+                        help="Don't compress large artifacts copied to buckets")
+    parser.add_argument('--artifact-store', choices=store.STORES,
+                        dest='artifact_store',
+                        help='Hand artifacts between phases through S3, a '
+                        'directory on a shared filesystem, or memory '
+                        '(default: s3, or posix with the local executor)')
+    parser.add_argument('--artifact-root', metavar='DIR',
+                        dest='artifact_root',
+                        help='Directory on a shared filesystem keeping '
+                        'the buckets for the posix artifact store')
     return parser
 
-def bucket_merge(opts, args, config):
-    """Merge options giving S3 bucket and object names"""
+def artifact_store_merge(opts, args, config):
+    """Merge options choosing the artifact store"""
+
+    default = store.S3
+    if opts['executor'] == executor.LOCAL:
+        default = store.POSIX
+    opts['artifact_store'] = merge(args.artifact_store,
+                                   config.get('artifact_store'), default)
+    opts['artifact_root'] = merge(args.artifact_root,
+                                  config.get('artifact_root'), None)
+
+    if (opts['executor'] == executor.LOCAL and
+            opts['artifact_store'] == store.S3):
+        abort("The local executor keeps buckets in directories: "
+              "use the posix or memory artifact store")
+    if (opts['artifact_store'] == store.POSIX and
+            opts['executor'] != executor.LOCAL and not opts['artifact_root']):
+        abort("The posix artifact store needs an artifact root")
+    return opts
+
+def bucket_merge(opts, args, config, validate=True):
+    """Merge options giving S3 bucket and object names, and check that
+    the buckets exist if validate is True"""
+
+    opts = artifact_store_merge(opts, args, config)
+    if opts['executor'] == executor.LOCAL:
+        return local_bucket_merge(opts, args, config)
 
     opts['bucket'] = args.bucket or config.get('bucket', None) or 'cbmc'
     opts['srcbucket'] = (args.srcbucket or config.get('srcbucket', None) or
@@ -201,6 +291,8 @@ def bucket_merge(opts, args, config):
     opts['outbucket'] = (args.outbucket or config.get('outbucket', None) or
                          "{}/{}/out".format(opts['bucket'], opts['jobname']))
     opts['srctarfile'] = args.srctarfile or config.get('srctarfile', None)
+    opts['packed'] = merge(args.packed, config.get('packed', None), False)
+    opts['compress'] = merge(args.compress, config.get('compress', None), False)
 
     if not s3.is_path(opts['srcbucket']):
         abort("Not a valid S3 bucket or object: {}"
@@ -212,15 +304,10 @@ def bucket_merge(opts, args, config):
         abort("Not a valid S3 bucket or object: {}"
               .format(opts['outbucket']))
 
-    bkt = s3.bucket_name(opts['srcbucket'])
-    if not s3.bucket_exists(bkt, region=opts['region']):
-        abort("Bucket does not exist: {}".format(bkt))
-    bkt = s3.bucket_name(opts['wsbucket'])
-    if not s3.bucket_exists(bkt, region=opts['region']):
-        abort("Bucket does not exist: {}".format(bkt))
-    bkt = s3.bucket_name(opts['outbucket'])
-    if not s3.bucket_exists(bkt, region=opts['region']):
-        abort("Bucket does not exist: {}".format(bkt))
+    for path in [opts['srcbucket'], opts['wsbucket'], opts['outbucket']]:
+        bkt = s3.bucket_name(path)
+        if validate and not s3.bucket_exists(bkt, region=opts['region']):
+            abort("Bucket does not exist: {}".format(bkt))
 
     opts['srcbucket'] = s3.path_url(opts['srcbucket'])
     opts['wsbucket'] = s3.path_url(opts['wsbucket'])
@@ -228,6 +315,25 @@ def bucket_merge(opts, args, config):
 
     return opts
 
+def local_bucket_merge(opts, args, config):
+    """Merge options giving the directories standing in for buckets
+    when running jobs with the local executor"""
+
+    opts['bucket'] = os.path.abspath(
+        args.bucket or config.get('bucket', None) or
+        executor.local_buckets(opts['local_dir']))
+    opts['srcbucket'] = (args.srcbucket or config.get('srcbucket', None) or
+                         os.path.join(opts['bucket'], opts['jobname'], 'src'))
+    opts['wsbucket'] = (args.wsbucket or config.get('wsbucket', None) or
+                        os.path.join(opts['bucket'], opts['jobname'], 'ws'))
+    opts['outbucket'] = (args.outbucket or config.get('outbucket', None) or
+                         os.path.join(opts['bucket'], opts['jobname'], 'out'))
+    # Local jobs copy source trees, not tar files, and never compress
+    opts['srctarfile'] = None
+    opts['packed'] = False
+    opts['compress'] = False
+    return opts
+
 ################
 # Packages
 
@@ -245,18 +351,23 @@ def package_parser(parser):
 
     return parser
 
-def package_merge(opts, args, config):
-    """Merge options giving package locations"""
+def package_merge(opts, args, config, validate=True):
+    """Merge options giving package locations, and check that the
+    packages exist if validate is True"""
 
     opts['pkgbucket'] = (args.pkgbucket or config.get('pkgbucket', None) or
                          "{}/package".format(opts['bucket']))
+    if opts['executor'] == executor.LOCAL:
+        # Local jobs use the tools on the search path
+        opts['cbmcpkg'] = opts['batchpkg'] = opts['viewerpkg'] = None
+        return opts
 
     if not s3.is_path(opts['pkgbucket']):
         abort("Not a valid S3 bucket or object: {}"
               .format(opts['pkgbucket']))
 
     bkt = s3.bucket_name(opts['pkgbucket'])
-    if not s3.bucket_exists(bkt, region=opts['region']):
+    if validate and not s3.bucket_exists(bkt, region=opts['region']):
         abort("Bucket does not exist: {}".format(bkt))
     opts['pkgbucket'] = s3.path_url(opts['pkgbucket'])
 
@@ -274,6 +385,9 @@ def package_merge(opts, args, config):
     if not re.search(r'(\.tar$|\.tar\.)', opts['viewerpkg'], re.IGNORECASE):
         opts['viewerpkg'] += ".tar.gz"
 
+    if not validate:
+        return opts
+
     path = '{}/{}'.format(opts['pkgbucket'], opts['cbmcpkg'])
     if not s3.path_exists(path, region=opts['region']):
         abort("S3 package not found: {}".format(path))
@@ -296,6 +410,16 @@ def cbmcflags_parser(parser):
                         help='Name for the goto program for CBMC')
     parser.add_argument('--cbmcflags', metavar="OPTS",
                         help='Command line options for CBMC (encoded)')
+    parser = runoptions.property_parser(parser)
+    parser.add_argument('--portfolio', metavar="OPTS", action='append',
+                        help='Command line options for CBMC (encoded) '
+                        'added to --cbmcflags for one variant in a '
+                        'portfolio of variants raced in the property '
+                        'phase (may be repeated)')
+    parser.add_argument('--portfolio-race', dest='portfolio_race',
+                        default=None, action="store_true",
+                        help='Race the portfolio even if a past race '
+                        'recorded a winner')
     return parser
 
 def cbmcflags_merge(opts, args, config):
@@ -308,6 +432,21 @@ def cbmcflags_merge(opts, args, config):
         opts['cbmcflags'] = options
     else:
         opts['cbmcflags'] = options_str2dict(options.strip('='))
+
+    opts = runoptions.property_merge(opts, args, config)
+
+    portfolio = merge(args.portfolio, config.get('portfolio', None), [])
+    if not isinstance(portfolio, list):
+        abort("Portfolio is not a list of CBMC options: {}".format(portfolio))
+    # An empty variant in the portfolio is --cbmcflags itself
+    opts['portfolio'] = []
+    for variant in portfolio:
+        if variant and not isinstance(variant, dict):
+            variant = options_str2dict(variant.strip('='))
+        opts['portfolio'].append(variant or {})
+    opts['portfolio_race'] = merge(args.portfolio_race,
+                                   config.get('portfolio_race', None),
+                                   False)
     return opts
 
 ################
@@ -320,6 +459,7 @@ def build_parser(parser):
                         help='Compiler flags to build the goto program')
     parser.add_argument('--ldflags', metavar="STR",
                         help='Load flags to build the goto program')
+    parser = runoptions.gotocache_parser(parser)
     return parser
 
 def build_merge(opts, args, config):
@@ -335,6 +475,8 @@ def build_merge(opts, args, config):
         opts['ldflags'] = ldflags
     else:
         opts['ldflags'] = options_str2dict(ldflags.strip('='))
+
+    opts = runoptions.gotocache_merge(opts, args, config)
     return opts
 
 ################
@@ -388,6 +530,7 @@ def aws_batch_parser(parser):
     parser.add_argument('--build-memory', metavar='MB',
                         dest='build_memory',
                         help="Memory in MB for the CBMC build phase")
+    parser = runoptions.resource_parser(parser)
     parser.add_argument('--property-memory', metavar='MB',
                         dest='property_memory',
                         help="Memory in MB for the CBMC property phase")
@@ -458,10 +601,9 @@ def job_queue_merge(opts, args, config):
 def region_merge(opts, args, config):
     """Merge AWS region options"""
 
-    default_region = boto3.session.Session().region_name
-    if default_region is None:
-        default_region = 'us-east-1'
-    opts['region'] = merge(args.region, config.get('region'), default_region)
+    opts['region'] = merge(args.region, config.get('region'), None)
+    if opts['region'] is None:
+        opts['region'] = boto3.session.Session().region_name or 'us-east-1'
 
     return opts
 
@@ -475,6 +617,7 @@ def aws_batch_merge(opts, args, config):
     opts['build_memory'] = int(merge(args.build_memory,
                                      config.get('build_memory'),
                                      8000))
+    opts = runoptions.resource_merge(opts, args, config)
     opts['property_memory'] = int(merge(args.property_memory,
                                         config.get('property_memory'),
                                         16000))
@@ -544,6 +687,16 @@ def container_parser(parser):
                         help='Do the CBMC coverage phase')
     parser.add_argument('--doreport', action="store_true", default=None,
                         help='Do the CBMC report phase')
+    parser.add_argument('--dobundle', action="store_true", default=None,
+                        help='Do the phases of the proofs in a bundle')
+    parser.add_argument('--bundle', metavar='OBJ',
+                        help='S3 path to the manifest of the bundle')
+    parser.add_argument('--doworker', action="store_true", default=None,
+                        help='Run phases pulled from the worker queue')
+    parser.add_argument('--idle-timeout', metavar='S', type=int,
+                        dest='idle_timeout',
+                        help='Seconds a worker waits for a task before '
+                        'exiting (default: 300)')
 
     return parser
 
@@ -563,10 +716,20 @@ def container_merge(opts, args, config):
     opts['docoverage'] = merge(args.docoverage,
                                config.get('docoverage', None), False)
     opts['doreport'] = merge(args.doreport, config.get('doreport', None), False)
+    opts['dobundle'] = merge(args.dobundle, config.get('dobundle', None), False)
+    opts['bundle'] = args.bundle or config.get('bundle', None)
+    opts['doworker'] = merge(args.doworker, config.get('doworker', None), False)
+    opts['idle_timeout'] = merge(args.idle_timeout,
+                                 config.get('idle_timeout', None), 300)
 
     if more_than_one_set([opts['dobuild'], opts['doproperty'],
-                          opts['docoverage'], opts['doreport']]):
+                          opts['docoverage'], opts['doreport'],
+                          opts['dobundle'], opts['doworker']]):
         abort("Too many commands passed to docker container.")
+    if opts['dobundle'] and not opts['bundle']:
+        abort("No bundle manifest passed to docker container.")
+    if opts['doworker'] and not opts['worker_queue']:
+        abort("No worker queue passed to docker container.")
 
     return opts
 
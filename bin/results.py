@@ -0,0 +1,224 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+An index of the results in the CBMC output written by the property phase.
+
+The CBMC output cbmc.txt can be hundreds of megabytes when CBMC is
+run with --trace.  The property phase writes a compact index
+results.json of this output in a single streaming pass: the overall
+verdict, the status of each property, the timing reported by CBMC, and
+the byte offsets of the trace for each failing property.  Consumers
+read the index instead of the output, and read individual traces with
+ranged GETs.
+"""
+
+import json
+import os
+import re
+
+import compressor
+
+################################################################
+
+INDEX_VERSION = 1
+
+CBMC_OUTPUT = 'cbmc.txt'
+RESULTS_INDEX = 'results.json'
+
+PROPERTY_REGEXP = re.compile(r'^\[(\S+)\] (.*): ([A-Z]+)$')
+TRACE_REGEXP = re.compile(r'^Trace for (\S+):$')
+SUMMARY_REGEXP = re.compile(r'^\*\* ([0-9]+) of ([0-9]+) failed')
+VERDICT_REGEXP = re.compile(r'^VERIFICATION ([A-Z]+)')
+TIMING_REGEXP = re.compile(r'^Runtime ([^:]+): ([0-9.]+)s$')
+UNWIND_REGEXP = re.compile(r'\.unwind\.[0-9]+$')
+
+def index_output(filename, runtime=None):
+    """Index the CBMC output in a file in one pass over the file."""
+
+    index = {
+        'version': INDEX_VERSION,
+        'verdict': None,
+        'status': None,
+        'summary': None,
+        'failed': None,
+        'total': None,
+        'properties': {},
+        'timing': {},
+        'runtime': runtime,
+        'size': None
+    }
+    properties = index['properties']
+    trace = None
+    offset = 0
+
+    def end_trace(end):
+        """Record the end of the trace currently being read."""
+        if trace is not None and trace in properties:
+            properties[trace]['trace'][1] = end
+
+    with open(filename, 'rb') as output:
+        for raw in output:
+            line = raw.decode('utf-8', 'replace').rstrip('\r\n')
+
+            match = TRACE_REGEXP.match(line)
+            if match:
+                end_trace(offset)
+                trace = match.group(1)
+                properties.setdefault(trace, {'status': 'FAILURE',
+                                              'description': None})
+                properties[trace]['trace'] = [offset, None]
+                offset += len(raw)
+                continue
+
+            match = PROPERTY_REGEXP.match(line)
+            if match and trace is None:
+                properties[match.group(1)] = {'status': match.group(3),
+                                              'description': match.group(2),
+                                              'trace': None}
+
+            match = SUMMARY_REGEXP.match(line)
+            if match:
+                end_trace(offset)
+                trace = None
+                index['summary'] = line
+                index['failed'] = int(match.group(1))
+                index['total'] = int(match.group(2))
+
+            match = VERDICT_REGEXP.match(line)
+            if match:
+                end_trace(offset)
+                trace = None
+                index['verdict'] = line
+                index['status'] = match.group(1)
+
+            match = TIMING_REGEXP.match(line)
+            if match:
+                index['timing'][match.group(1)] = float(match.group(2))
+
+            offset += len(raw)
+
+    end_trace(offset)
+    index['size'] = offset
+    return index
+
+def write_index(output, filename, runtime=None):
+    """Write the index of the CBMC output in file output to file filename."""
+
+    index = index_output(output, runtime)
+    with open(filename, 'w') as fileobj:
+        json.dump(index, fileobj, indent=2, sort_keys=True)
+    return index
+
+def load_index(data):
+    """Load an index from the bytes or string data."""
+
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    return json.loads(data)
+
+################################################################
+
+def result_lines(index):
+    """The lines of the CBMC output summarized by the index."""
+
+    lines = ['[{}] {}: {}'.format(name, prop['description'], prop['status'])
+             for name, prop in sorted(index['properties'].items())
+             if prop.get('description') is not None]
+    return lines + [line for line in [index['summary'], index['verdict']]
+                    if line]
+
+def expected_in_index(index, expected):
+    """The expected substring appears in the results summarized by the index."""
+
+    if isinstance(expected, bytes):
+        expected = expected.decode('utf-8')
+    if not expected:
+        return True
+    return any(expected in line for line in result_lines(index))
+
+def failing_properties(index):
+    """The names of the failing properties in the index."""
+
+    return sorted(name for name, prop in index['properties'].items()
+                  if prop['status'] == 'FAILURE')
+
+def is_unwinding_property(name):
+    """The property is an unwinding assertion."""
+
+    return UNWIND_REGEXP.search(name) is not None
+
+def trace_range(index, name):
+    """The byte range [start, end) of the trace for a property, or None."""
+
+    prop = index['properties'].get(name)
+    if prop is None or prop.get('trace') is None:
+        return None
+    start, end = prop['trace']
+    return (start, end if end is not None else index['size'])
+
+def read_trace(client, bucket, key, index, name):
+    """Read the trace for a property from CBMC output in a bucket.
+
+    The trace is read with a ranged GET.  The offsets in the index are
+    offsets into the uncompressed output, so an object written
+    compressed is read whole and decompressed instead.
+    """
+    # pylint: disable=too-many-arguments
+
+    trace = trace_range(index, name)
+    if trace is None:
+        return None
+    start, end = trace
+    method = compressor.encoding(
+        client.head_object(Bucket=bucket, Key=key).get('Metadata'))
+    if method:
+        response = client.get_object(Bucket=bucket, Key=key)
+        data = compressor.decompress(response['Body'].read(),
+                                     method)[start:end]
+    else:
+        response = client.get_object(Bucket=bucket, Key=key,
+                                     Range='bytes={}-{}'.format(start, end - 1))
+        data = response['Body'].read()
+    return data.decode('utf-8', 'replace')
+
+################################################################
+# Splicing traces into CBMC output
+#
+# CBMC run without --trace prints the status of every property but no
+# traces.  The traces for the failing properties can be generated
+# afterwards by running CBMC with --trace --property on each failing
+# property, and spliced into the output where CBMC run with --trace
+# would have printed them: after the results and before the summary.
+
+def read_local_trace(filename, name):
+    """Read the trace for a property from CBMC output in a file."""
+
+    index = index_output(filename)
+    trace = trace_range(index, name)
+    if trace is None:
+        return None
+    start, end = trace
+    with open(filename, 'rb') as output:
+        output.seek(start)
+        return output.read(end - start)
+
+def splice_traces(filename, traces):
+    """Splice the traces into the CBMC output in a file.
+
+    The traces are a list of trace bytes in the order they are to
+    appear in the output.
+    """
+
+    spliced = filename + '.spliced'
+    with open(filename, 'rb') as output, open(spliced, 'wb') as splice:
+        for raw in output:
+            line = raw.decode('utf-8', 'replace').rstrip('\r\n')
+            if traces and SUMMARY_REGEXP.match(line):
+                for trace in traces:
+                    splice.write(trace)
+                traces = None
+            splice.write(raw)
+    os.rename(spliced, filename)
+
+################################################################
@@ -0,0 +1,230 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Parse and validate options choosing how the phases of a job are run.
+
+The parsers and mergers here are called by the parsers and mergers in
+options.py, and follow the same conventions.
+"""
+
+import os
+
+import executor
+import s3
+
+################################################################
+
+def abort(msg):
+    """Abort option parsing."""
+    raise Exception(msg)
+
+def merge(val1, val2, val3):
+    """Compute first defined source of options."""
+
+    if val1 is not None:
+        return val1
+    if val2 is not None:
+        return val2
+    return val3
+
+################
+# Options choosing how the property phase runs CBMC
+
+PROPERTY_FULL = 'full'
+PROPERTY_LAZY = 'lazy'
+PROPERTY_INCREMENTAL = 'incremental'
+PROPERTY_MODES = [PROPERTY_FULL, PROPERTY_LAZY, PROPERTY_INCREMENTAL]
+
+def property_parser(parser):
+    """Parse options choosing how the property phase runs CBMC"""
+
+    parser.add_argument('--property-mode', metavar="MODE",
+                        choices=PROPERTY_MODES,
+                        help='How the property phase generates traces: '
+                        '"full" runs CBMC once with --trace, '
+                        '"lazy" runs CBMC without --trace and then '
+                        'runs CBMC with --trace on each failing property, '
+                        '"incremental" is lazy but increases the --unwind '
+                        'bound step by step up to the bound given '
+                        '(default: full)')
+    parser.add_argument('--unwind-start', metavar="N", type=int,
+                        dest='unwind_start',
+                        help='First --unwind bound tried in incremental '
+                        'property mode (default: 1, or the bound '
+                        'found by the last run)')
+    parser.add_argument('--trace-jobs', metavar="N", type=int,
+                        help='Number of failing properties to generate '
+                        'traces for at once in lazy property mode '
+                        '(default: number of cores)')
+    return parser
+
+def property_merge(opts, args, config):
+    """Merge options choosing how the property phase runs CBMC"""
+
+    opts['property_mode'] = merge(args.property_mode,
+                                  config.get('property_mode', None),
+                                  PROPERTY_FULL)
+    if opts['property_mode'] not in PROPERTY_MODES:
+        abort("Unknown property mode: {}".format(opts['property_mode']))
+    opts['trace_jobs'] = merge(args.trace_jobs,
+                               config.get('trace_jobs', None),
+                               None)
+    opts['unwind_start'] = merge(args.unwind_start,
+                                 config.get('unwind_start', None),
+                                 None)
+    return opts
+
+################
+# Options to cache the object files built by goto-cc
+
+def gotocache_parser(parser):
+    """Parse options to cache the object files built by goto-cc"""
+
+    parser.add_argument('--gotocache', dest='gotocache', default=None,
+                        action="store_true",
+                        help='Cache object files built by goto-cc')
+    parser.add_argument('--no-gotocache', dest='gotocache', default=None,
+                        action="store_false",
+                        help="Don't cache object files built by goto-cc")
+    parser.add_argument('--gotocache-dir', metavar="DIR",
+                        help='Local directory caching object files '
+                        '(default: /var/cache/gotocache)')
+    parser.add_argument('--gotocache-bucket', metavar="BKT",
+                        help='S3 path to bucket caching object files '
+                        '(default: BUCKET/gotocache)')
+    return parser
+
+def gotocache_merge(opts, args, config):
+    """Merge options to cache the object files built by goto-cc"""
+
+    opts['gotocache'] = merge(args.gotocache, config.get('gotocache', None),
+                              False)
+    opts['gotocache_dir'] = (args.gotocache_dir or
+                             config.get('gotocache_dir', None) or
+                             '/var/cache/gotocache')
+    opts['gotocache_bucket'] = (args.gotocache_bucket or
+                                config.get('gotocache_bucket', None))
+    if opts['gotocache_bucket'] is None and s3.is_path(opts['bucket']):
+        opts['gotocache_bucket'] = "{}/gotocache".format(opts['bucket'])
+    return opts
+
+################
+# Options to choose the resources given to the phases
+
+def resource_parser(parser):
+    """Parse options choosing the resources given to the phases"""
+
+    parser.add_argument('--sizing', dest='sizing', default=None,
+                        action="store_true",
+                        help='Choose memory, vCPUs, and timeouts for each '
+                        'phase from the resources used by past runs')
+    parser.add_argument('--no-sizing', dest='sizing', default=None,
+                        action="store_false",
+                        help="Use the memory given for each phase")
+    parser.add_argument('--max-memory', metavar='MB', type=int,
+                        dest='max_memory',
+                        help="Most memory in MB to give any phase when "
+                        "sizing or retrying a phase out of memory")
+    parser.add_argument('--bundled', dest='bundled', default=None,
+                        action="store_true",
+                        help="Prepare the job to run in a bundle of proofs "
+                        "and don't submit its phases")
+    parser.add_argument('--worker-queue', metavar='URL',
+                        dest='worker_queue',
+                        help="Send the phases to workers through the SQS "
+                        "queue (or local directory) URL instead of "
+                        "submitting a job for each phase")
+    parser.add_argument('--workers', metavar='N', type=int,
+                        help="Number of workers to submit with the phases "
+                        "sent to a worker queue (default: 0)")
+    parser.add_argument('--build-vcpus', metavar='N', type=int,
+                        dest='build_vcpus',
+                        help="vCPUs for the CBMC build phase "
+                        "(default: vCPUs in the job definition)")
+    return parser
+
+def resource_merge(opts, args, config):
+    """Merge options choosing the resources given to the phases"""
+
+    opts['sizing'] = merge(args.sizing, config.get('sizing'), False)
+    opts['max_memory'] = merge(args.max_memory, config.get('max_memory'), None)
+    opts['bundled'] = merge(args.bundled, config.get('bundled'), False)
+    opts['worker_queue'] = merge(args.worker_queue,
+                                 config.get('worker_queue'), None)
+    opts['workers'] = merge(args.workers, config.get('workers'), 0)
+    opts['build_vcpus'] = merge(args.build_vcpus,
+                                config.get('build_vcpus'),
+                                None)
+    return opts
+
+################
+# Options to choose the executor running the phases
+
+def executor_parser(parser):
+    """Parse options choosing the executor running the phases"""
+
+    parser.add_argument('--executor', choices=executor.EXECUTORS,
+                        help='Run the phases on AWS Batch or as processes '
+                        'on the local machine (default: batch)')
+    parser.add_argument('--local-dir', metavar='DIR', dest='local_dir',
+                        help='State directory of the local executor, '
+                        'holding directories standing in for buckets '
+                        '(default: {})'.format(executor.DEFAULT_LOCAL_DIR))
+    parser.add_argument('--local-slots', metavar='N', type=int,
+                        dest='local_slots',
+                        help='Number of phases the local executor runs at '
+                        'once (default: number of cores)')
+    return parser
+
+def executor_merge(opts, args, config):
+    """Merge options choosing the executor running the phases"""
+
+    opts['executor'] = merge(args.executor, config.get('executor'),
+                             executor.BATCH)
+    opts['local_dir'] = os.path.abspath(os.path.expanduser(
+        merge(args.local_dir, config.get('local_dir'),
+              executor.DEFAULT_LOCAL_DIR)))
+    opts['local_slots'] = merge(args.local_slots, config.get('local_slots'),
+                                None)
+    return opts
+
+################
+# Options specific to the cbmc-autotune program
+
+def autotune_parser(parser):
+    """Parse options specific to the cbmc-autotune program"""
+
+    parser.add_argument('--dimension', metavar="ALTS", action='append',
+                        help='Alternative command line options for CBMC '
+                        '(encoded) separated by "|" to search over '
+                        '(may be repeated; default: slicing options)')
+    parser.add_argument('--jobs', metavar="N", type=int,
+                        help='Number of variants to run at once '
+                        '(default: 1)')
+    parser.add_argument('--timeout', metavar="S", type=int,
+                        help='Seconds to let a variant run')
+    parser.add_argument('--max-variants', metavar="N", type=int,
+                        dest='max_variants',
+                        help='Maximum number of variants to run')
+    parser.add_argument('--report', metavar="FILE",
+                        help='File to write the JSON report to')
+    parser.add_argument('--patch', metavar="FILE",
+                        help='File to write the suggested YAML patch to')
+    return parser
+
+def autotune_merge(opts, args, config):
+    """Merge options specific to the cbmc-autotune program"""
+
+    # The config file is usually the cbmc-batch.yaml for the proof, so
+    # only the search space may be given there
+    opts['dimensions'] = merge(args.dimension,
+                               config.get('autotune-dimensions'), None)
+    opts['jobs'] = args.jobs or 1
+    opts['timeout'] = args.timeout
+    opts['max_variants'] = args.max_variants
+    opts['report'] = args.report
+    opts['patch'] = args.patch
+    return opts
+
+################################################################
@@ -10,6 +10,13 @@ import os
 import re
 import sys
 import errno
+import json
+import mimetypes
+import struct
+import tempfile
+import zipfile
+import zlib
+from multiprocessing.pool import ThreadPool
 from pprint import pprint
 
 import boto3
@@ -17,6 +24,7 @@ from botocore.exceptions import ClientError
 from botocore.exceptions import WaiterError
 
 import clienterror
+import compressor
 
 ################################################################
 
@@ -62,7 +70,7 @@ def abort(msg1, msg2=None, data=None, verbose=False):
 BUCKET_NAME_REGEXP = '[a-z0-9][a-z0-9_-]*'
 KEY_WORD_REGEXP = '[a-z0-9][a-z0-9_.-]*'
 KEY_NAME_REGEXP = '{key}(/{key})*'.format(key=KEY_WORD_REGEXP)
-PATH_REGEXP = '^(s3://)?({})(/({}))?/?(?i)$'.format(BUCKET_NAME_REGEXP,
+PATH_REGEXP = '(?i)^(s3://)?({})(/({}))?/?$'.format(BUCKET_NAME_REGEXP,
                                                     KEY_NAME_REGEXP)
 BUCKET_NAME_GROUP = 2
 KEY_NAME_GROUP = 4
@@ -257,8 +265,14 @@ def create_object(path, client=None, region=None, force=False):
     if not response.get('ETag', False):
         abort("Error creating object", key, data=response)
 
-def copy_file_to_object(filename, path, client=None, region=None):
-    """Copy local file to an S3 object"""
+def copy_file_to_object(filename, path, client=None, region=None,
+                        metadata=None, compress=False):
+    """Copy local file to an S3 object
+
+    Compress files larger than the compression threshold if compress
+    is true, and tag the object with the encoding used.
+    """
+    # pylint: disable=too-many-arguments
 
     if client is None:
         client = boto3.client('s3', region_name=region)
@@ -268,14 +282,34 @@ def copy_file_to_object(filename, path, client=None, region=None):
     bucket = bucket_name(path)
     key = key_name(path)
 
+    metadata = dict(metadata or {})
+    upload = filename
+    size = os.path.getsize(filename)
+    if compress and size >= compressor.THRESHOLD:
+        method = compressor.codec()
+        handle, upload = tempfile.mkstemp()
+        os.close(handle)
+        compressor.compress_file(filename, upload, method)
+        metadata[compressor.ENCODING_METADATA] = method
+        print(compressor.ratio_report(filename, size,
+                                      os.path.getsize(upload), method))
+        sys.stdout.flush()
+
+    extra = {'Metadata': metadata} if metadata else None
     try:
-        client.upload_file(filename, bucket, key)
+        client.upload_file(upload, bucket, key, ExtraArgs=extra)
     except ClientError as exc:
         abort("Error copying file to object: {}, {}".format(filename, path),
               "", data=exc)
+    finally:
+        if upload != filename:
+            os.remove(upload)
 
 def copy_object_to_file(objectname, filename, client=None, region=None):
-    """Copy an S3 object to a local file"""
+    """Copy an S3 object to a local file
+
+    Decompress the object if it is tagged with an encoding.
+    """
 
     if client is None:
         client = boto3.client('s3', region_name=region)
@@ -286,10 +320,41 @@ def copy_object_to_file(objectname, filename, client=None, region=None):
     key = key_name(objectname)
 
     try:
-        client.download_file(bucket, key, filename)
+        response = client.head_object(Bucket=bucket, Key=key)
+        method = compressor.encoding(response.get('Metadata'))
+        if method is None:
+            client.download_file(bucket, key, filename)
+            return
+        download = "{}.{}".format(filename, method)
+        client.download_file(bucket, key, download)
     except ClientError as exc:
         abort("Error copying object {} to file {}".format(objectname, filename),
               "", data=exc)
+    compressor.decompress_file(download, filename, method)
+    os.remove(download)
+
+def read_body(response):
+    """Read the body of a get_object response, decompressing if tagged."""
+
+    return compressor.decompress(response['Body'].read(),
+                                 compressor.encoding(response.get('Metadata')))
+
+def put_json(path, data, client=None, region=None):
+    """Write data to an S3 object as JSON"""
+
+    if client is None:
+        client = boto3.client('s3', region_name=region)
+    client.put_object(Bucket=bucket_name(path), Key=key_name(path),
+                      Body=json.dumps(data, indent=2, sort_keys=True),
+                      ContentType='application/json')
+
+def get_json(path, client=None, region=None):
+    """Read data from an S3 object written as JSON"""
+
+    if client is None:
+        client = boto3.client('s3', region_name=region)
+    response = client.get_object(Bucket=bucket_name(path), Key=key_name(path))
+    return json.loads(read_body(response).decode('utf-8'))
 
 ################################################################
 # Deletion
@@ -511,8 +576,10 @@ def wait_for_object_condition(path, condition, client=None, region=None,
 
 # boto3 api omits a sync which is just too useful not to use
 
-def sync_directory_to_bucket(directory, bucket, quiet=False, delete=False, metadata=None):
+def sync_directory_to_bucket(directory, bucket, quiet=False, delete=False, metadata=None,
+                             exclude=None):
     """Synchronize a directory to a path (a bucket or bucket and prefix)."""
+    # pylint: disable=too-many-arguments
 
     if not os.path.isdir(directory):
         abort("Directory does not exist", directory)
@@ -527,6 +594,8 @@ def sync_directory_to_bucket(directory, bucket, quiet=False, delete=False, metad
             cmd.append('--delete')
         if quiet:
             cmd.append('--quiet')
+        for pattern in exclude or []:
+            cmd.extend(['--exclude', pattern])
         if metadata:
             cmd.append('--metadata')
             param_str = ""
@@ -546,7 +615,8 @@ def sync_directory_to_bucket(directory, bucket, quiet=False, delete=False, metad
         sys.stdout.flush()
         raise exc
 
-def sync_bucket_to_directory(bucket, directory, quiet=False, delete=False):
+def sync_bucket_to_directory(bucket, directory, quiet=False, delete=False,
+                             exclude=None):
     """Synchronize a path (a bucket or bucket and prefix) to a directory."""
 
     try:
@@ -565,6 +635,8 @@ def sync_bucket_to_directory(bucket, directory, quiet=False, delete=False):
             cmd.append('--delete')
         if quiet:
             cmd.append('--quiet')
+        for pattern in exclude or []:
+            cmd.extend(['--exclude', pattern])
         if not quiet:
             print("Copying bucket {} to directory {}".format(url, directory))
         sys.stdout.flush()
@@ -576,6 +648,266 @@ def sync_bucket_to_directory(bucket, directory, quiet=False, delete=False):
         sys.stdout.flush()
         raise exc
 
+################################################################
+# Packed transfers
+#
+# Source trees and cbmc-viewer reports are thousands of tiny files,
+# and copying them with a sync issues one request per file.  A packed
+# transfer copies a directory as a single zip archive named
+# pack-NAME.zip together with an index pack-NAME.json of the byte
+# offsets of the archive members.  A directory is restored with one
+# GET of the archive, and a single member with one ranged GET.
+
+PACK_PREFIX = 'pack-'
+PACK_SUFFIX = '.zip'
+PACK_INDEX_SUFFIX = '.json'
+PUBLISH_THREADS = 32
+
+# The fixed-size part of a zip local file header
+ZIP_LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+
+def pack_key(bucket, name, suffix=PACK_SUFFIX):
+    """The key for the pack (or pack index) with a given name in a path."""
+    prefix = key_name(bucket)
+    pack = '{}{}{}'.format(PACK_PREFIX, name, suffix)
+    return '{}/{}'.format(prefix, pack) if prefix else pack
+
+def directory_snapshot(directory):
+    """Map each file under a directory to its size and modification time."""
+    snapshot = {}
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            stat = os.stat(path)
+            snapshot[os.path.relpath(path, directory)] = (stat.st_size,
+                                                          stat.st_mtime)
+    return snapshot
+
+def pack_directory(directory, packfile, since=None, exclude=None):
+    """Pack a directory into a zip archive and return the member index.
+
+    Given a snapshot of the directory, pack only files added or
+    modified since the snapshot was taken.  Omit the files named in
+    exclude.
+    """
+
+    since = since or {}
+    exclude = exclude or []
+    current = directory_snapshot(directory)
+    names = sorted(name for name in current
+                   if since.get(name) != current[name]
+                   and name not in exclude)
+
+    zipf = zipfile.ZipFile(packfile, 'w', zipfile.ZIP_DEFLATED,
+                           allowZip64=True)
+    with zipf:
+        for name in names:
+            zipf.write(os.path.join(directory, name), name)
+        infos = zipf.infolist()
+        # The central directory starts where the last member ends
+        ends = [info.header_offset for info in infos[1:]] + [zipf.fp.tell()]
+
+    return [{'name': info.filename,
+             'offset': info.header_offset,
+             'end': end,
+             'size': info.file_size,
+             'compressed_size': info.compress_size,
+             'compress_type': info.compress_type,
+             'mode': (info.external_attr >> 16) & 0o777}
+            for info, end in zip(infos, ends)]
+
+def unpack_directory(packfile, directory):
+    """Unpack a zip archive into a directory, restoring file modes."""
+    with zipfile.ZipFile(packfile) as zipf:
+        for info in zipf.infolist():
+            if (info.filename.startswith('/') or
+                    '..' in info.filename.split('/')):
+                abort("Invalid name in pack", info.filename)
+            path = zipf.extract(info, directory)
+            mode = (info.external_attr >> 16) & 0o777
+            if mode:
+                os.chmod(path, mode)
+
+def pack_directory_to_bucket(directory, bucket, name, since=None,
+                             quiet=False, metadata=None, exclude=None,
+                             client=None, region=None):
+    """Copy a directory to a path (a bucket or bucket and prefix) as a pack.
+
+    Return the name of the local pack file, which is left for the
+    caller to publish or remove.
+    """
+    # pylint: disable=too-many-arguments
+
+    if client is None:
+        client = boto3.client('s3', region_name=region)
+
+    if not os.path.isdir(directory):
+        abort("Directory does not exist", directory)
+    url = path_url(bucket)
+    if url is None:
+        abort("Not a bucket", bucket)
+
+    handle, packfile = tempfile.mkstemp(suffix=PACK_SUFFIX)
+    os.close(handle)
+    index = pack_directory(directory, packfile, since, exclude)
+    if not quiet:
+        print("Copying {} files in directory {} to pack {} in bucket {}"
+              .format(len(index), directory, name, url))
+    sys.stdout.flush()
+
+    bkt = bucket_name(bucket)
+    copy_file_to_object(packfile,
+                        '{}/{}'.format(bkt, pack_key(bucket, name)),
+                        client=client, metadata=metadata)
+    try:
+        client.put_object(Bucket=bkt,
+                          Key=pack_key(bucket, name, PACK_INDEX_SUFFIX),
+                          Body=json.dumps(index).encode('utf-8'))
+    except ClientError as exc:
+        abort("Error writing pack index", name, data=exc)
+    return packfile
+
+def unpack_bucket_to_directory(bucket, directory, quiet=False,
+                               client=None, region=None):
+    """Copy every pack in a path (a bucket or bucket and prefix) to a directory.
+
+    Packs are unpacked in the order they were written, so a file
+    packed by a later phase replaces the same file packed earlier.
+    """
+
+    if client is None:
+        client = boto3.client('s3', region_name=region)
+
+    try:
+        os.makedirs(directory)
+    except OSError as exc:
+        if not (exc.errno == errno.EEXIST and os.path.isdir(directory)):
+            abort("Error creating directory", directory)
+
+    url = path_url(bucket)
+    if url is None:
+        abort("Not a bucket", bucket)
+    bkt = bucket_name(bucket)
+    prefix = pack_key(bucket, '', '')
+
+    packs = []
+    try:
+        paginator = client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bkt, Prefix=prefix):
+            packs.extend(obj for obj in page.get('Contents', [])
+                         if obj['Key'].endswith(PACK_SUFFIX))
+    except ClientError as exc:
+        abort("Error listing packs", url, data=exc)
+    packs.sort(key=lambda obj: obj['LastModified'])
+
+    for obj in packs:
+        if not quiet:
+            print("Copying pack {} to directory {}"
+                  .format(obj['Key'], directory))
+        sys.stdout.flush()
+        handle, packfile = tempfile.mkstemp(suffix=PACK_SUFFIX)
+        os.close(handle)
+        try:
+            copy_object_to_file('{}/{}'.format(bkt, obj['Key']), packfile,
+                                client=client)
+            unpack_directory(packfile, directory)
+        finally:
+            os.remove(packfile)
+
+def read_pack_index(bucket, name, client=None, region=None):
+    """Read the member index of a pack in a path."""
+
+    if client is None:
+        client = boto3.client('s3', region_name=region)
+
+    key = pack_key(bucket, name, PACK_INDEX_SUFFIX)
+    try:
+        body = client.get_object(Bucket=bucket_name(bucket), Key=key)['Body']
+    except ClientError as exc:
+        abort("Error reading pack index", key, data=exc)
+    return json.loads(body.read().decode('utf-8'))
+
+def read_pack_member(bucket, name, member, index=None,
+                     client=None, region=None):
+    """Read one member of a pack in a path with a single ranged GET."""
+    # pylint: disable=too-many-arguments
+
+    if client is None:
+        client = boto3.client('s3', region_name=region)
+
+    index = index or read_pack_index(bucket, name, client=client)
+    entries = [entry for entry in index if entry['name'] == member]
+    if not entries:
+        abort("No such member in pack {}".format(name), member)
+    entry = entries[0]
+
+    key = pack_key(bucket, name)
+    try:
+        response = client.get_object(
+            Bucket=bucket_name(bucket), Key=key,
+            Range='bytes={}-{}'.format(entry['offset'], entry['end'] - 1))
+    except ClientError as exc:
+        abort("Error reading pack member {}".format(member), key, data=exc)
+    record = response['Body'].read()
+
+    header = ZIP_LOCAL_HEADER.unpack(record[:ZIP_LOCAL_HEADER.size])
+    start = ZIP_LOCAL_HEADER.size + header[10] + header[11]
+    data = record[start:start + entry['compressed_size']]
+    if entry['compress_type'] == zipfile.ZIP_DEFLATED:
+        return zlib.decompress(data, -zlib.MAX_WBITS)
+    return data
+
+def publish_pack(packfile, bucket, prefix=None, metadata=None,
+                 client=None, region=None):
+    """Publish the members of a pack as individual objects in a path.
+
+    Unpacking on publication keeps per-file urls working for content
+    served directly from the bucket (like the cbmc-viewer report
+    served by CloudFront).  Restrict publication to members whose
+    names begin with prefix, if given.
+    """
+    # pylint: disable=too-many-arguments
+
+    if client is None:
+        client = boto3.client('s3', region_name=region)
+
+    url = path_url(bucket)
+    if url is None:
+        abort("Not a bucket", bucket)
+    bkt = bucket_name(bucket)
+    root = key_name(bucket)
+
+    zipf = zipfile.ZipFile(packfile)
+    with zipf:
+        names = [info.filename for info in zipf.infolist()
+                 if not prefix or info.filename.startswith(prefix)]
+        members = [(name, zipf.read(name)) for name in names]
+
+    def publish(member):
+        """Write one pack member to its own object."""
+        name, body = member
+        key = '{}/{}'.format(root, name) if root else name
+        kwds = {'Bucket': bkt, 'Key': key, 'Body': body}
+        if metadata:
+            kwds['Metadata'] = metadata
+        content_type = mimetypes.guess_type(name)[0]
+        if content_type:
+            kwds['ContentType'] = content_type
+        try:
+            client.put_object(**kwds)
+        except ClientError as exc:
+            abort("Error publishing pack member", key, data=exc)
+
+    print("Publishing {} files from pack {} to bucket {}"
+          .format(len(members), packfile, url))
+    sys.stdout.flush()
+    pool = ThreadPool(PUBLISH_THREADS)
+    try:
+        pool.map(publish, members)
+    finally:
+        pool.close()
+        pool.join()
+
 ################################################################
 
 # The response never seems to have the documented 'Status' key ???
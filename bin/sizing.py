@@ -0,0 +1,220 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Size the resources for each phase of a proof from its history.
+
+Each phase records its peak memory, duration, and average parallelism
+in the history of the proof.  When sizing is enabled, the memory,
+vCPUs, and timeout for a phase are chosen from the most recent of
+these samples with headroom.  A phase with no history is given the
+memory from the command line or config file and no timeout.  A phase
+killed for running out of memory is retried with more memory.
+
+A property phase racing a portfolio of variants runs a CBMC process for
+each variant at once, so it is given the memory and vCPUs of one
+process times the number of variants.  Each sample records the number
+of processes run at once, so samples from races and from runs of a
+single variant size the phase alike.
+"""
+
+import math
+import resource
+
+import cgroup
+import history
+
+################################################################
+
+PHASES = ['build', 'property', 'coverage', 'report']
+
+# The phases to rerun when a phase fails: the phase and those downstream
+RERUN = {
+    'build': ['build', 'property', 'coverage', 'report'],
+    'property': ['property', 'report'],
+    'coverage': ['coverage', 'report'],
+    'report': ['report']
+}
+
+SAMPLES = 5
+
+MEMORY_HEADROOM = 1.5
+MEMORY_QUANTUM = 1024
+MIN_MEMORY = 2048
+
+TIMEOUT_HEADROOM = 3.0
+MIN_TIMEOUT = 3600
+
+OOM_REASON = 'OutOfMemoryError'
+OOM_RETRIES = 2
+OOM_ESCALATION = 2
+
+def record_name(phase):
+    """The name of the history record for a phase."""
+
+    return 'sizing-{}'.format(phase)
+
+################################################################
+# Recording resource use in the container
+
+def usage(start, end, container=True, processes=1):
+    """The peak memory (MB), duration (s), and average parallelism of
+    the processes run by the container between start and end, and the
+    number of CBMC processes run at once.
+
+    The peak memory of the container is used only if the container
+    runs nothing else (container is True).
+    """
+
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    memory = cgroup.memory_peak() if container else None
+    if memory is None:
+        # ru_maxrss is in kilobytes on Linux
+        memory = children.ru_maxrss / 1024.0
+    duration = end - start
+    cputime = children.ru_utime + children.ru_stime
+    return {
+        'memory': memory,
+        'duration': duration,
+        'parallelism': cputime / duration if duration else 1.0,
+        'processes': processes
+    }
+
+def record_usage(opts, phase, sample):
+    """Add a sample of resource use to the history of a phase."""
+
+    name = record_name(phase)
+    record = history.read_record(opts['bucket'], opts['taskname'], name,
+                                 region=opts['region']) or {}
+    samples = (record.get('samples') or [])[-(SAMPLES-1):] + [sample]
+    history.write_record(opts['bucket'], opts['taskname'], name,
+                         {'samples': samples}, region=opts['region'])
+
+################################################################
+# Choosing resources for a phase
+
+def round_up(value, quantum):
+    """Round value up to a multiple of quantum."""
+
+    return int(math.ceil(float(value) / quantum) * quantum)
+
+def width(opts, phase):
+    """The number of CBMC processes a phase may run at once: the number
+    of variants in a portfolio raced by the property phase, or 1."""
+
+    variants = len(opts.get('portfolio') or [])
+    return variants if phase == 'property' and variants > 1 else 1
+
+def per_process(sample, key):
+    """The value of a sample for each process run at once."""
+
+    return sample[key] / float(sample.get('processes') or 1)
+
+def choose(opts, phase):
+    """The memory (MB), vCPUs, and timeout (s) for a phase.
+
+    Values of None leave the value in the job definition unchanged.
+    """
+
+    processes = width(opts, phase)
+    memory = opts['{}_memory'.format(phase)] * processes
+    vcpus = opts.get('{}_vcpus'.format(phase))
+    if processes > 1:
+        vcpus = (vcpus or 1) * processes
+    if not opts.get('sizing'):
+        return memory, vcpus, None
+
+    record = history.read_record(opts['bucket'], opts['taskname'],
+                                 record_name(phase), region=opts['region'])
+    samples = (record or {}).get('samples')
+    if not samples:
+        return memory, vcpus, None
+
+    peak = max(per_process(sample, 'memory') for sample in samples)
+    memory = max(MIN_MEMORY, round_up(peak * processes * MEMORY_HEADROOM,
+                                      MEMORY_QUANTUM))
+    if opts.get('max_memory'):
+        memory = min(memory, opts['max_memory'])
+
+    if vcpus is None or processes > 1:
+        parallelism = max(per_process(sample, 'parallelism')
+                          for sample in samples)
+        vcpus = max(1, int(math.ceil(parallelism * processes)))
+
+    duration = max(sample['duration'] for sample in samples)
+    timeout = max(MIN_TIMEOUT, int(duration * TIMEOUT_HEADROOM))
+
+    print("Sized {} phase from {} runs: {} MB, {} vCPUs, {} s timeout"
+          .format(phase, len(samples), memory, vcpus, timeout))
+    return memory, vcpus, timeout
+
+################################################################
+# Predicting the runtime of a proof
+
+def phase_duration(bucket, taskname, phase, client=None, region=None):
+    """The mean duration of a phase in recent runs, or None if unknown."""
+    # pylint: disable=too-many-arguments
+
+    record = history.read_record(bucket, taskname, record_name(phase),
+                                 client=client, region=region)
+    samples = (record or {}).get('samples')
+    if not samples:
+        return None
+    return sum(sample['duration'] for sample in samples) / len(samples)
+
+def predict_runtime(bucket, taskname, client=None, region=None):
+    """The predicted time from launch to report for a proof, or None if
+    the proof has no history.
+
+    Property checking and coverage run concurrently after the build,
+    and the report runs after both.
+    """
+
+    durations = {phase: phase_duration(bucket, taskname, phase,
+                                       client=client, region=region)
+                 for phase in PHASES}
+    if durations['property'] is None:
+        return None
+    return ((durations['build'] or 0) +
+            max(durations['property'], durations['coverage'] or 0) +
+            (durations['report'] or 0))
+
+################################################################
+# Retrying phases that run out of memory
+
+def out_of_memory(detail):
+    """The Batch job described by a state change event ran out of memory."""
+
+    reasons = [detail.get('statusReason', ''),
+               detail.get('container', {}).get('reason', '')]
+    reasons += [attempt.get('container', {}).get('reason', '')
+                for attempt in detail.get('attempts', [])]
+    return any(OOM_REASON in (reason or '') for reason in reasons)
+
+def escalate(opts, phase, memory):
+    """The options for a retry of a phase with more memory, or None if
+    the phase has been retried too often."""
+
+    attempt = opts.get('oom_attempt', 0) + 1
+    if attempt > OOM_RETRIES:
+        return None
+    if opts.get('max_memory'):
+        if memory >= opts['max_memory']:
+            return None
+        memory = min(memory * OOM_ESCALATION, opts['max_memory'])
+    else:
+        memory = memory * OOM_ESCALATION
+
+    retry = dict(opts)
+    retry['oom_attempt'] = attempt
+    # The phases sized from history were too small: use the
+    # escalated memory for the failed phase and the static values
+    # for the phases downstream
+    retry['sizing'] = False
+    # The memory of the phase is given for each process run at once
+    retry['{}_memory'.format(phase)] = memory // width(opts, phase)
+    for other in PHASES:
+        retry[other] = opts.get(other, True) and other in RERUN[phase]
+    return retry
+
+################################################################
@@ -0,0 +1,426 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Artifact stores handing the files of a CBMC job between phases.
+
+Each phase of a CBMC job copies the source, workspace, and output
+buckets into its container, runs, and copies what it wrote back to
+the output bucket.  An artifact store does this copying.
+
+The S3 store keeps the buckets in S3.  The POSIX store keeps the
+buckets as directories on a filesystem shared by the containers, such
+as an EFS or FSx mount, so phases running on the same mount do no
+object-store I/O.  The output of a phase is hard-linked into a bucket,
+but a bucket is copied into a workspace, because tools like goto-cc
+and cbmc may rewrite their files in place, and a write through a link
+would change the bucket and every other workspace using the file.
+For an output bucket that is an S3 path, the POSIX store copies the
+logs and results at the top of the output to S3 after each phase,
+because continuous integration reads them from S3 as each phase
+finishes, and copies the rest of the output to S3 when the report is
+published.  The memory store keeps the buckets in memory for tests.
+"""
+
+import os
+import shutil
+import subprocess
+import uuid
+
+import s3
+
+################################################################
+
+class StoreException(Exception):
+    """Exception thrown by store methods."""
+
+    def __init__(self, msg):
+        super(StoreException, self).__init__()
+        self.message = msg
+
+    def __str__(self):
+        return self.message
+
+    def __repr__(self):
+        return self.message
+
+def abort(msg):
+    """Abort a store method."""
+    raise StoreException(msg)
+
+################################################################
+
+S3 = 's3'
+POSIX = 'posix'
+MEMORY = 'memory'
+STORES = [S3, POSIX, MEMORY]
+
+PUBLIC_WEBSITE_METADATA = {"public-website-contents": "True"}
+
+# Large, compressible artifacts handed between phases
+COMPRESSED_ARTIFACTS = ['cbmc.txt', 'property.xml', 'coverage.xml']
+
+def make_store(opts):
+    """The artifact store for the buckets described by the options."""
+
+    if opts['artifact_store'] == POSIX:
+        return PosixStore(opts['artifact_root'])
+    if opts['artifact_store'] == MEMORY:
+        return MemoryStore()
+    return S3Store()
+
+################################################################
+# Files in a directory
+
+def changed_files(directory, since=None):
+    """The paths relative to directory of the files under directory,
+    omitting the files unchanged since a snapshot given by
+    s3.directory_snapshot."""
+
+    since = since or {}
+    if not os.path.isdir(directory):
+        return []
+    paths = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            relpath = os.path.relpath(path, directory)
+            stat = os.stat(path)
+            if since.get(relpath) == (stat.st_size, stat.st_mtime):
+                continue
+            paths.append(relpath)
+    return paths
+
+def make_parent(path):
+    """Make the directory containing a path."""
+
+    parent = os.path.dirname(path)
+    if parent and not os.path.isdir(parent):
+        try:
+            os.makedirs(parent)
+        except OSError:
+            # Another phase made it first
+            if not os.path.isdir(parent):
+                raise
+
+def link_file(src, dst, link=True):
+    """Replace dst with a hard link to src, or a copy of src.
+
+    A hard link is impossible across filesystems, so fall back to a
+    copy.  The link or copy is made under a temporary name and renamed
+    so a concurrent reader never sees a partial file.  A copy replaces
+    a dst that is already a link to src, so the two no longer share a
+    file.
+    """
+
+    if link and os.path.exists(dst) and os.path.samefile(src, dst):
+        return
+    make_parent(dst)
+    tmp = "{}.{}.tmp".format(dst, uuid.uuid4().hex)
+    linked = False
+    if link:
+        try:
+            os.link(src, tmp)
+            linked = True
+        except OSError:
+            pass
+    if not linked:
+        shutil.copy2(src, tmp)
+    os.rename(tmp, dst)
+
+def link_tree(src, dst, since=None, link=True):
+    """Link or copy the files under src changed since a snapshot to dst."""
+
+    for relpath in changed_files(src, since):
+        link_file(os.path.join(src, relpath), os.path.join(dst, relpath),
+                  link)
+
+################################################################
+# The S3 store
+
+def compressed_artifacts(opts):
+    """Large artifacts copied to the output bucket compressed"""
+
+    if not opts['compress']:
+        return []
+    return [opts['goto']] + COMPRESSED_ARTIFACTS
+
+def get_artifacts(opts, artifacts):
+    """Copy compressed artifacts from the output bucket to the workspace"""
+
+    for name in artifacts:
+        path = '{}/{}'.format(opts['outbucket'], name)
+        if s3.object_exists(path, region=opts['region']):
+            s3.copy_object_to_file(path, os.path.join(opts['wsdir'], name),
+                                   region=opts['region'])
+
+def put_artifacts(opts, artifacts, snapshot):
+    """Copy new artifacts to the output bucket compressed"""
+
+    current = s3.directory_snapshot(opts['wsdir'])
+    for name in artifacts:
+        if name in current and current[name] != snapshot.get(name):
+            s3.copy_file_to_object(os.path.join(opts['wsdir'], name),
+                                   '{}/{}'.format(opts['outbucket'], name),
+                                   region=opts['region'],
+                                   metadata=PUBLIC_WEBSITE_METADATA,
+                                   compress=True)
+
+def untar_source(opts, tarfile):
+    """Untar the source directory from a tar file"""
+
+    tardir = os.path.dirname(opts['srcdir'].rstrip('/'))
+    try:
+        os.makedirs(tardir)
+    except OSError:
+        abort("Failed to make directory {}".format(tardir))
+    cmd = ['tar', 'fx', tarfile, '-C', tardir]
+    try:
+        subprocess.check_call(cmd)
+    except subprocess.CalledProcessError:
+        abort("Failed to run command {}".format(' '.join(cmd)))
+    if not os.path.isdir(opts['srcdir']):
+        abort("Failed to create {} by untarring {}"
+              .format(opts['srcdir'], opts['srctarfile']))
+
+class S3Store:
+    """Buckets kept in S3"""
+
+    @staticmethod
+    def put_directory(opts, directory, bucket, name, quiet=True):
+        """Copy a directory to a bucket, as a pack named name if packing"""
+
+        if opts['packed']:
+            packfile = s3.pack_directory_to_bucket(
+                directory, bucket, name, quiet=quiet,
+                metadata=PUBLIC_WEBSITE_METADATA, region=opts['region'])
+            os.remove(packfile)
+            return
+        s3.sync_directory_to_bucket(directory, bucket, quiet,
+                                    metadata=PUBLIC_WEBSITE_METADATA)
+
+    @staticmethod
+    def get_directory(opts, bucket, directory, quiet=True):
+        """Copy a bucket to a directory"""
+
+        if opts['packed']:
+            s3.unpack_bucket_to_directory(bucket, directory, quiet,
+                                          region=opts['region'])
+            return
+        s3.sync_bucket_to_directory(bucket, directory, quiet)
+
+    @staticmethod
+    def get_bucket(opts, bucket, directory, exclude=None):
+        """Copy a workspace or output bucket to the workspace"""
+
+        if opts['packed']:
+            s3.unpack_bucket_to_directory(bucket, directory,
+                                          region=opts['region'])
+        else:
+            s3.sync_bucket_to_directory(bucket, directory, exclude=exclude)
+
+    @staticmethod
+    def get_source(opts):
+        """Copy the source bucket or tar file to the source directory"""
+
+        if opts['srctarfile']:
+            tarfile = s3.key_name(opts['srctarfile'])
+            s3.copy_object_to_file(
+                opts['srctarfile'], tarfile, region=opts['region'])
+            untar_source(opts, tarfile)
+        elif opts['packed']:
+            s3.unpack_bucket_to_directory(
+                opts['srcbucket'], opts['srcdir'], region=opts['region'])
+        else:
+            s3.sync_bucket_to_directory(opts['srcbucket'], opts['srcdir'])
+            # make scripts in the source tree executable
+            subprocess.check_call(['chmod', '+x', '-R', opts['srcdir']])
+
+    def get(self, opts, copysrc=True):
+        """Copy the input buckets to the container and return a
+        snapshot of the workspace."""
+
+        if copysrc:
+            self.get_source(opts)
+
+        artifacts = compressed_artifacts(opts)
+        self.get_bucket(opts, opts['wsbucket'], opts['wsdir'])
+        self.get_bucket(opts, opts['outbucket'], opts['wsdir'],
+                        exclude=artifacts)
+        get_artifacts(opts, artifacts)
+
+        # Snapshot the workspace so only new output is packed or compressed
+        return s3.directory_snapshot(opts['wsdir'])
+
+    @staticmethod
+    def put(opts, snapshot, name, publish=None):
+        """Copy the container output to the output bucket.
+
+        When packing, copy the workspace as a pack named name of the
+        files written since the snapshot, and publish the pack members
+        under the prefix publish as individual objects.  When
+        compressing, copy the large artifacts written since the
+        snapshot individually compressed.
+        """
+
+        artifacts = compressed_artifacts(opts)
+        put_artifacts(opts, artifacts, snapshot)
+
+        if opts['packed']:
+            packfile = s3.pack_directory_to_bucket(
+                opts['wsdir'], opts['outbucket'], name,
+                since=snapshot, metadata=PUBLIC_WEBSITE_METADATA,
+                exclude=artifacts, region=opts['region'])
+            # Logs and results at the top of the workspace are read file by file
+            s3.sync_directory_to_bucket(opts['wsdir'], opts['outbucket'],
+                                        metadata=PUBLIC_WEBSITE_METADATA,
+                                        exclude=['*/*'] + artifacts)
+            if publish:
+                s3.publish_pack(packfile, opts['outbucket'], publish,
+                                metadata=PUBLIC_WEBSITE_METADATA,
+                                region=opts['region'])
+            os.remove(packfile)
+            return
+
+        s3.sync_directory_to_bucket(opts['wsdir'], opts['outbucket'],
+                                    metadata=PUBLIC_WEBSITE_METADATA,
+                                    exclude=artifacts)
+
+################################################################
+# Stores keeping each bucket as a tree of files
+#
+# A tree store has methods to fetch the tree for a bucket into a
+# directory and to store the files in a directory changed since a
+# snapshot into the tree for a bucket.  Fetched files are always
+# copied, so a workspace never shares a file with a bucket.  Stored
+# files are linked when link is True and copied otherwise: the
+# directories of the developer are copied so the phases cannot write
+# into them.
+
+class TreeStore:
+    """Buckets kept as trees of files"""
+
+    def fetch(self, opts, bucket, directory):
+        """Copy the tree for a bucket into a directory"""
+        raise NotImplementedError
+
+    def store(self, opts, directory, bucket, since=None, link=True):
+        """Copy the files in a directory into the tree for a bucket"""
+        raise NotImplementedError
+
+    def put_directory(self, opts, directory, bucket, name, quiet=True):
+        """Copy a directory to a bucket"""
+        # pylint: disable=too-many-arguments,unused-argument
+        self.store(opts, directory, bucket, link=False)
+
+    def get_directory(self, opts, bucket, directory, quiet=True):
+        """Copy a bucket to a directory"""
+        # pylint: disable=unused-argument
+        self.fetch(opts, bucket, directory)
+
+    def get_source(self, opts):
+        """Copy the source bucket to the source directory"""
+        self.fetch(opts, opts['srcbucket'], opts['srcdir'])
+
+    def get(self, opts, copysrc=True):
+        """Copy the input buckets to the container and return a
+        snapshot of the workspace."""
+
+        if copysrc:
+            self.get_source(opts)
+        self.fetch(opts, opts['wsbucket'], opts['wsdir'])
+        self.fetch(opts, opts['outbucket'], opts['wsdir'])
+        return s3.directory_snapshot(opts['wsdir'])
+
+    def put(self, opts, snapshot, name, publish=None):
+        """Copy the files written since the snapshot to the output bucket"""
+        # pylint: disable=unused-argument
+        self.store(opts, opts['wsdir'], opts['outbucket'], since=snapshot)
+
+class PosixStore(TreeStore):
+    """Buckets kept as directories on a shared filesystem.
+
+    A bucket that is a local directory (as with the local executor) is
+    used as is.  A bucket that is an S3 path is kept in the directory
+    of the same name under the root of the store.  A bucket missing
+    from the store, such as the source uploaded to S3 by continuous
+    integration, is copied from S3.
+    """
+
+    def __init__(self, root=None):
+        self.root = root and os.path.abspath(os.path.expanduser(root))
+
+    def path(self, bucket):
+        """The directory keeping a bucket"""
+
+        if s3.is_path(bucket):
+            if not self.root:
+                abort("No artifact root for bucket {}".format(bucket))
+            return os.path.join(self.root, s3.path_name(bucket))
+        return os.path.abspath(bucket)
+
+    def fetch(self, opts, bucket, directory):
+        path = self.path(bucket)
+        if os.path.isdir(path):
+            link_tree(path, directory, link=False)
+        elif s3.is_path(bucket):
+            S3Store.get_bucket(opts, bucket, directory)
+
+    def store(self, opts, directory, bucket, since=None, link=True):
+        link_tree(directory, self.path(bucket), since, link)
+
+    def get_source(self, opts):
+        if not opts['srctarfile']:
+            TreeStore.get_source(self, opts)
+            return
+        tarfile = self.path(opts['srctarfile'])
+        if os.path.isfile(tarfile):
+            untar_source(opts, tarfile)
+            return
+        S3Store.get_source(opts)
+
+    def put(self, opts, snapshot, name, publish=None):
+        TreeStore.put(self, opts, snapshot, name, publish)
+        if not s3.is_path(opts['outbucket']):
+            return
+        # Continuous integration reads the logs and results at the top
+        # of the output from S3 as each phase finishes
+        artifacts = compressed_artifacts(opts)
+        put_artifacts(opts, artifacts, snapshot)
+        s3.sync_directory_to_bucket(opts['wsdir'], opts['outbucket'],
+                                    metadata=PUBLIC_WEBSITE_METADATA,
+                                    exclude=['*/*'] + artifacts)
+        if publish:
+            # The report is done: consumers read the output from S3
+            s3.sync_directory_to_bucket(self.path(opts['outbucket']),
+                                        opts['outbucket'],
+                                        metadata=PUBLIC_WEBSITE_METADATA,
+                                        exclude=artifacts)
+
+class MemoryStore(TreeStore):
+    """Buckets kept in memory for tests.
+
+    The buckets are shared by every memory store in the process.  A
+    bucket maps the path of each file relative to the bucket to the
+    contents and mode of the file.
+    """
+
+    BUCKETS = {}
+
+    def fetch(self, opts, bucket, directory):
+        files = self.BUCKETS.get(bucket.rstrip('/'), {})
+        for relpath, (data, mode) in files.items():
+            path = os.path.join(directory, relpath)
+            make_parent(path)
+            with open(path, 'wb') as fileobj:
+                fileobj.write(data)
+            os.chmod(path, mode)
+
+    def store(self, opts, directory, bucket, since=None, link=True):
+        files = self.BUCKETS.setdefault(bucket.rstrip('/'), {})
+        for relpath in changed_files(directory, since):
+            path = os.path.join(directory, relpath)
+            with open(path, 'rb') as fileobj:
+                files[relpath] = (fileobj.read(), os.stat(path).st_mode)
+
+################################################################
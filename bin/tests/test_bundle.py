@@ -0,0 +1,38 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bundle
+
+class PackTest(unittest.TestCase):
+    """Proofs packed into bundles by memory and vCPU demand."""
+
+    def test_first_fit_decreasing(self):
+        items = [('a', 2000, 1), ('b', 6000, 1), ('c', 3000, 1),
+                 ('d', 4000, 1), ('e', 1000, 1)]
+        self.assertEqual(bundle.pack(items, 8000, 4),
+                         [['b', 'a'], ['d', 'c', 'e']])
+
+    def test_vcpus(self):
+        items = [('a', 1000, 2), ('b', 1000, 2), ('c', 1000, 1)]
+        self.assertEqual(bundle.pack(items, 8000, 3),
+                         [['a', 'c'], ['b']])
+
+    def test_too_big(self):
+        items = [('a', 1000, 1), ('big', 16000, 1), ('wide', 1000, 8)]
+        self.assertEqual(bundle.pack(items, 8000, 4),
+                         [['big'], ['wide'], ['a']])
+
+    def test_capacity(self):
+        items = [(name, 2000, 1) for name in 'abcdefghij']
+        bundles = bundle.pack(items, 8000, 4)
+        self.assertEqual(sorted(sum(bundles, [])), list('abcdefghij'))
+        self.assertEqual([len(items) for items in bundles], [4, 4, 2])
+
+    def test_empty(self):
+        self.assertEqual(bundle.pack([], 8000, 4), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cgroup
+
+class CgroupTest(unittest.TestCase):
+    """The cores and memory allotted by cgroup v1 files."""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.root, 'cpu'))
+        os.makedirs(os.path.join(self.root, 'memory'))
+        self.proc = os.path.join(self.root, 'proc-cgroup')
+        self.write('proc-cgroup', '3:cpu,cpuacct:/ecs/task/container\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, name, text):
+        with open(os.path.join(self.root, name), 'w') as fileobj:
+            fileobj.write(text)
+
+    def cpus(self, shares):
+        self.write(os.path.join('cpu', cgroup.CPU_SHARES), shares)
+        with mock.patch('multiprocessing.cpu_count', return_value=16):
+            return cgroup.cpus(self.root, self.proc)
+
+    def test_shares(self):
+        self.assertEqual(self.cpus('1024\n'), 1)
+        self.assertEqual(self.cpus('4096\n'), 4)
+        self.assertEqual(self.cpus('512\n'), 16)
+
+    def test_root_shares(self):
+        self.write('proc-cgroup', '3:cpu,cpuacct:/\n')
+        self.assertEqual(self.cpus('1024\n'), 16)
+
+    def test_quota(self):
+        self.write(os.path.join('cpu', cgroup.CFS_QUOTA), '200000\n')
+        self.write(os.path.join('cpu', cgroup.CFS_PERIOD), '100000\n')
+        self.assertEqual(self.cpus('1024\n'), 2)
+
+    def test_memory_limit(self):
+        path = os.path.join('memory', 'memory.limit_in_bytes')
+        self.write(path, '9223372036854771712\n')
+        self.assertIsNone(cgroup.memory_limit(self.root))
+        self.write(path, '{}\n'.format(2048 * 1024 * 1024))
+        self.assertEqual(cgroup.memory_limit(self.root), 2048)
+
+if __name__ == '__main__':
+    unittest.main()
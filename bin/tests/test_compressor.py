@@ -0,0 +1,46 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import compressor
+
+class CodecTest(unittest.TestCase):
+    """Artifacts are compressed with zstd only when it is recent enough."""
+
+    def setUp(self):
+        self.bindir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.bindir)
+
+    def codec(self, banner):
+        path = os.path.join(self.bindir, compressor.ZSTD)
+        with open(path, 'w') as fileobj:
+            fileobj.write("#!/bin/sh\necho '{}'\n".format(banner))
+        os.chmod(path, 0o755)
+        with mock.patch.dict(os.environ, {'PATH': self.bindir}), \
+             mock.patch.object(compressor, 'ZSTD_COMMAND', []):
+            return compressor.codec()
+
+    def test_old_zstd(self):
+        self.assertEqual(self.codec(
+            '*** zstd command line interface 64-bits v0.5.1, '
+            'by Yann Collet ***'), compressor.GZIP)
+
+    def test_new_zstd(self):
+        self.assertEqual(self.codec(
+            '*** zstd command line interface 64-bits v1.3.3, '
+            'by Yann Collet ***'), compressor.ZSTD)
+
+    def test_no_zstd(self):
+        with mock.patch.dict(os.environ, {'PATH': self.bindir}), \
+             mock.patch.object(compressor, 'ZSTD_COMMAND', []):
+            self.assertEqual(compressor.codec(), compressor.GZIP)
+
+if __name__ == '__main__':
+    unittest.main()
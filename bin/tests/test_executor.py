@@ -0,0 +1,63 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import executor
+
+def running(pid):
+    """Whether a process is running (and not a zombie)."""
+
+    try:
+        with open('/proc/{}/stat'.format(pid)) as fileobj:
+            # The state follows the command name in parentheses
+            return fileobj.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except (IOError, OSError):
+        return False
+
+class SleepingExecutor(executor.LocalExecutor):
+    """A local executor whose phases start a child that outlives them."""
+
+    def __init__(self, root, pidfile):
+        super().__init__(root, 1)
+        self.pidfile = pidfile
+
+    def phase_command(self, job):
+        return ['sh', '-c', 'sleep 60 & echo $! > {}; wait'.format(
+            self.pidfile)]
+
+class LocalExecutorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.pidfile = os.path.join(self.root, 'child.pid')
+        self.local = SleepingExecutor(self.root, self.pidfile)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_timeout_kills_phase_processes(self):
+        self.local.write_job({'jobId': 'job', 'jobName': 'job',
+                              'status': executor.SUBMITTED, 'command': [],
+                              'memory': None, 'vcpus': None, 'timeout': 1,
+                              'dependsOn': [], 'createdAt': time.time()})
+        with mock.patch.object(executor, 'POLL_INTERVAL', 0.1):
+            self.local.run('job')
+
+        job = self.local.read_job('job')
+        self.assertEqual(job['status'], executor.FAILED)
+        with open(self.pidfile) as fileobj:
+            child = int(fileobj.read())
+        for _ in range(50):
+            if not running(child):
+                break
+            time.sleep(0.1)
+        self.assertFalse(running(child))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import json
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import options
+import runoptions
+import s3
+
+class DockerOptionsTest(unittest.TestCase):
+    """The options cbmc-batch sends to docker.py with --jsons survive the
+    round trip through docker_options."""
+
+    def round_trip(self, argv):
+        with mock.patch.object(s3, 'bucket_exists', return_value=True), \
+             mock.patch.object(s3, 'path_exists', return_value=True):
+            opts = options.batch_options(
+                ['--srcdir', '/src', '--wsdir', '/ws', '--jobname', 'job']
+                + argv, validate=False)
+            return opts, options.docker_options(['--jsons',
+                                                 json.dumps(opts)])
+
+    def assertRoundTrip(self, argv, keys):
+        opts, docker = self.round_trip(argv)
+        for key in keys:
+            self.assertEqual(docker[key], opts[key], key)
+
+    def test_property_mode(self):
+        self.assertRoundTrip(['--property-mode', 'lazy', '--trace-jobs', '3'],
+                             ['property_mode', 'trace_jobs'])
+        self.assertRoundTrip(['--property-mode', 'incremental',
+                              '--unwind-start', '4'],
+                             ['property_mode', 'unwind_start'])
+        _, docker = self.round_trip(['--property-mode', 'lazy'])
+        self.assertEqual(docker['property_mode'], runoptions.PROPERTY_LAZY)
+
+    def test_portfolio(self):
+        self.assertRoundTrip(['--portfolio=--unwind;3', '--portfolio=',
+                              '--portfolio-race'],
+                             ['portfolio', 'portfolio_race'])
+
+    def test_gotocache(self):
+        self.assertRoundTrip(['--gotocache', '--gotocache-dir', '/cache',
+                              '--gotocache-bucket', 's3://shared/gotocache'],
+                             ['gotocache', 'gotocache_dir',
+                              'gotocache_bucket'])
+
+if __name__ == '__main__':
+    unittest.main()
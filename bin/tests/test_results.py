@@ -0,0 +1,81 @@
+import gzip
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+from botocore.exceptions import ClientError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import compressor
+import results
+
+CBMC_OUTPUT = (
+    b"CBMC version 5.12\n" +
+    b"[main.assertion.1] line 10 assertion x > 0: FAILURE\n" +
+    b"".join(b"[main.assertion.%d] line %d assertion y > %d: SUCCESS\n"
+             % (prop, prop, prop) for prop in range(2, 500)) +
+    b"\nTrace for main.assertion.1:\n" +
+    b"".join(b"State %d x=%d\n" % (state, state) for state in range(200)) +
+    b"\n** 1 of 499 failed (2 iterations)\nVERIFICATION FAILED\n")
+
+class FakeClient:
+    """An S3 client holding one object, refusing ranges past its end."""
+
+    def __init__(self, body, metadata):
+        self.body = body
+        self.metadata = metadata
+
+    def head_object(self, Bucket, Key):
+        return {'Metadata': self.metadata, 'ContentLength': len(self.body)}
+
+    def get_object(self, Bucket, Key, Range=None):
+        body = self.body
+        if Range is not None:
+            start, end = [int(pos) for pos in
+                          Range[len('bytes='):].split('-')]
+            if start >= len(body):
+                raise ClientError({'Error': {'Code': 'InvalidRange'}},
+                                  'GetObject')
+            body = body[start:end + 1]
+        return {'Metadata': self.metadata, 'Body': io.BytesIO(body)}
+
+class ReadTraceTest(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.output = tempfile.mkstemp()
+        with os.fdopen(handle, 'wb') as fileobj:
+            fileobj.write(CBMC_OUTPUT)
+        self.index = results.index_output(self.output)
+        self.trace = results.read_local_trace(
+            self.output, 'main.assertion.1').decode('utf-8')
+
+    def tearDown(self):
+        os.remove(self.output)
+
+    def test_uncompressed_trace(self):
+        client = FakeClient(CBMC_OUTPUT, {})
+        self.assertEqual(results.read_trace(client, 'bucket', 'cbmc.txt',
+                                            self.index, 'main.assertion.1'),
+                         self.trace)
+
+    def test_compressed_trace(self):
+        compressed = gzip.compress(CBMC_OUTPUT)
+        # The trace lies past the end of the compressed object
+        self.assertLess(len(compressed),
+                        results.trace_range(self.index, 'main.assertion.1')[0])
+        client = FakeClient(compressed,
+                            {compressor.ENCODING_METADATA: compressor.GZIP})
+        self.assertEqual(results.read_trace(client, 'bucket', 'cbmc.txt',
+                                            self.index, 'main.assertion.1'),
+                         self.trace)
+
+    def test_no_trace(self):
+        client = FakeClient(CBMC_OUTPUT, {})
+        self.assertIsNone(results.read_trace(client, 'bucket', 'cbmc.txt',
+                                             self.index, 'main.assertion.2'))
+
+if __name__ == '__main__':
+    unittest.main()
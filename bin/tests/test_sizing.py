@@ -0,0 +1,110 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sizing
+
+def options(**kwargs):
+    opts = {'bucket': 's3://bucket', 'taskname': 'proof', 'region': None,
+            'build_memory': 8000, 'property_memory': 4000, 'sizing': True}
+    opts.update(kwargs)
+    return opts
+
+def sample(memory, duration=100, parallelism=1.0, processes=1):
+    return {'memory': memory, 'duration': duration,
+            'parallelism': parallelism, 'processes': processes}
+
+class ChooseTest(unittest.TestCase):
+    """The memory, vCPUs, and timeout chosen for a phase."""
+
+    def choose(self, opts, phase, samples):
+        record = {'samples': samples} if samples is not None else None
+        with mock.patch.object(sizing.history, 'read_record',
+                               return_value=record):
+            return sizing.choose(opts, phase)
+
+    def test_no_sizing(self):
+        self.assertEqual(
+            self.choose(options(sizing=False), 'build', [sample(100)]),
+            (8000, None, None))
+
+    def test_no_history(self):
+        self.assertEqual(self.choose(options(), 'build', None),
+                         (8000, None, None))
+        self.assertEqual(self.choose(options(), 'build', []),
+                         (8000, None, None))
+
+    def test_history(self):
+        memory, vcpus, timeout = self.choose(
+            options(), 'build',
+            [sample(3000, duration=1000, parallelism=1.5),
+             sample(5000, duration=2000, parallelism=2.5)])
+        # 5000 MB with headroom, rounded up to a multiple of 1024
+        self.assertEqual(memory, 8192)
+        self.assertEqual(vcpus, 3)
+        self.assertEqual(timeout, 6000)
+
+    def test_minimums(self):
+        self.assertEqual(self.choose(options(), 'build', [sample(10)]),
+                         (sizing.MIN_MEMORY, 1, sizing.MIN_TIMEOUT))
+
+    def test_max_memory(self):
+        memory, _, _ = self.choose(options(max_memory=6000), 'build',
+                                   [sample(5000)])
+        self.assertEqual(memory, 6000)
+
+    def test_vcpus_given(self):
+        _, vcpus, _ = self.choose(options(build_vcpus=8), 'build',
+                                  [sample(1000, parallelism=2.0)])
+        self.assertEqual(vcpus, 8)
+
+    def test_portfolio(self):
+        opts = options(portfolio=['a', 'b', 'c'], sizing=False)
+        self.assertEqual(self.choose(opts, 'property', None),
+                         (12000, 3, None))
+        # Only the property phase races the portfolio
+        self.assertEqual(self.choose(opts, 'build', None),
+                         (8000, None, None))
+
+    def test_portfolio_history(self):
+        # A race of two variants and a run of one size the race alike
+        opts = options(portfolio=['a', 'b', 'c'])
+        for samples in [[sample(4000, parallelism=2.0, processes=2)],
+                        [sample(2000, parallelism=1.0)]]:
+            memory, vcpus, _ = self.choose(opts, 'property', samples)
+            self.assertEqual(memory, 9216)
+            self.assertEqual(vcpus, 3)
+
+class EscalateTest(unittest.TestCase):
+    """The options for retrying a phase that ran out of memory."""
+
+    def test_escalate(self):
+        retry = sizing.escalate(options(), 'property', 4000)
+        self.assertEqual(retry['property_memory'], 8000)
+        self.assertEqual(retry['oom_attempt'], 1)
+        self.assertFalse(retry['sizing'])
+        self.assertEqual([phase for phase in sizing.PHASES if retry[phase]],
+                         ['property', 'report'])
+
+    def test_retries(self):
+        retry = sizing.escalate(options(), 'build', 8000)
+        retry = sizing.escalate(retry, 'build', retry['build_memory'])
+        self.assertEqual(retry['build_memory'], 32000)
+        self.assertIsNone(sizing.escalate(retry, 'build', 32000))
+
+    def test_max_memory(self):
+        retry = sizing.escalate(options(max_memory=12000), 'build', 8000)
+        self.assertEqual(retry['build_memory'], 12000)
+        self.assertIsNone(sizing.escalate(retry, 'build', 12000))
+
+    def test_portfolio(self):
+        # The memory of a race is stored for each variant
+        retry = sizing.escalate(options(portfolio=['a', 'b']), 'property',
+                                8000)
+        self.assertEqual(retry['property_memory'], 8000)
+
+if __name__ == '__main__':
+    unittest.main()
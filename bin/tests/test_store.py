@@ -0,0 +1,65 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import store
+
+class PosixStoreTest(unittest.TestCase):
+    """Workspaces never share files with the buckets of a POSIX store."""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.bucket = os.path.join(self.root, 'bucket')
+        self.store = store.PosixStore()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def workspace(self, name):
+        return os.path.join(self.root, name)
+
+    @staticmethod
+    def write(path, data, mode='w'):
+        store.make_parent(path)
+        with open(path, mode) as fileobj:
+            fileobj.write(data)
+
+    @staticmethod
+    def read(path):
+        with open(path) as fileobj:
+            return fileobj.read()
+
+    def test_write_in_workspace(self):
+        self.write(os.path.join(self.bucket, 'proof', 'cbmc.txt'), 'bucket')
+        self.store.fetch({}, self.bucket, self.workspace('ws1'))
+        self.store.fetch({}, self.bucket, self.workspace('ws2'))
+
+        # Rewrite the file in place, as a tool appending to it would
+        self.write(os.path.join(self.workspace('ws1'), 'proof', 'cbmc.txt'),
+                   'ws1', 'r+')
+
+        self.assertEqual(
+            self.read(os.path.join(self.bucket, 'proof', 'cbmc.txt')),
+            'bucket')
+        self.assertEqual(
+            self.read(os.path.join(self.workspace('ws2'), 'proof',
+                                   'cbmc.txt')),
+            'bucket')
+
+    def test_write_after_store(self):
+        wsdir = self.workspace('ws')
+        self.write(os.path.join(wsdir, 'goto'), 'built')
+        self.store.store({}, wsdir, self.bucket)
+        self.store.fetch({}, self.bucket, wsdir)
+
+        self.write(os.path.join(wsdir, 'goto'), 'rebuilt', 'r+')
+
+        self.assertEqual(self.read(os.path.join(self.bucket, 'goto')),
+                         'built')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,314 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Phase tasks passed to long-lived workers through a queue.
+
+Each Batch job cold-starts a container, installs the packages, and
+runs one phase of one proof.  A worker is a container that installs
+the packages once and then runs phase tasks pulled from a queue until
+the queue has been idle for a while.  A task is a JSON message giving
+the phase to run and the job options for the proof.
+
+The queue is an SQS queue named by its URL, or a directory standing
+in for a queue on the local machine.  A task received from a queue is
+hidden from other workers for a visibility timeout, and the worker
+running the task extends the timeout with a heartbeat until the task
+is done and deleted from the queue.  If the worker dies, the task
+reappears in the queue when the timeout expires.
+
+Workers enqueue the phases downstream of the build when the build
+succeeds.  A phase whose upstream phases have not all finished is put
+back in the queue with a delay, and each finished phase writes a
+marker giving its status to the output bucket of the proof.
+
+Worker mode is outside continuous integration.  The CI updates GitHub
+from the Batch job state events of the phases of each proof, and a
+phase run by a worker is not a Batch job of its own (the workers are
+jobs named <jobname>-worker<n>, which the CI ignores), so the CI
+refuses to launch a proof with a worker queue.
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+
+import boto3
+from botocore.exceptions import ClientError
+
+import clienterror
+import s3
+import sizing
+
+################################################################
+
+class WorkerException(Exception):
+    """Exception thrown by worker methods."""
+
+    def __init__(self, msg):
+        super(WorkerException, self).__init__()
+        self.message = msg
+
+    def __str__(self):
+        return self.message
+
+    def __repr__(self):
+        return self.message
+
+def abort(msg):
+    """Abort a worker method."""
+    raise WorkerException(msg)
+
+################################################################
+
+VISIBILITY_TIMEOUT = 300
+HEARTBEAT_INTERVAL = 60
+RECEIVE_WAIT = 20
+REQUEUE_DELAY = 60
+
+SUCCEEDED = 'SUCCEEDED'
+FAILED = 'FAILED'
+
+################################################################
+# Queues
+#
+# A queue has methods to send a message body with a delay, receive a
+# message hidden for a visibility timeout (or None if no message
+# arrives within RECEIVE_WAIT seconds), extend the visibility timeout
+# of a message received, and delete a message received.
+
+class SqsQueue:
+    """An SQS queue"""
+
+    def __init__(self, url, region=None):
+        self.url = url
+        self.client = boto3.client('sqs', region_name=region)
+
+    def send(self, body, delay=0):
+        """Send a message"""
+        try:
+            self.client.send_message(QueueUrl=self.url, MessageBody=body,
+                                     DelaySeconds=min(delay, 900))
+        except ClientError as exc:
+            abort("Failed to send message to {}: {}"
+                  .format(self.url, clienterror.message(exc)))
+
+    def receive(self, visibility=VISIBILITY_TIMEOUT):
+        """Receive a message, or None"""
+        try:
+            response = self.client.receive_message(
+                QueueUrl=self.url, MaxNumberOfMessages=1,
+                VisibilityTimeout=visibility, WaitTimeSeconds=RECEIVE_WAIT)
+        except ClientError as exc:
+            abort("Failed to receive message from {}: {}"
+                  .format(self.url, clienterror.message(exc)))
+        messages = response.get('Messages')
+        if not messages:
+            return None
+        return {'body': messages[0]['Body'],
+                'handle': messages[0]['ReceiptHandle']}
+
+    def extend(self, message, visibility=VISIBILITY_TIMEOUT):
+        """Extend the visibility timeout of a message"""
+        self.client.change_message_visibility(
+            QueueUrl=self.url, ReceiptHandle=message['handle'],
+            VisibilityTimeout=visibility)
+
+    def delete(self, message):
+        """Delete a message"""
+        self.client.delete_message(QueueUrl=self.url,
+                                   ReceiptHandle=message['handle'])
+
+class DirectoryQueue:
+    """A directory standing in for a queue on the local machine.
+
+    A message waiting in the queue is a file named for the time it
+    becomes visible.  A message received is moved to the subdirectory
+    'inflight' and named for the time its visibility timeout expires.
+    Renaming is atomic, so only one worker can receive a message.
+    """
+
+    INFLIGHT = 'inflight'
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.inflight = os.path.join(directory, self.INFLIGHT)
+        if not os.path.isdir(self.inflight):
+            os.makedirs(self.inflight)
+
+    @staticmethod
+    def name(when, ident):
+        """The name of a message file"""
+        return "{:017.6f}-{}.json".format(when, ident)
+
+    @staticmethod
+    def parse(name):
+        """The time and identifier in the name of a message file"""
+        when, ident = name[:-len('.json')].split('-', 1)
+        return float(when), ident
+
+    def send(self, body, delay=0):
+        """Send a message"""
+        ident = uuid.uuid4().hex
+        tmp = os.path.join(self.directory, '.' + ident)
+        with open(tmp, 'w') as fileobj:
+            fileobj.write(body)
+        os.rename(tmp, os.path.join(self.directory,
+                                    self.name(time.time() + delay, ident)))
+
+    def expire(self):
+        """Return messages whose visibility timeout expired to the queue"""
+        now = time.time()
+        for name in os.listdir(self.inflight):
+            when, ident = self.parse(name)
+            if when <= now:
+                try:
+                    os.rename(os.path.join(self.inflight, name),
+                              os.path.join(self.directory,
+                                           self.name(now, ident)))
+                except OSError:
+                    pass
+
+    def claim(self, visibility):
+        """Claim the first visible message, or return None"""
+        now = time.time()
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith('.json'):
+                continue
+            when, ident = self.parse(name)
+            if when > now:
+                break
+            handle = os.path.join(self.inflight,
+                                  self.name(now + visibility, ident))
+            try:
+                os.rename(os.path.join(self.directory, name), handle)
+            except OSError:
+                # Another worker claimed the message first
+                continue
+            with open(handle) as fileobj:
+                return {'body': fileobj.read(), 'handle': handle}
+        return None
+
+    def receive(self, visibility=VISIBILITY_TIMEOUT):
+        """Receive a message, or None"""
+        deadline = time.time() + RECEIVE_WAIT
+        while True:
+            self.expire()
+            message = self.claim(visibility)
+            if message is not None or time.time() >= deadline:
+                return message
+            time.sleep(1)
+
+    def extend(self, message, visibility=VISIBILITY_TIMEOUT):
+        """Extend the visibility timeout of a message"""
+        _, ident = self.parse(os.path.basename(message['handle']))
+        handle = os.path.join(self.inflight,
+                              self.name(time.time() + visibility, ident))
+        os.rename(message['handle'], handle)
+        message['handle'] = handle
+
+    def delete(self, message):
+        """Delete a message"""
+        os.remove(message['handle'])
+
+def open_queue(url, region=None):
+    """The queue named by an SQS queue URL or a local directory"""
+
+    if url.startswith('https://'):
+        return SqsQueue(url, region)
+    return DirectoryQueue(url)
+
+class Heartbeat:
+    """Extend the visibility timeout of a message until stopped"""
+
+    def __init__(self, queue, message, interval=HEARTBEAT_INTERVAL,
+                 visibility=VISIBILITY_TIMEOUT):
+        # pylint: disable=too-many-arguments
+        self.queue = queue
+        self.message = message
+        self.interval = interval
+        self.visibility = visibility
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.beat)
+        self.thread.daemon = True
+
+    def beat(self):
+        """Extend the visibility timeout every interval"""
+        while not self.stopped.wait(self.interval):
+            try:
+                self.queue.extend(self.message, self.visibility)
+            except (ClientError, OSError) as exc:
+                print("Failed to extend visibility of task: {}".format(exc))
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stopped.set()
+        self.thread.join()
+
+################################################################
+# Tasks
+
+def task_body(opts, phase):
+    """The message body for a task running a phase of a proof"""
+
+    return json.dumps({'phase': phase, 'opts': opts})
+
+def initial_phases(opts):
+    """The phases to enqueue first: the build, or every phase if there
+    is no build"""
+
+    if opts['build']:
+        return ['build']
+    return [phase for phase in sizing.PHASES if opts[phase]]
+
+def followup_phases(opts, phase):
+    """The phases to enqueue when a phase succeeds"""
+
+    if phase != 'build':
+        return []
+    return [other for other in sizing.PHASES
+            if other != 'build' and opts[other]]
+
+def upstream_phases(opts, phase):
+    """The phases that must succeed before a phase can run"""
+
+    return [other for other in sizing.PHASES
+            if other != phase and phase in sizing.RERUN[other] and opts[other]]
+
+def submit(opts, url):
+    """Enqueue the tasks for a proof and return the phase job names"""
+
+    queue = open_queue(url, opts['region'])
+    for phase in initial_phases(opts):
+        queue.send(task_body(opts, phase))
+    return {phase: "{}-{}".format(opts['jobname'], phase)
+            for phase in sizing.PHASES if opts[phase]}
+
+def marker_path(opts, phase):
+    """The S3 path to the marker written when a phase finishes"""
+
+    return "{}/{}-done.json".format(opts['outbucket'], phase)
+
+def write_marker(opts, phase, status):
+    """Write the marker giving the status of a finished phase"""
+
+    s3.put_json(marker_path(opts, phase), {'phase': phase, 'status': status},
+                region=opts['region'])
+
+def read_marker(opts, phase):
+    """The status of a phase, or None if the phase has not finished"""
+
+    try:
+        return s3.get_json(marker_path(opts, phase),
+                           region=opts['region'])['status']
+    except ClientError as exc:
+        if clienterror.code(exc) not in ['NoSuchKey', '404']:
+            raise
+        return None
+
+################################################################
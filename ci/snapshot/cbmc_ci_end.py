@@ -3,28 +3,175 @@
 
 """Lambda function invoked in response to a Batch job changing state."""
 
+import functools
 import re
 import os
+import time
 import traceback
 import json
 
 import boto3
+from botocore.exceptions import ClientError
 
+import bundle
+from cbmc import CBMC
 from cbmc_ci_github import update_status
+import clienterror
 import clog_writert
+import compressor
+import job_manifest
+import results
+import s3
+import sizing
 
 # S3 Bucket name for storing CBMC Batch packages and outputs
 bkt = os.environ['S3_BUCKET_PROOFS']
 PROPERTY = "property"
 REPORT = "report"
+MANIFEST_CACHE_SIZE = 256
 
 def read_from_s3(s3_path):
     """Read from a file in S3 Bucket
 
-    For getting bookkeeping information from the S3 bucket.
+    For getting bookkeeping information from the S3 bucket.  Objects
+    written compressed are decompressed on read.
     """
-    s3 = boto3.client('s3')
-    return s3.get_object(Bucket=bkt, Key=s3_path)['Body'].read()
+    client = boto3.client('s3')
+    return s3.read_body(client.get_object(Bucket=bkt, Key=s3_path))
+
+# Manifests are written once at launch, so they are cached across the
+# invocations of a warm lambda.  A job without a manifest raises
+# ValueError, and lru_cache caches no exceptions, so a missing
+# manifest is never cached.
+@functools.lru_cache(maxsize=MANIFEST_CACHE_SIZE)
+def read_job_manifest(s3_dir):
+    """Read the bookkeeping for a job written at launch"""
+    return job_manifest.read_manifest(boto3.client('s3'), bkt, s3_dir)
+
+def expected_in_output(s3_dir, expected):
+    """Test for the expected substring in the CBMC output.
+
+    Read the index of the results written by the property phase and
+    not the CBMC output itself, which can be hundreds of megabytes with
+    traces.  The index holds only the results, so when the substring
+    is not found there, and for jobs run before the property phase
+    wrote an index, scan the output chunk by chunk as before.
+    """
+    try:
+        index = read_from_s3(s3_dir + "/out/" + results.RESULTS_INDEX)
+        if results.expected_in_index(results.load_index(index), expected):
+            return True
+    except ClientError as exc:
+        if clienterror.code(exc) != 'NoSuchKey':
+            raise
+
+    client = boto3.client('s3')
+    response = client.get_object(Bucket=bkt,
+                                 Key=s3_dir + "/out/" + results.CBMC_OUTPUT)
+    if compressor.encoding(response.get('Metadata')):
+        return expected in s3.read_body(response)
+    tail = b''
+    for chunk in response['Body'].iter_chunks():
+        if expected in tail + chunk:
+            return True
+        tail = chunk[-len(expected):] if expected else b''
+    return not expected
+
+RETRY_MANIFEST = "retry.json"
+
+def retry_out_of_memory(job_name_info, detail):
+    """Resubmit a phase killed for running out of memory.
+
+    The phase is resubmitted with more memory together with the phases
+    downstream of it, which Batch failed as dependent jobs.  Return
+    True if the phase was resubmitted.
+    """
+    if not sizing.out_of_memory(detail):
+        return False
+    command = detail.get('container', {}).get('command', [])
+    if '--jsons' not in command:
+        return False
+    opts = json.loads(command[command.index('--jsons') + 1])
+
+    phase = job_name_info.type
+    memory = detail.get('container', {}).get('memory') or opts[phase + '_memory']
+    retry = sizing.escalate(opts, phase, memory)
+    if retry is None:
+        print("Not retrying {}: out of memory after {} retries"
+              .format(detail['jobName'], opts.get('oom_attempt', 0)))
+        return False
+
+    print("Retrying {} with {} MB after running out of memory with {} MB"
+          .format(detail['jobName'], retry[phase + '_memory'], memory))
+    jobs = CBMC(retry).submit_jobs()
+    client = boto3.client('s3')
+    client.put_object(Bucket=bkt,
+                      Key=job_name_info.get_s3_dir() + "/" + RETRY_MANIFEST,
+                      Body=json.dumps({'attempt': retry['oom_attempt'],
+                                       'phase': phase,
+                                       'memory': retry[phase + '_memory'],
+                                       'jobs': jobs}, indent=2))
+    return True
+
+def superseded_by_retry(job_name_info, detail):
+    """A dependent job failed because a phase it depends on was retried."""
+
+    if 'Dependent Job failed' not in detail.get('statusReason', ''):
+        return False
+    try:
+        read_from_s3(job_name_info.get_s3_dir() + "/" + RETRY_MANIFEST)
+    except ClientError as exc:
+        if clienterror.code(exc) != 'NoSuchKey':
+            raise
+        return False
+    return True
+
+def report_runtime(s3_dir, detail, response):
+    """Report the actual runtime of a proof next to the predicted runtime."""
+
+    schedule = read_job_manifest(s3_dir)['schedule']
+    if not schedule:
+        return
+    stopped = detail.get('stoppedAt')
+    stopped = stopped / 1000.0 if stopped else time.time()
+    runtime = {'actual_runtime': stopped - schedule['launched'],
+               'predicted_runtime': schedule['predicted_runtime'],
+               'predicted_makespan': schedule['predicted_makespan']}
+    print("Runtime of {}: {:.0f}s actual, {:.0f}s predicted "
+          "(predicted makespan {:.0f}s)".format(
+              s3_dir, runtime['actual_runtime'],
+              runtime['predicted_runtime'], runtime['predicted_makespan']))
+    response['runtime'] = runtime
+
+
+def bundle_member_events(job_name_info, event):
+    """The events for the phases of the proofs run by a bundle.
+
+    Each proof in a bundle writes a completion marker giving the status
+    of its phases.  A proof with no marker was cut short by the failure
+    of the bundle, and all of its phases are taken to have failed.
+    """
+    members = json.loads(read_from_s3(
+        job_name_info.get_s3_dir() + "/" + bundle.MANIFEST))['members']
+    events = []
+    for member in members:
+        try:
+            done = json.loads(read_from_s3(
+                member['jobname'] + "/out/" + bundle.DONE))
+            phases = done['phases']
+        except ClientError as exc:
+            if clienterror.code(exc) != 'NoSuchKey':
+                raise
+            print("No completion marker for {}".format(member['jobname']))
+            phases = {phase: bundle.FAILED
+                      for phase in sizing.PHASES if member.get(phase)}
+        for phase in sizing.PHASES:
+            if phase in phases:
+                detail = dict(event["detail"],
+                              jobName="{}-{}".format(member['jobname'], phase),
+                              status=phases[phase])
+                events.append(dict(event, detail=detail))
+    return events
 
 
 class Job_name_info:
@@ -45,6 +192,9 @@ class Job_name_info:
     def is_cbmc_report_job(self):
         return self.is_cbmc_batch_job and self.type == REPORT
 
+    def is_cbmc_bundle_job(self):
+        return self.is_cbmc_batch_job and self.type == bundle.BUNDLE
+
     @staticmethod
     def check_job_name(job_name):
         """Check job_name to see if it matches CBMC Batch naming conventions"""
@@ -106,11 +256,9 @@ class CbmcResponseHandler:
 
         if self.status == "SUCCEEDED":
             # Get expected output substring
-            expected = read_from_s3(self.s3_dir + "/expected.txt")
-            self.response['expected_result'] = expected.decode('ascii')
-            # Get CBMC output
-            cbmc = read_from_s3(self.s3_dir + "/out/cbmc.txt")
-            if expected in cbmc:
+            expected = read_job_manifest(self.s3_dir)['expected'].encode('utf-8')
+            self.response['expected_result'] = expected.decode('utf-8')
+            if expected_in_output(self.s3_dir, expected):
                 print("Expected Verification Result: {}".format(self.s3_dir))
                 update_status(
                     "success", self.job_dir, self.s3_dir, self.desc, self.repo_id, self.sha, self.is_draft, post_url=post_url)
@@ -143,10 +291,38 @@ def lambda_handler(event, context):
 
     print("CBMC CI End Event")
     print(json.dumps(event))
+    job_name_info = Job_name_info(event["detail"]["jobName"])
+    if (event["detail"]["status"] in ["SUCCEEDED", "FAILED"] and
+            job_name_info.is_cbmc_bundle_job()):
+        # Handle the phases of each proof in the bundle as if they had
+        # been run by jobs of their own
+        pending_exception = None
+        for member_event in bundle_member_events(job_name_info, event):
+            try:
+                handle_job_event(member_event, context, retry=False)
+            except Exception as e:  # pylint: disable=broad-except
+                pending_exception = e
+        if pending_exception is not None:
+            raise pending_exception
+        return
+    handle_job_event(event, context)
+
+def handle_job_event(event, context, retry=True):
+    """Update the status of the GitHub commit for a Batch job event.
+
+    A phase killed for running out of memory is resubmitted if retry
+    is True.
+    """
     job_name = event["detail"]["jobName"]
     job_id = event["detail"]["jobId"]
     status = event["detail"]["status"]
     job_name_info = Job_name_info(job_name)
+    if status in ["FAILED"] and job_name_info.is_cbmc_batch_job and retry:
+        if retry_out_of_memory(job_name_info, event["detail"]):
+            return
+        if superseded_by_retry(job_name_info, event["detail"]):
+            print(f"Job {job_name} failed on a phase that has been retried")
+            return
     if status in ["FAILED"]:
         print(f"ERROR: The following job has failed: {job_name} with status {status}")
         raise Exception(f"The following job has failed: {job_name} with status {status}")
@@ -157,12 +333,11 @@ def lambda_handler(event, context):
         # Prepare description for GitHub status update
         desc = "CBMC Batch job " + job_name + " " + status
         # Get bookkeeping information about commit
-        repo_id = int(read_from_s3(s3_dir + "/repo_id.txt"))
-        sha = read_from_s3(s3_dir + "/sha.txt").decode('ascii')
-        draft_status = read_from_s3(s3_dir + "/is_draft.txt").decode('ascii')
-        is_draft = draft_status.lower() == "true"
-        correlation_list = read_from_s3(s3_dir + "/correlation_list.txt").decode('ascii')
-        event["correlation_list"] = json.loads(correlation_list)
+        manifest = read_job_manifest(s3_dir)
+        repo_id = manifest['repo_id']
+        sha = manifest['sha']
+        is_draft = manifest['is_draft']
+        event["correlation_list"] = list(manifest['correlation_list'])
         response = {}
 
         # AWS batch 'magic' that must be added to wire together subprocesses since we don't modify cbmc-batch
@@ -191,6 +366,7 @@ def lambda_handler(event, context):
                 response_handler.handle_github_update(post_url=False)
             elif job_name_info.is_cbmc_report_job():
                 response_handler.handle_github_update(post_url=True)
+                report_runtime(s3_dir, event["detail"], response)
             else:
                 response['status'] = clog_writert.SUCCEEDED if (status == "SUCCEEDED") else clog_writert.FAILED
 
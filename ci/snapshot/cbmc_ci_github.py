@@ -3,14 +3,15 @@
 
 import json
 import os
-import tarfile
-import urllib
 
 import boto3
 import github
 
 from cbmc_ci_timer import Timer
 CBMC_RETRY_KEYWORDS = ["CBMC_RETRY", "/cbmc run checks"]
+# Dummy branch name for an event triggered by a retry keyword
+RETRY_BRANCH = "COMMENT_RETRY"
+CONTEXT_PREFIX = "CBMC Batch: "
 
 def update_github_status(repo_id, sha, status, ctx, desc, jobname, post_url = False):
     target_url = None
@@ -29,7 +30,7 @@ def update_github_status(repo_id, sha, status, ctx, desc, jobname, post_url = Fa
             "commit": sha,
             "pr": pr,
             "status": status,
-            "context": "CBMC Batch: " + ctx,
+            "context": CONTEXT_PREFIX + ctx,
             "description": desc,
             "cloudfront_url": target_url
         }
@@ -111,84 +112,26 @@ def update_status(status, ctx, jobname, desc, repo_id, sha, no_status_metric, po
         )
     timer.end()
 
-
-def fetch_tar(tar_path, tar_URL):
-    """
-    Download tar_URL to tar_path.
-
-    GitHub may require authorization in case of private repositories. This is
-    accomplished by setting an "Authorization" HTTP header to the GitHub
-    personal access (OAuth) token.
+def get_statuses(repo_id, sha):
     """
-    print("downloading {} to {}".format(tar_URL, tar_path))
-    token = get_github_personal_access_token()
-    request = urllib.request.Request(
-        url=tar_URL, headers={"Authorization": "token " + token})
-    response = urllib.request.urlopen(request)
-    with open(tar_path, "wb") as tar:
-        tar.write(response.read())
+    Get the latest CBMC Batch statuses of a commit as a dict from context
+    (without the "CBMC Batch: " prefix) to the status.
 
-
-def extract_tar(tmp_dir, tar_path):
-    """
-    Extract a tar archive downloaded from GitHub.
-
-    All files in the archive should be contained in a single top-level
-    directory - the code below actually checks that all files share a common
-    prefix, which must be a directory. The name of that directory varies, and
-    is thus found as the common prefix and returned to the caller.
+    Relevant documentation:
+    https://developer.github.com/v3/repos/statuses/#list-statuses-for-a-specific-ref
     """
-    print("Extracting tar file {} to directory {}".format(tar_path, tmp_dir))
-
-    prefix = None
-    with tarfile.open(tar_path) as tar:
-        paths = tar.getnames()
-        for p in paths:
-            if p.startswith('/') or '..' in p:
-                raise ValueError("Invalid filename")
-        prefix = os.path.commonprefix(paths)
-
-        kwds = {"path": tmp_dir}
-        # The FreeRTOS repository is larger than the writeable disk
-        # space available in a lambda.  Our solution is to omit a 250M
-        # directory not needed by current CBMC proofs.  This is a
-        # project-specific solution that will be replaced in the
-        # future by a general solution that extracts only the
-        # cbmc-batch.yaml files needed to launch the CBMC proofs.
-        if "freertos" in tar_path:
-            kwds["members"] = [member
-                               for member in tar.getmembers()
-                               if "lib/third_party/mcu_vendor"
-                               not in member.name]
-
-        timer = Timer("Extract tar containing code for commit")
-        tar.extractall(**kwds)
-        timer.end()
-
-    print(str(os.listdir(tmp_dir)))
-    if not prefix or not os.path.isdir(os.path.join(tmp_dir, prefix)):
-        raise ValueError("No common root base directory found")
-
-    return prefix
-
-def get_tar(name, full_name, sha, tmp_dir):
-    """Get tar containing the code for the commit"""
-    timer = Timer("Get tar containing code for commit")
-    tar_name = sha + ".tar.gz"
-    tar_URL = "https://api.github.com/repos/{}/tarball/{}".format(
-        full_name, str(sha))
-    tar_file = full_name.replace('/', '-') + "-" + tar_name
-    tar_path = os.path.join(tmp_dir, tar_file)
-    fetch_tar(tar_path, tar_URL)
-    timer.end()
-
-    timer = Timer("Uploading tar containing code for commit to S3")
-    s3 = boto3.client('s3')
-    s3.upload_file(
-        Bucket=os.environ['S3_BUCKET_PROOFS'], Key=tar_file, Filename=tar_path)
+    timer = Timer("Getting GitHub statuses of {}".format(sha))
+    repo = github.Github(get_github_personal_access_token()).get_repo(
+        int(repo_id))
+    statuses = {}
+    # Statuses are listed most recent first
+    for status in repo.get_commit(sha).get_statuses():
+        if not status.context.startswith(CONTEXT_PREFIX):
+            continue
+        statuses.setdefault(status.context[len(CONTEXT_PREFIX):], status)
     timer.end()
+    return statuses
 
-    return (tar_path, tar_file)
 
 def parse_pr(body):
     """
@@ -250,7 +193,7 @@ def parse_issue_type(body):
 
     base_repo_name = body["repository"]["full_name"]
     base_repo_id = body["repository"]["id"]
-    base_repo_branch = "COMMENT_RETRY"
+    base_repo_branch = RETRY_BRANCH
     draft = False  # FIXME: We are assuming always not a draft
     pr_num = body["issue"]["number"]
     head_sha = f"origin/pr/{pr_num}"
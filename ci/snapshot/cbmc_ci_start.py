@@ -3,8 +3,6 @@
 
 """Lambda function to invoke CBMC Batch upon a GitHub webhook event."""
 
-import tarfile
-import re
 import glob
 import json
 import os
@@ -17,51 +15,20 @@ import boto3
 
 
 import clog_writert
-import cbmc_batch
 import cbmc_ci_github
+import job_manifest
+import proof_manifest
+from launcher import Launcher
 from cbmc_ci_timer import Timer
 
-# The name of the directory expected to exist in the GitHub repo that contains
-# the a directory per proof; we used to use .cbmc-batch/jobs, but more recent
-# projects should use cbmc/proofs
-jobs_dirs = ["cbmc/proofs", ".cbmc-batch/jobs"]
-
 # Expected name for CBMC Batch yaml
-yaml_name = "cbmc-batch.yaml"
+yaml_name = proof_manifest.YAML_NAME
 
 # S3 Bucket name for storing CBMC Batch packages and outputs
 # FIX: Lambdas put S3_BKT in env, CodeBuild puts S3_BUCKET in env.
 bkt_proofs = os.environ.get('S3_BUCKET_PROOFS')
 bkt_tools = os.environ.get('S3_BUCKET_TOOLS')
 
-def scan_tarfile_for_proofs(tarfile_name, proof_markers):
-    """Return a list of (proof_root, proof_subdir) pairs for every proof
-    directory found in the tar file.
-
-    A proof directory is any directory under one of the proof markers
-    (expected to be 'cbmc/proofs' and '.cbmc-batch/jobs') containing a
-    file named 'cbmc-batch.yaml'.
-    """
-    print("Scanning '{}' for CBMC proofs".format(tarfile_name))
-
-    proofs = []
-    try:
-        with tarfile.open(tarfile_name) as tar:
-            for tarinfo in tar.getmembers():
-                name = tarinfo.name
-                for proof_marker in proof_markers:
-                    match = re.match(
-                        "(.*/{})/(.*)/cbmc-batch.yaml".format(proof_marker),
-                        name)
-                    if match:
-                        proofs.append((match.group(1), match.group(2)))
-                        break
-    except (tarfile.ReadError, IOError) as err:
-        print("Couldn't scan '{}' for CBMC proofs: {}".format(tarfile_name,
-                                                              str(err)))
-        return None
-    return proofs
-
 def lambda_handler(event, context):
     """
     Start CBMC Batch jobs and update the GitHub commit status to "pending" for
@@ -121,6 +88,11 @@ def lambda_handler(event, context):
                     'value': sha,
                     'type': 'PLAINTEXT'
                 },
+                {
+                    'name': 'CBMC_BRANCH',
+                    'value': branch,
+                    'type': 'PLAINTEXT'
+                },
                 {
                     'name': 'CBMC_IS_DRAFT',
                     'value': str(is_draft),
@@ -152,63 +124,42 @@ def lambda_handler(event, context):
 
     return 0
 
-def generate_cbmc_makefiles(group_names, topdir):
-    ran = False
-    for directory in find_proof_groups(group_names, topdir):
-        files = os.listdir(directory)
-        if "make-common-makefile.py" in files and "make-proof-makefiles.py" in files:
-            cwd = os.getcwd()
-            os.chdir(directory)
-            print("Running make-common-makefile.py in {}".format(directory))
-            os.system("python make-common-makefile.py")
-            print("Running make-proof-makefiles.py in {}".format(directory))
-            os.system("python make-proof-makefiles.py")
-            os.chdir(cwd)
-            ran = True
-    return ran
+def tarfile_path(tar_file):
+    """The S3 path to a source archive file."""
+    return "s3://{}/{}".format(bkt_proofs, tar_file)
 
-def find_proof_groups(group_names, topdir='.'):
-    """Find CBMC proof group directories under topdir.
+def launcher_options(region, src, tar_file):
+    """The CBMC Batch options common to the proofs in a source tree.
 
-    CBMC proofs are grouped together under directories with names like
-    'cbmc/proofs' and '.cbmc-batch/jobs' given by the list group_names.
-    Find all such directories under topdir.
-    """
-
-    return [path
-            for path, _, _ in os.walk(topdir)
-            if any([path.endswith(os.path.sep + suffix)
-                    for suffix in group_names])]
-
-def find_proofs(groupdir, relative=True):
-    """Find CBMC proof directories under a proof group directory groupdir.
-
-    A CBMC proof requires a file named 'cbmc-batch.yaml' that gives
-    parameters for running that proof under CBMC Batch.  Find all such
-    directories under groupdir.
-    """
-
-    prefix_length = len(groupdir)+1 if relative else 0
-    return [dir[prefix_length:]
-            for dir, _, files in os.walk(groupdir)
-            if 'cbmc-batch.yaml' in files]
-
-def find_tasks(group_names, topdir='.'):
-    """Return (proof-name, proof-directory) pairs for CBMC proofs under topdir.
-
-    For any given proof, CBMC Batch needs the name of the proof and the
-    directory containing the proof.  Suppose groupdir is the group
-    directory and proofdir is the subdirectory containing the proof.  The
-    proof name is proofdir (with '/' replaced with '-').  The proof
-    directory is the full path groupdir/proofdir.
+    Inputs: region - AWS region Batch is running in
+            src - source code directory,
+            tar_file - source archive file name
     """
+    common = {
+        "region": region,
+        "no-file-output": True,
+        "srcdir": src,
+        "copysrc": False,
+        "bucket": bkt_proofs
+    }
+    # Without a source archive common to the proofs, each proof is given
+    # a source archive of its own
+    if tar_file:
+        common["srctarfile"] = tarfile_path(tar_file)
+    # FIX: Lambdas put PKG_BKT in env, CodeBuild puts S3_PKG_PATH in env.
+    if os.environ.get('PKG_BKT'):
+        common["pkgbucket"] = os.environ['PKG_BKT']
+    elif os.environ.get('S3_BUCKET_TOOLS') and os.environ.get('S3_PKG_PATH'):
+        common["pkgbucket"] = "{}/{}".format(os.environ['S3_BUCKET_TOOLS'],
+                                             os.environ['S3_PKG_PATH'])
+    return common
 
-    return [(proofdir.replace(os.path.sep, '-'),
-             os.path.join(groupdir, proofdir))
-            for groupdir in find_proof_groups(group_names, topdir)
-            for proofdir in find_proofs(groupdir)]
+def make_launcher(region, src, tar_file, session=None):
+    """A launcher for the CBMC Batch jobs for the proofs in a source tree."""
+    return Launcher(launcher_options(region, src, tar_file), session)
 
-def run_batch(region, ws, src, task_name, tar_file):
+def run_batch(region, ws, src, task_name, tar_file, jobqueue=None,
+              bundled=False, launcher=None, srctarfile=None, proof=None):
     """Run the CBMC Batch job.
 
     Inputs: region - AWS region Batch is running in
@@ -216,24 +167,41 @@ def run_batch(region, ws, src, task_name, tar_file):
             src - source code directory,
             task_name - name of task
             tar_file - source archive file name
-    Outputs: Expected result substring
+            jobqueue - job queue overriding the queue in the yaml
+            bundled - prepare the job to run in a bundle without
+                      submitting it
+            launcher - launcher shared by the jobs for the source tree
+            srctarfile - S3 path to a source archive for this job alone
+            proof - proof manifest entry with the yaml already parsed
+    Outputs: Job name, expected result substring, and job options
     """
+    #pylint: disable=too-many-arguments
     # Expect a Makefile in the directory
     if not os.path.isfile(join(ws, "Makefile")):
         raise ValueError("Missing Makefile from " + ws)
 
-    # Expected CBMC output contains expected_result as a substring
-    expected = ""
-
-    # Expect yaml_name in the directory
-    yamls = glob.glob(join(ws, "*.yaml"))
-    yaml = join(ws, yaml_name)
-    if yaml in yamls:
-        # Bookkeep expected result
-        with open(yaml, "r") as stream:
-            expected = expected_result(load(stream))
+    if proof is not None:
+        # The yaml was parsed when the proof was found
+        if 'error' in proof:
+            raise ValueError(proof['error'])
+        config = proof['config']
     else:
-        raise ValueError("Missing " + yaml_name + " from " + ws)
+        # Expect yaml_name in the directory
+        yamls = glob.glob(join(ws, "*.yaml"))
+        yaml = join(ws, yaml_name)
+        if yaml in yamls:
+            with open(yaml, "r") as stream:
+                config = load(stream) or {}
+        else:
+            raise ValueError("Missing " + yaml_name + " from " + ws)
+
+    # The CI updates GitHub from the Batch job state events of the
+    # phases, and phases run by workers send no such events
+    if config.get('worker_queue'):
+        raise ValueError("Worker mode is not supported in CI: " + ws)
+
+    # Expected CBMC output contains expected_result as a substring
+    expected = proof_manifest.expected_result(config)
 
     # fix the jobname now, in the same way that cbmc_batch would do
     gmt = time.gmtime()
@@ -242,69 +210,41 @@ def run_batch(region, ws, src, task_name, tar_file):
                              gmt.tm_hour, gmt.tm_min, gmt.tm_sec))
     jobname = task_name + "-" + timestamp_str
 
-    # CBMC Batch args -- require that property-checking is performed
-    cbmc_batch.sys.argv = [
-        "cbmc_batch",
-        "--region", region,
-        "--no-file-output",
-        "--wsdir", ws,
-        "--srcdir", src, "--no-copysrc",
-        "--srctarfile",
-        "s3://{}/{}".format(bkt_proofs, tar_file),
-        "--bucket", bkt_proofs,
-        "--jobname", jobname,
-        "--taskname", task_name,
-        "--yaml", yaml]
-    # FIX: Lambdas put PKG_BKT in env, CodeBuild puts S3_PKG_PATH in env.
-    if os.environ.get('PKG_BKT'):
-        cbmc_batch.sys.argv += ["--pkgbucket", os.environ['PKG_BKT']]
-    elif os.environ.get('S3_BUCKET_TOOLS') and os.environ.get('S3_PKG_PATH'):
-        cbmc_batch.sys.argv += ["--pkgbucket",
-                                "{}/{}".format(os.environ['S3_BUCKET_TOOLS'], os.environ['S3_PKG_PATH'])]
+    # CBMC Batch options for the proof -- require that property-checking
+    # is performed
+    config = dict(config, wsdir=ws, jobname=jobname, taskname=task_name,
+                  bundled=bundled)
+    if jobqueue:
+        config["jobqueue"] = jobqueue
+    if srctarfile:
+        config["srctarfile"] = srctarfile
 
     # Run CBMC Batch
+    launcher = launcher or make_launcher(region, src, tar_file)
     timer = Timer("Run CBMC Batch")
     print("CBMC Batch options")
-    print(json.dumps(cbmc_batch.sys.argv))
-    cbmc_batch.main()
+    print(json.dumps(config))
+    opts = launcher.launch(config)
     timer.end()
 
     # Return expected result for bookkeeping
-    return (jobname, expected)
+    return (jobname, expected, opts)
 
 
 def batch_bookkeep(
-        tmp_dir, repo_id, sha, is_draft, expected, subdir, batch_name, correlation_list):
+        repo_id, sha, is_draft, expected, subdir, batch_name, correlation_list,
+        client=None, schedule=None):
+    """Write the manifest for a job and mark it pending in GitHub."""
     #pylint: disable=too-many-arguments
 
-    # Bookkeeping about the GitHub commit for later response
-    bookkeep(tmp_dir, batch_name, repo_id, "repo_id.txt")
-    bookkeep(tmp_dir, batch_name, sha, "sha.txt")
-    bookkeep(tmp_dir, batch_name, is_draft, "is_draft.txt")
-    # Bookkeeping about expected result for later response
-    bookkeep(tmp_dir, batch_name, expected, "expected.txt")
-    bookkeep(tmp_dir, batch_name, correlation_list, "correlation_list.txt")
+    client = client or boto3.client('s3')
+    # Bookkeeping about the GitHub commit and expected result for
+    # later response
+    job_manifest.write_manifest(client, bkt_proofs, batch_name,
+                                job_manifest.make_manifest(
+                                    repo_id, sha, is_draft, expected,
+                                    correlation_list, schedule))
     # Update commit status to pending
     desc = "Verification Pending: CBMC Batch job " + batch_name
     cbmc_ci_github.update_status(
         "pending", subdir, batch_name, desc, repo_id, sha, False)
-
-
-def expected_result(yaml):
-    """Return an expected substring for the CBMC result
-
-    The result is specified in a dict constructed from a user-provided yaml
-    """
-    if "expected" in yaml.keys():
-        return yaml["expected"]
-    return ""
-
-
-def bookkeep(tmp_dir, job_name, content, file_name):
-    """Upload tmp_dir/file_name to the S3 bucket as job_name/file_name"""
-    file_path = join(tmp_dir, file_name)
-    with open(file_path, "w") as file_obj:
-        file_obj.write(str(content))
-    s3 = boto3.client('s3')
-    s3.upload_file(
-        Bucket=bkt_proofs, Key=job_name + "/" + file_name, Filename=file_path)
@@ -0,0 +1,263 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+A cache of git mirrors for cloning a repository and its submodules.
+
+Cloning a large repository from GitHub for every commit checked is
+the largest fixed cost before any proof is launched.  The cache keeps
+a bare mirror of the repository and of each of its submodules in a
+local directory, and keeps a tar file of the directory in S3 so the
+mirrors survive from one build to the next.  Cloning a commit
+restores the directory from S3 if it is missing, fetches into the
+mirror only the branches and the commit or pull request needed, and
+clones the commit from the mirror with the objects hard linked.  The
+submodules are cloned from mirrors in the same directory, updated the
+same way.
+
+The mirrors are fetched from the URLs given on the command line and
+never store the URLs, so a URL with a token in it is not written to
+the tar file in S3.
+"""
+
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import time
+from urllib.parse import urlparse, urlunparse
+
+from botocore.exceptions import ClientError
+
+import clienterror
+
+# The directory containing the mirrors for each repository
+MIRROR_ROOT = (os.environ.get('CBMC_GIT_MIRROR_DIR') or
+               os.path.expanduser(os.path.join('~', '.cbmc-git-mirror')))
+MIRROR_PREFIX = 'git-mirror'
+# The age (in seconds) of the mirrors in S3 at which they are replaced
+REFRESH_SECONDS = int(os.environ.get('CBMC_GIT_MIRROR_REFRESH') or 86400)
+
+HEADS = '+refs/heads/*:refs/heads/*'
+PULL_HEADS = '+refs/pull/*/head:refs/remotes/origin/pr/*'
+PULL_CHECKOUT = 'origin/pr/'
+
+################################################################
+
+def run_git(args, cwd=None):
+    """Run a git command and return its output."""
+
+    cmd = ['git'] + args
+    logging.info('Running "%s" in "%s"', ' '.join(cmd), cwd or '.')
+    result = subprocess.run(cmd, cwd=cwd, capture_output=True, check=True)
+    return result.stdout.decode('utf-8').strip()
+
+def plain_url(url):
+    """The URL without the credentials in it."""
+
+    parsed = urlparse(url)
+    if '@' not in parsed.netloc:
+        return url
+    return urlunparse(parsed._replace(netloc=parsed.netloc.split('@')[-1]))
+
+def mirror_name(url):
+    """The name of the mirror of the repository at a URL."""
+
+    name = plain_url(url).split('://')[-1].replace(':', '/')
+    if name.endswith('.git'):
+        name = name[:-4]
+    return re.sub(r'[^A-Za-z0-9._-]+', '-', name.strip('/')) + '.git'
+
+def resolve_url(url, base):
+    """The URL of a submodule, resolved against its superproject URL."""
+
+    if not url.startswith(('./', '../')):
+        return url
+    base = base.rstrip('/')
+    if base.endswith('.git'):
+        base = base[:-4]
+    for part in url.split('/'):
+        if part == '..':
+            base = base.rsplit('/', 1)[0]
+        elif part not in ['', '.']:
+            base = '{}/{}'.format(base, part)
+    return base
+
+################################################################
+
+class MirrorCache:
+    """The mirrors of a repository and its submodules"""
+
+    def __init__(self, name, client, bucket, root=None):
+        self.name = name
+        self.client = client
+        self.bucket = bucket
+        self.root = os.path.join(root or MIRROR_ROOT, name)
+        self.key = '{}/{}.tar'.format(MIRROR_PREFIX, name)
+        # The time the mirrors in S3 were saved, if there are any
+        self.saved = None
+
+    ################################################################
+    # The mirrors in S3
+
+    def head(self):
+        """The metadata of the mirrors in S3, or None if there are none."""
+
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self.key)
+        except ClientError as exc:
+            if clienterror.code(exc) not in ['404', 'NoSuchKey']:
+                raise
+            logging.info("No git mirrors in s3://%s/%s", self.bucket, self.key)
+            return None
+
+    def restore(self):
+        """Restore the mirrors from S3 unless they are on the local disk.
+
+        Record the time the mirrors in S3 were saved even if the mirrors
+        on the local disk are used, so save replaces them only when they
+        are old.
+        """
+
+        head = self.head() if self.bucket else None
+        if head is not None:
+            self.saved = head['LastModified'].timestamp()
+        if os.path.isdir(self.root):
+            logging.info("Using git mirrors in %s", self.root)
+            return
+        if head is None:
+            return
+
+        start = time.time()
+        try:
+            with tempfile.TemporaryFile() as fileobj:
+                self.client.download_fileobj(self.bucket, self.key, fileobj)
+                fileobj.seek(0)
+                with tarfile.open(fileobj=fileobj) as tar:
+                    tar.extractall(os.path.dirname(self.root))
+        except Exception:
+            # Start over with empty mirrors rather than broken ones
+            shutil.rmtree(self.root, ignore_errors=True)
+            raise
+        logging.info("Restored git mirrors from s3://%s/%s in %.1fs",
+                     self.bucket, self.key, time.time() - start)
+
+    def save(self):
+        """Save the mirrors to S3 unless the mirrors in S3 are recent."""
+
+        if not self.bucket or not os.path.isdir(self.root):
+            return
+        if self.saved and time.time() - self.saved < REFRESH_SECONDS:
+            return
+
+        start = time.time()
+        with tempfile.TemporaryFile() as fileobj:
+            with tarfile.open(fileobj=fileobj, mode='w') as tar:
+                tar.add(self.root, arcname=self.name)
+            fileobj.seek(0)
+            self.client.upload_fileobj(fileobj, self.bucket, self.key)
+        self.saved = time.time()
+        logging.info("Saved git mirrors to s3://%s/%s in %.1fs",
+                     self.bucket, self.key, time.time() - start)
+
+    ################################################################
+    # Updating a mirror
+
+    def mirror(self, url, refspecs=None, commit=None):
+        """Fetch the branches, the refspecs, and the commit into the mirror
+        of the repository at a URL and return the path to the mirror."""
+
+        path = os.path.join(self.root, mirror_name(url))
+        if not os.path.isdir(path):
+            os.makedirs(path)
+            run_git(['init', '--bare', '--quiet', path])
+
+        run_git(['fetch', '--quiet', '--prune', url, HEADS], path)
+        if refspecs:
+            run_git(['fetch', '--quiet', url] + refspecs, path)
+        if commit and not self.has_commit(path, commit):
+            # GitHub serves a commit by name if it is reachable from a ref
+            run_git(['-c', 'protocol.version=2', 'fetch', '--quiet',
+                     url, commit], path)
+        return path
+
+    @staticmethod
+    def has_commit(path, commit):
+        """Whether the repository at a path contains a commit."""
+
+        try:
+            run_git(['cat-file', '-e', commit + '^{commit}'], path)
+        except subprocess.CalledProcessError:
+            return False
+        return True
+
+    ################################################################
+    # Cloning from the mirrors
+
+    def clone(self, url, srcdir, checkout=None):
+        """Clone the repository at a URL into srcdir from its mirror,
+        with the commit or pull request to check out.
+
+        The clone is not checked out, and its origin is the URL.
+        """
+
+        refspecs = []
+        commit = checkout
+        if checkout and checkout.startswith(PULL_CHECKOUT):
+            number = checkout[len(PULL_CHECKOUT):]
+            refspecs.append('+refs/pull/{0}/head:refs/pull/{0}/head'.format(
+                number))
+            commit = None
+
+        mirror = self.mirror(url, refspecs, commit)
+        run_git(['clone', '--quiet', '--no-checkout', mirror, srcdir])
+        # The pull requests fetched into the mirror, as in a clone of
+        # the repository at the URL
+        run_git(['config', '--add', 'remote.origin.fetch', PULL_HEADS],
+                srcdir)
+        run_git(['fetch', '--quiet', 'origin'], srcdir)
+        run_git(['remote', 'set-url', 'origin', url], srcdir)
+
+    def update_submodules(self, srcdir, url):
+        """Initialize and update the submodules of the commit checked out
+        in srcdir, recursively, cloning each from its mirror.
+
+        url is the URL of the repository in srcdir.  A submodule that
+        cannot be mirrored is left to be cloned from its own URL.
+        """
+
+        if not os.path.isfile(os.path.join(srcdir, '.gitmodules')):
+            return
+        try:
+            urls = run_git(['config', '-f', '.gitmodules', '--get-regexp',
+                            r'^submodule\..*\.url$'], srcdir)
+        except subprocess.CalledProcessError:
+            return
+
+        for line in urls.splitlines():
+            key, submodule_url = line.split(None, 1)
+            name = key[len('submodule.'):-len('.url')]
+            submodule_url = resolve_url(submodule_url, url)
+            try:
+                path = run_git(['config', '-f', '.gitmodules',
+                                'submodule.{}.path'.format(name)], srcdir)
+                commit = run_git(['rev-parse', 'HEAD:' + path], srcdir)
+                mirror = self.mirror(submodule_url, commit=commit)
+                run_git(['config', 'submodule.{}.url'.format(name), mirror],
+                        srcdir)
+                run_git(['-c', 'protocol.file.allow=always', 'submodule',
+                         'update', '--init', '--quiet', '--', path], srcdir)
+                run_git(['remote', 'set-url', 'origin', submodule_url],
+                        os.path.join(srcdir, path))
+                run_git(['config', 'submodule.{}.url'.format(name),
+                         submodule_url], srcdir)
+            except subprocess.CalledProcessError as err:
+                logging.info("Not using a git mirror for submodule %s: %s",
+                             name, err.stderr.decode('utf-8').strip())
+                continue
+            self.update_submodules(os.path.join(srcdir, path), submodule_url)
+
+################################################################
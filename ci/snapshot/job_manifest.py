@@ -0,0 +1,105 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+The bookkeeping for a CBMC Batch job launched by continuous integration.
+
+When a proof is launched, the GitHub commit being checked, the result
+expected of the proof, the correlation list tracing the proof back to
+the GitHub event, and the schedule of the proof are written to the
+manifest job.json next to the output of the job.  The lambda handling
+the completion of the job reads them back from the manifest.
+
+Jobs launched before the manifest existed wrote each of these to an
+object of its own (repo_id.txt, sha.txt, and so on), and they are
+read from these objects when a job has no manifest.
+"""
+
+import json
+
+from botocore.exceptions import ClientError
+
+import clienterror
+import s3
+
+JOB_MANIFEST = "job.json"
+VERSION = 1
+
+# The objects written for each job before the manifest existed
+REPO_ID_FILE = "repo_id.txt"
+SHA_FILE = "sha.txt"
+IS_DRAFT_FILE = "is_draft.txt"
+EXPECTED_FILE = "expected.txt"
+CORRELATION_LIST_FILE = "correlation_list.txt"
+SCHEDULE_FILE = "schedule.txt"
+
+def make_manifest(repo_id, sha, is_draft, expected, correlation_list,
+                  schedule=None):
+    """The manifest for a job.
+
+    The schedule is the time the job was launched and its predicted
+    runtime and makespan, or None if no schedule was predicted.
+    """
+    # pylint: disable=too-many-arguments
+    return {
+        'version': VERSION,
+        'repo_id': int(repo_id) if repo_id is not None else None,
+        'sha': sha,
+        'is_draft': bool(is_draft),
+        'expected': str(expected),
+        'correlation_list': correlation_list,
+        'schedule': schedule
+    }
+
+def write_manifest(client, bucket, jobname, manifest):
+    """Write the manifest for a job."""
+    client.put_object(Bucket=bucket, Key=f"{jobname}/{JOB_MANIFEST}",
+                      Body=json.dumps(manifest).encode('utf-8'),
+                      ContentType='application/json')
+
+def read_object(client, bucket, key):
+    """The body of an object, or None if there is no such object."""
+    try:
+        return s3.read_body(client.get_object(Bucket=bucket, Key=key))
+    except ClientError as exc:
+        if clienterror.code(exc) != 'NoSuchKey':
+            raise
+        return None
+
+def read_legacy_manifest(client, bucket, jobname):
+    """The manifest for a job assembled from the objects written
+    for each job before the manifest existed.
+
+    Raise ValueError if the job has neither a manifest nor the objects
+    giving the commit being checked.
+    """
+
+    def read(name):
+        body = read_object(client, bucket, f"{jobname}/{name}")
+        return body.decode('utf-8') if body is not None else None
+
+    repo_id = read(REPO_ID_FILE)
+    sha = read(SHA_FILE)
+    if repo_id is None or sha is None:
+        raise ValueError(f"No {JOB_MANIFEST} or {REPO_ID_FILE} and "
+                         f"{SHA_FILE} for job {jobname}")
+    schedule = read(SCHEDULE_FILE)
+    return make_manifest(
+        repo_id=repo_id,
+        sha=sha,
+        is_draft=(read(IS_DRAFT_FILE) or '').lower() == "true",
+        expected=read(EXPECTED_FILE) or "",
+        correlation_list=json.loads(read(CORRELATION_LIST_FILE) or '[]'),
+        schedule=json.loads(schedule) if schedule else None)
+
+def read_manifest(client, bucket, jobname):
+    """The manifest for a job, or ValueError if there is none."""
+
+    body = read_object(client, bucket, f"{jobname}/{JOB_MANIFEST}")
+    if body is None:
+        return read_legacy_manifest(client, bucket, jobname)
+    manifest = json.loads(body)
+    if manifest.get('version', 0) > VERSION:
+        raise ValueError(f"Unsupported version {manifest['version']} of "
+                         f"{jobname}/{JOB_MANIFEST}")
+    return manifest
@@ -10,14 +10,28 @@ import logging
 import datetime
 from urllib.parse import urlparse, urlunparse
 import json
+import shutil
 import sys
 import traceback
+import heapq
+import time
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
 
+import bundle
+from cbmc import CBMC
 import cbmc_ci_start
 import cbmc_ci_github
 import clog_writert
+import executor
+import git_mirror
+import proof_dependencies
+import proof_manifest
+import sizing
+import source_tarball
 
 # Too hard to install, just run git as a subprocess
 # import pygit2
@@ -25,16 +39,13 @@ import clog_writert
 ################################################################
 
 # All proofs are under one of these directories
-PROOF_MARKERS = ['cbmc/proofs', '.cbmc-batch/jobs']
+PROOF_MARKERS = proof_manifest.PROOF_MARKERS
 
 # Scripts run before taring up the repository
 MAKE_COMMON_MAKEFILE = 'make_common_makefile.py'
 MAKE_PROOF_MAKEFILES = 'make_proof_makefiles.py'
 PREPARE_FILE = 'prepare.py'
 
-# Expected name for CBMC Batch yaml
-YAML_NAME = "cbmc-batch.yaml"
-
 # S3 Bucket name for storing CBMC Batch packages and outputs
 # FIX: Lambdas put S3_BKT in env, CodeBuild puts S3_BUCKET in env.
 BKT = os.environ.get('S3_BKT') or os.environ.get('S3_BUCKET')
@@ -100,6 +111,14 @@ def get_arguments():
         """
     )
 
+    parser.add_argument(
+        '--full-run',
+        action='store_true',
+        help="""
+        Run every proof, and not just the proofs affected by the change.
+        """
+    )
+
     ################################################################
     # S3 paths
     parser.add_argument(
@@ -172,6 +191,10 @@ def get_arguments():
         # Environment value could be an empty string
         env = os.environ.get('CBMC_IS_DRAFT')
         arg.is_draft = env is not None and env.lower() == "true"
+    if not arg.full_run:
+        # Environment value could be an empty string
+        env = os.environ.get('CBMC_FULL_RUN')
+        arg.full_run = env is not None and env.lower() == "true"
     if not arg.id:
         # Environment value could be an empty string
         env = os.environ.get('CBMC_ID')
@@ -212,7 +235,8 @@ def script_data(arg):
              'CBMC_REPOSITORY': os.environ.get('CBMC_REPOSITORY'),
              'CBMC_BRANCH': os.environ.get('CBMC_BRANCH'),
              'CBMC_SHA': os.environ.get('CBMC_SHA'),
-             'CBMC_IS_DRAFT': os.environ.get('CBMC_IS_DRAFT')
+             'CBMC_IS_DRAFT': os.environ.get('CBMC_IS_DRAFT'),
+             'CBMC_FULL_RUN': os.environ.get('CBMC_FULL_RUN')
              }
     return debug
 
@@ -256,8 +280,48 @@ def repository_name(url):
 def repository_basename(url):
     return repository_name(url).replace('/', '-')
 
-def clone_repository(url, srcdir):
+# The repository is cloned from a git mirror cached in the proofs
+# bucket (see git_mirror.py) unless CBMC_GIT_MIRROR is false, and is
+# cloned from GitHub if cloning from the mirror fails.  A clone from
+# GitHub is a partial clone with the filter CBMC_GIT_FILTER (like
+# blob:none) if one is given.
+GIT_MIRROR = (os.environ.get('CBMC_GIT_MIRROR') or 'true').lower() == 'true'
+GIT_FILTER = os.environ.get('CBMC_GIT_FILTER')
+
+def git_mirror_cache(repository, bucket):
+    if not GIT_MIRROR:
+        return None
+    cache = git_mirror.MirrorCache(repository_basename(repository),
+                                   boto3.client('s3'), bucket)
+    try:
+        cache.restore()
+    # pylint: disable=broad-except
+    except Exception as e:
+        logging.info("Failed to restore the git mirror: %s", str(e))
+    return cache
+
+def save_git_mirror_cache(cache):
+    if cache is None:
+        return
+    try:
+        cache.save()
+    # pylint: disable=broad-except
+    except Exception as e:
+        logging.info("Failed to save the git mirror: %s", str(e))
+
+def clone_repository(url, srcdir, checkout=None, cache=None):
+    if cache is not None:
+        try:
+            cache.clone(url, srcdir, checkout)
+            return
+        except subprocess.CalledProcessError as e:
+            logging.info("Failed to clone from the git mirror: %s",
+                         e.stderr.decode("utf-8").strip())
+            shutil.rmtree(srcdir, ignore_errors=True)
+
     cmd = ['git', 'clone', url, srcdir]
+    if GIT_FILTER:
+        cmd[2:2] = ['--filter', GIT_FILTER]
     run_command(cmd)
 
     # Fetch the pull request data in addtion to the head data that
@@ -308,7 +372,8 @@ def verify_commit_is_gone(srcdir, checkout):
         logging.error("No such commit exists in this repository: <%s>", checkout)
         return True
 
-def checkout_repository(sha=None, branch=None, srcdir=None):
+def checkout_repository(sha=None, branch=None, srcdir=None, cache=None,
+                        url=None):
     checkout = sha or branch
     if checkout is None:
         return False
@@ -322,58 +387,12 @@ def checkout_repository(sha=None, branch=None, srcdir=None):
         if not force_checkout_success and not verify_commit_is_gone(srcdir, checkout):
             raise Exception(CHECKOUT_FAILED_BUT_COMMIT_EXISTS_MSG.format(checkout))
 
+    if cache is not None:
+        cache.update_submodules(srcdir, url)
     cmd = ["git", "submodule", "update", "--init", "--recursive"]
     run_command(cmd, srcdir)
     return True
 
-################################################################
-
-def find_proof_groups(group_names, root='.'):
-    """Find CBMC proof group directories under root.
-
-    CBMC proofs are grouped together under directories with names like
-    'cbmc/proofs' and '.cbmc-batch/jobs' given by the list group_names.
-    Find all such directories under root.
-    """
-
-    return [path
-            for path, _, _ in os.walk(root)
-            if any([path.endswith(os.path.sep + suffix)
-                    for suffix in group_names])]
-
-def find_proof_directories(groupdir, relative=True):
-    """Find CBMC proof directories under a proof group directory groupdir.
-
-    A CBMC proof requires a file named 'cbmc-batch.yaml' that gives
-    parameters for running that proof under CBMC Batch.  Find all such
-    directories under groupdir.
-    """
-
-    prefix_length = len(groupdir)+1 if relative else 0
-    return [dir[prefix_length:]
-            for dir, _, files in os.walk(groupdir)
-            if YAML_NAME in files]
-
-def find_proofs(group_names, root='.'):
-    """Return (proof-group, proof-directory) pairs for CBMC proofs under root.
-
-    The proof-group is a full path, proof-directory is relative to proof-group.
-    """
-
-    return [(groupdir, proofdir)
-            for groupdir in find_proof_groups(group_names, root)
-            for proofdir in find_proof_directories(groupdir)]
-
-def find_tasks(group_names, root='.'):
-    """Return (proof-name, proof-directory) pairs for CBMC proofs under topdir.
-
-    For any given proof, CBMC Batch needs the name of the proof and the
-    directory containing the proof.
-    """
-
-    return [(os.path.split(proofdir)[1], os.path.join(groupdir, proofdir))
-            for (groupdir, proofdir) in find_proofs(group_names, root)]
-
 ################################################################
 # tar files
 
@@ -387,63 +406,489 @@ def make_tarfile_name(repository, sha=None):
     filename += '.tar.gz'
     return filename
 
-def generate_tarfile(tarfile, srcdir):
-    # Just a simple tar, not worth the tarfile module
-    cmd = ['tar', 'fcz', tarfile, srcdir]
-    run_command(cmd)
-
-def upload_tarfile_to_s3(tarfile, bucket, path):
-    logging.info("Uploading %s to %s/%s", tarfile, bucket, tarfile)
-    s3 = boto3.client('s3')
+def upload_tarfile_to_s3(tarfile, srcdir, bucket, path, manifest=None):
+    # The tar file is streamed to S3 and never written to disk
     key = '{}/{}'.format(path, tarfile) if path else tarfile
-    s3.upload_file(Bucket=bucket, Key=key, Filename=tarfile)
+    logging.info("Uploading %s to %s/%s", srcdir, bucket, key)
+    s3 = boto3.client('s3')
+    source_tarball.upload_tarfile(srcdir, bucket, key, client=s3)
+    if manifest is not None:
+        proof_manifest.write_manifest(s3, bucket, key, manifest)
 
 ################################################################
 
-def generate_cbmc_makefiles(group_names, root):
-    for directory in find_proof_groups(group_names, root):
+def generate_cbmc_makefiles(groups, root):
+    for group in groups:
+        directory = os.path.join(root, group)
         files = os.listdir(directory)
         if PREPARE_FILE in files:
             cmd = ["python", PREPARE_FILE]
             run_command(cmd, directory)
 
+################################################################
+# Selection
+#
+# A change usually touches few of the files the proofs depend on, so
+# only the proofs affected by the change are run (see
+# proof_dependencies.py).  The change is the difference between the
+# commit and a base commit: the merge base with the branch a pull
+# request is against, or the parent of a commit pushed to a branch.
+# A proof not affected by the change is given the result it has at the
+# base commit, and is run if it has no result there.  Every proof is
+# run for a commit pushed to one of the PROTECTED_BRANCHES, for a retry
+# requested in a comment, and when the full run is requested.
+
+PROTECTED_BRANCHES = (os.environ.get('CBMC_PROTECTED_BRANCHES') or
+                      'master main').split()
+PUSH_PREFIX = 'refs/heads/'
+REUSABLE_STATES = ['success', 'failure']
+REUSED_DESCRIPTION = 'Reused result from '
+
+def base_commit(branch, srcdir, full_run=False):
+    """The commit to compare the commit checked out with, or None if
+    every proof is to be run."""
+
+    if full_run or not branch or branch == cbmc_ci_github.RETRY_BRANCH:
+        return None
+    if branch.startswith(PUSH_PREFIX):
+        if branch[len(PUSH_PREFIX):] in PROTECTED_BRANCHES:
+            return None
+        return proof_dependencies.git(srcdir, 'rev-parse', 'HEAD^')
+    return proof_dependencies.git(srcdir, 'merge-base',
+                                  'origin/' + branch, 'HEAD')
+
+def reused_description(status, base):
+    """The description of the result reused from a status of the base."""
+
+    description = status.description or ''
+    if description.startswith(REUSED_DESCRIPTION):
+        return description
+    return REUSED_DESCRIPTION + base[:8]
+
+def report_jobname(status):
+    """The job name in the URL of the report linked to a status, or None."""
+
+    if not status.target_url:
+        return None
+    return urlparse(status.target_url).path.strip('/').split('/')[0] or None
+
+def select_tasks(context, tasks, base):
+    """Return the tasks for the proofs affected by the change from the
+    base commit, and give the other proofs their results at the base."""
+
+    if base is None:
+        print("Running all proofs")
+        return tasks
+
+    statuses = cbmc_ci_github.get_statuses(context.repo_id, base)
+    reusable = {proofname: status for proofname, status in statuses.items()
+                if status.state in REUSABLE_STATES}
+    changed = proof_dependencies.changes(context.src, base)
+    if not reusable or changed is None:
+        print("Running all proofs: no results to reuse from {}".format(base))
+        return tasks
+    print("{} files changed since {}".format(len(changed), base))
+
+    proofdirs = [proofdir for proofname, proofdir in tasks
+                 if proofname in reusable]
+    dependencies = proof_dependencies.commit_dependencies(
+        context.s3, cbmc_ci_start.bkt_proofs, context.repo_id,
+        context.commit, proofdirs, context.src, PROOF_MARKERS)
+
+    selected = []
+    for proofname, proofdir in tasks:
+        status = reusable.get(proofname)
+        if status is None or proof_dependencies.affected(
+                dependencies.get(os.path.relpath(proofdir, context.src)),
+                changed):
+            selected.append((proofname, proofdir))
+            continue
+        jobname = report_jobname(status)
+        cbmc_ci_github.update_status(
+            status.state, proofname, jobname,
+            reused_description(status, base),
+            context.repo_id, context.repo_sha, True,
+            post_url=jobname is not None)
+    print("Running {} of {} proofs affected by changes since {}".format(
+        len(selected), len(tasks), base))
+    return selected
+
+################################################################
+# Scheduling
+#
+# The time to a result for a commit is the time until the last proof
+# finishes.  Proofs are submitted longest first by the runtime
+# predicted from the history of past runs, so the longest proofs start
+# first, and proofs predicted to run longer than LONG_PROOF_SECONDS
+# are routed to the job queue LONG_JOB_QUEUE (a queue for a compute
+# environment of larger instances) when one is given.
+
+LONG_JOB_QUEUE = os.environ.get('CBMC_LONG_JOB_QUEUE')
+LONG_PROOF_SECONDS = int(os.environ.get('CBMC_LONG_PROOF_SECONDS') or 7200)
+# The number of proofs Batch runs at once, if bounded
+BATCH_SLOTS = int(os.environ.get('CBMC_BATCH_SLOTS') or 0)
+PREDICTION_THREADS = 32
+
+def predict_runtimes(tasks, bucket):
+    """Predict the runtime of each (proof-name, proof-directory) task."""
+
+    if not bucket:
+        return [None] * len(tasks)
+    client = boto3.client('s3')
+    with ThreadPoolExecutor(PREDICTION_THREADS) as pool:
+        return list(pool.map(
+            lambda task: sizing.predict_runtime(bucket, task[0],
+                                                client=client),
+            tasks))
+
+def schedule_tasks(tasks, predictions):
+    """Order tasks by predicted runtime, longest first.
+
+    Return (task, runtime, predicted) triples.  A proof with no history
+    is not predicted, and is given the median of the runtimes predicted.
+    """
+
+    known = sorted(prediction for prediction in predictions
+                   if prediction is not None)
+    median = known[len(known)//2] if known else 0
+    schedule = [(task,
+                 prediction if prediction is not None else median,
+                 prediction is not None)
+                for task, prediction in zip(tasks, predictions)]
+    return sorted(schedule, key=lambda item: item[1], reverse=True)
+
+def predicted_makespan(runtimes, slots=None):
+    """The predicted time until the last proof finishes when proofs are
+    started longest first on the given number of slots."""
+
+    if not runtimes:
+        return 0
+    if not slots:
+        return max(runtimes)
+    finish = [0] * slots
+    for runtime in sorted(runtimes, reverse=True):
+        heapq.heapreplace(finish, finish[0] + runtime)
+    return max(finish)
+
+def job_queue(runtime, predicted):
+    """The job queue for a proof with a runtime, or None for the default."""
+
+    if LONG_JOB_QUEUE and predicted and runtime >= LONG_PROOF_SECONDS:
+        return LONG_JOB_QUEUE
+    return None
+
+################################################################
+# Bundling
+#
+# When CBMC_BUNDLE_MEMORY is set, proofs not routed to the long job
+# queue are packed by memory and vCPU demand into bundles of
+# CBMC_BUNDLE_MEMORY MB and CBMC_BUNDLE_VCPUS vCPUs, and each bundle
+# runs its proofs side by side in one container.  See bundle.py.
+
+BUNDLE_MEMORY = int(os.environ.get('CBMC_BUNDLE_MEMORY') or 0)
+BUNDLE_VCPUS = int(os.environ.get('CBMC_BUNDLE_VCPUS') or 4)
+
+def bundle_name(repo_sha, number):
+    """The job name for a bundle, following CBMC Batch naming conventions."""
+
+    gmt = time.gmtime()
+    return "{}-{}-{:03d}-{:04d}{:02d}{:02d}-{:02d}{:02d}{:02d}".format(
+        bundle.BUNDLE, repo_sha[:8], number,
+        gmt.tm_year, gmt.tm_mon, gmt.tm_mday,
+        gmt.tm_hour, gmt.tm_min, gmt.tm_sec)
+
+def launch_bundles(context, prepared, first_position):
+    """Pack the jobs prepared to run in bundles into bundles and submit them.
+
+    prepared is a list of (job-options, predicted-runtime) pairs.
+    Bundles are submitted longest first, and a job packed into a bundle
+    by itself is submitted as an ordinary job.  Failures are recorded
+    in the launch context at positions from first_position.
+    """
+
+    items = []
+    for opts, runtime in prepared:
+        memory, vcpus = bundle.demand(opts)
+        items.append(((opts, runtime, memory, vcpus), memory, vcpus))
+    bundles = sorted(bundle.pack(items, BUNDLE_MEMORY, BUNDLE_VCPUS),
+                     key=lambda members: max(member[1] for member in members),
+                     reverse=True)
+    print("Packed {} proofs into {} bundles".format(len(items), len(bundles)))
+
+    def launch(number, members):
+        # pylint: disable=broad-except
+        try:
+            with context.stage('bundle'):
+                if len(members) == 1:
+                    opts = dict(members[0][0], bundled=False)
+                    CBMC(opts, batch=executor.make_executor(
+                        opts, context.launcher.session)).submit_jobs()
+                    return
+                jobname = bundle_name(context.repo_sha, number)
+                memory = sum(member[2] for member in members)
+                vcpus = sum(member[3] for member in members)
+                print("Bundle {}: {} MB, {} vCPUs: {}".format(
+                    jobname, memory, vcpus,
+                    ' '.join(member[0]['jobname'] for member in members)))
+                bundle.submit([member[0] for member in members],
+                              jobname, memory, vcpus)
+        except Exception as e:
+            context.fail(first_position + number,
+                         [member[0]['taskname'] for member in members], e)
+
+    context.run(launch, bundles)
+
+################################################################
+# Source slices
+#
+# A proof builds from a few dozen of the files in the repository, so
+# when CBMC_SOURCE_SLICES is true each proof is given a slice of the
+# source tree instead of the tar file of the whole tree.  The slice has
+# the files the proof depends on (see proof_dependencies.py) and
+# everything in the proof directory and in the directory of its proof
+# group (like cbmc for cbmc/proofs), where the Makefiles, scripts, and
+# stubs shared by the proofs are kept.  The dependencies are found by
+# asking make and the preprocessor on the host preparing the source,
+# and a proof whose build reads a file they do not name (a file read by
+# a script, or a header chosen by a definition made in the container)
+# fails to build from its slice, so slices are off by default.  A proof
+# whose dependencies cannot be found, or whose slice cannot be built,
+# is given the whole tree.
+
+SOURCE_SLICES = (os.environ.get('CBMC_SOURCE_SLICES') or
+                 'false').lower() == 'true'
+SLICE_PREFIX = 'slices'
+TARFILE_SUFFIX = '.tar.gz'
+
+def slice_key(tarfile, proofname):
+    """The key for the source slice for a proof."""
+
+    if tarfile.endswith(TARFILE_SUFFIX):
+        tarfile = tarfile[:-len(TARFILE_SUFFIX)]
+    return '{}/{}/{}{}'.format(SLICE_PREFIX, tarfile, proofname,
+                               TARFILE_SUFFIX)
+
+def proof_infrastructure(proofdir):
+    """The directory of the proof group of a proof, like cbmc for
+    cbmc/proofs, or None if the proof is not in a proof group."""
+
+    for marker in PROOF_MARKERS:
+        index = proofdir.find(os.sep + marker + os.sep)
+        if index >= 0:
+            return os.path.join(proofdir[:index], marker.split('/')[0])
+    return None
+
+def source_slice(context, proofname, proofdir, dependencies):
+    """Upload the source slice for a proof and return its S3 path, or
+    return the S3 path to the whole tree if there is no slice."""
+
+    # pylint: disable=broad-except
+    if dependencies is None:
+        print("Using the whole source tree for {}".format(proofname))
+        return cbmc_ci_start.tarfile_path(context.tarfile)
+
+    paths = list(dependencies['paths'])
+    paths.append(os.path.relpath(proofdir, context.src))
+    infrastructure = proof_infrastructure(proofdir)
+    if infrastructure:
+        paths.append(os.path.relpath(infrastructure, context.src))
+
+    key = slice_key(context.tarfile, proofname)
+    try:
+        members = source_tarball.upload_tarfile(
+            context.src, cbmc_ci_start.bkt_proofs, key, client=context.s3,
+            members=source_tarball.slice_members(context.src, paths))
+    except Exception as e:
+        logging.warning("Failed to build the source slice for %s, "
+                        "using the whole source tree: %s", proofname, str(e))
+        return cbmc_ci_start.tarfile_path(context.tarfile)
+    print("Source slice for {}: {} files, {} bytes".format(
+        proofname, len(members), sum(size or 0 for _, size in members)))
+    return cbmc_ci_start.tarfile_path(key)
+
+################################################################
+# Launching
+#
+# Launching a proof parses its options, uploads its workspace, submits
+# its jobs, and bookkeeps the jobs for the lambda handling their
+# completion.  Proofs are launched LAUNCH_THREADS at a time in the
+# order they are scheduled, sharing one launch context and one
+# launcher: the buckets, packages, job definitions, and job queues are
+# checked once, and the clients are made once (see launcher.py).  A
+# proof that fails to launch is marked as an error in GitHub and the
+# others are launched anyway, and then the exception of the last proof
+# that failed is raised.
+
+LAUNCH_THREADS = int(os.environ.get('CBMC_LAUNCH_THREADS') or 16)
+
+class LaunchContext:
+    """The state shared by the threads launching the proofs for a commit"""
+
+    # pylint: disable=too-many-instance-attributes,too-many-arguments
+
+    def __init__(self, src, repo_id, repo_sha, is_draft, tarfile, logger):
+        self.src = src
+        self.repo_id = repo_id
+        self.repo_sha = repo_sha
+        self.is_draft = is_draft
+        self.tarfile = tarfile
+        self.logger = logger
+        self.region = os.environ['AWS_REGION']
+
+        # The commit checked out (repo_sha may name a pull request)
+        self.commit = proof_dependencies.git(src, 'rev-parse', 'HEAD') or repo_sha
+
+        # With source slices, each proof is given a source archive of its own
+        self.launcher = cbmc_ci_start.make_launcher(
+            self.region, src, None if SOURCE_SLICES else tarfile)
+        self.s3 = self.launcher.s3
+        # Making the first client for a service is not thread-safe, so
+        # make a client for the other services used by the threads here
+        boto3.client('cloudwatch', region_name=self.region)
+
+        self.lock = threading.Lock()
+        # (position, proof-names, exception) for each failure
+        self.errors = []
+        # stage -> (count, total seconds, longest seconds)
+        self.stages = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Add the time spent in a block to the time spent in a stage"""
+        start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            with self.lock:
+                count, total, longest = self.stages.get(name, (0, 0.0, 0.0))
+                self.stages[name] = (count + 1, total + elapsed,
+                                     max(longest, elapsed))
+
+    def run(self, function, items):
+        """Call function on each (position, item) pair, LAUNCH_THREADS
+        calls at a time, starting the calls in order of position"""
+        with ThreadPoolExecutor(LAUNCH_THREADS) as pool:
+            list(pool.map(function, range(len(items)), items))
+
+    def fail(self, position, proofnames, error):
+        """Record a failure to launch proofs and mark them in GitHub"""
+        traceback.print_exc()
+        print("Error: " + str(error))
+        with self.lock:
+            self.errors.append((position, proofnames, error))
+        for proofname in proofnames:
+            cbmc_ci_github.update_status(
+                "error", proofname, None, "Problem launching verification",
+                self.repo_id, self.repo_sha, False)
+
+    def report(self, elapsed):
+        """Print the time spent in each stage and the proofs that failed"""
+        print("Launched in {:.1f}s with {} threads".format(
+            elapsed, LAUNCH_THREADS))
+        for name, (count, total, longest) in sorted(self.stages.items()):
+            print("Stage {}: {} calls, {:.1f}s total, {:.2f}s mean, "
+                  "{:.2f}s longest".format(name, count, total,
+                                           total / count, longest))
+        for _, proofnames, error in sorted(self.errors,
+                                           key=lambda error: error[0]):
+            print("Failed to launch {}: {}".format(' '.join(proofnames),
+                                                  error))
+
+    def raise_errors(self):
+        """Raise the exception of the last proof that failed to launch"""
+        if self.errors:
+            raise max(self.errors, key=lambda error: error[0])[2]
+
 ################################################################
 # CBMC Batch
 
-#TODO: refactor so that there are not so many arguments per call.  Use classes perhaps?
-def generate_cbmc_jobs(src, repo_id, repo_sha, is_draft, tarfile, logger):
-    # Find (proof-name, proof-directory) pairs for all proofs under src
-    tasks = find_tasks(PROOF_MARKERS, src)
+def generate_cbmc_jobs(src, repo_id, repo_sha, is_draft, tarfile, logger,
+                       base=None, manifest=None):
+    #pylint: disable=too-many-arguments,too-many-locals
+    start = time.time()
+    context = LaunchContext(src, repo_id, repo_sha, is_draft, tarfile, logger)
+
+    # (proof-name, proof-directory) pairs for all proofs under src
+    manifest = manifest or proof_manifest.make_manifest(src)
+    tasks = proof_manifest.tasks(manifest)
+    proofs = {proofdir: proof
+              for (_, proofdir), proof in zip(tasks, manifest['proofs'])}
     print("{} tasks found".format(len(tasks)))
-    pending_exception = None
 
-    for (proofname, proofdir) in tasks:
+    with context.stage('select'):
+        tasks = select_tasks(context, tasks, base)
+    dependencies = {}
+    if SOURCE_SLICES:
+        with context.stage('dependencies'):
+            dependencies = proof_dependencies.commit_dependencies(
+                context.s3, cbmc_ci_start.bkt_proofs, context.repo_id,
+                context.commit, [proofdir for _, proofdir in tasks], src,
+                PROOF_MARKERS)
+
+    with context.stage('predict'):
+        schedule = schedule_tasks(
+            tasks, predict_runtimes(tasks, cbmc_ci_start.bkt_proofs))
+    makespan = predicted_makespan([runtime for _, runtime, _ in schedule],
+                                  BATCH_SLOTS)
+    print("Predicted makespan: {:.0f}s".format(makespan))
+    for (proofname, _), runtime, predicted in schedule:
+        print("Predicted runtime: {:.0f}s {}{}".format(
+            runtime, proofname, "" if predicted else " (no history)"))
+
+    # (position, job-options, predicted-runtime) for jobs run in bundles
+    prepared = []
+
+    def launch(position, scheduled):
         # pylint: disable=broad-except
+        (proofname, proofdir), runtime, predicted = scheduled
         try:
-            # Try to run batch
-            (jobname, expected) = cbmc_ci_start.run_batch(
-                os.environ['AWS_REGION'], proofdir, src, proofname, tarfile)
+            # Try to run batch, or just prepare the job to run in a bundle
+            jobqueue = job_queue(runtime, predicted)
+            bundled = bool(BUNDLE_MEMORY) and jobqueue is None
+            srctarfile = None
+            if SOURCE_SLICES:
+                with context.stage('slice'):
+                    srctarfile = source_slice(
+                        context, proofname, proofdir,
+                        dependencies.get(os.path.relpath(proofdir, src)))
+            with context.stage('launch'):
+                (jobname, expected, opts) = cbmc_ci_start.run_batch(
+                    context.region, proofdir, src, proofname, tarfile,
+                    jobqueue=jobqueue, bundled=bundled,
+                    launcher=context.launcher, srctarfile=srctarfile,
+                    proof=proofs[proofdir])
+            if bundled:
+                with context.lock:
+                    prepared.append((position, opts, runtime))
 
             # Log result.  In the case we don't have a task id that is provided by the interface for run_batch.
             child_correlation_list = logger.create_child_correlation_list()
             logger.launch_child(jobname, None, child_correlation_list)
 
-            cbmc_ci_start.batch_bookkeep(
-                ".", repo_id, repo_sha, is_draft, expected, proofname,
-                jobname, json.dumps(child_correlation_list))
+            with context.stage('bookkeep'):
+                cbmc_ci_start.batch_bookkeep(
+                    repo_id, repo_sha, is_draft, expected, proofname,
+                    jobname, child_correlation_list, client=context.s3,
+                    schedule={
+                        'launched': time.time(),
+                        'predicted_runtime': runtime,
+                        'predicted_makespan': makespan
+                    })
         except Exception as e:
-            # Update commit status to error
-            pending_exception = e
-            traceback.print_exc()
-            cbmc_ci_github.update_status(
-                "error", proofname, None,
-                "Problem launching verification", repo_id, repo_sha, False)
-            print("Error: " + str(e))
-            response = {'proofname': proofname,
-                        'error' : "Exception: {}; Traceback: {}".format(str(e), traceback.format_exc())}
+            context.fail(position, [proofname], e)
+
+    context.run(launch, schedule)
+
+    if prepared:
+        launch_bundles(context,
+                       [(opts, runtime)
+                        for _, opts, runtime in sorted(
+                            prepared, key=lambda item: item[0])],
+                       len(schedule))
 
-    if pending_exception is not None:
-        raise pending_exception
+    context.report(time.time() - start)
+    context.raise_errors()
 
 ################################################################
 SECRET_TARGET_GITHUB_PAT_NAME = 'GitHubCommitStatusPAT'
@@ -470,19 +915,29 @@ def source_prepare():
         base_name = repository_basename(arg.repository)
         # FIXME(fbbotero): Redact token in logs
         repository_url = format_github_url(arg.repository)
-        clone_repository(repository_url, base_name)
+        cache = git_mirror_cache(arg.repository, arg.bucket_proofs)
+        clone_repository(repository_url, base_name, arg.sha or arg.branch,
+                         cache)
 
-        if not checkout_repository(arg.sha, arg.branch, base_name):
+        if not checkout_repository(arg.sha, arg.branch, base_name, cache,
+                                   repository_url):
             cbmc_ci_github.update_status(
                 "success", "Cancelled", None, "Cancelled by force-pushed commit",
                 arg.id, arg.sha, no_status_metric=True)
             return
 
-        generate_cbmc_makefiles(PROOF_MARKERS, base_name)
-        generate_tarfile(arg.tarfile_name, base_name)
-        upload_tarfile_to_s3(arg.tarfile_name, arg.bucket_proofs, arg.tarfile_path)
+        base = base_commit(arg.branch, base_name, arg.full_run)
+        groups = proof_manifest.find_groups(base_name, PROOF_MARKERS)
+        generate_cbmc_makefiles(groups, base_name)
+        manifest = proof_manifest.make_manifest(base_name, groups)
+        upload_tarfile_to_s3(arg.tarfile_name, base_name, arg.bucket_proofs,
+                             arg.tarfile_path, manifest)
         generate_cbmc_jobs(
-            base_name, arg.id, arg.sha, arg.is_draft, arg.tarfile_name, logger)
+            base_name, arg.id, arg.sha, arg.is_draft, arg.tarfile_name, logger,
+            base=base, manifest=manifest)
+        # Saving the mirrors may upload gigabytes, so save them only
+        # after the proofs are launched
+        save_git_mirror_cache(cache)
         logger.summary(clog_writert.SUCCEEDED, vars(arg), {})
         cbmc_ci_github.update_status("success", "Proof jobs starting", None,
                                      "Successfully started proof jobs", arg.id, arg.sha, False)
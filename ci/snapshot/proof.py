@@ -9,7 +9,6 @@ import json
 import logging
 import os
 import re
-import tempfile
 import itertools
 import sys
 import functools
@@ -19,6 +18,14 @@ import botocore_amazon.monkeypatch
 import boto3
 import botocore
 
+# The modules reading the results written by the phases are in bin/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '..', 'bin'))
+# pylint: disable=wrong-import-position
+import compressor
+import job_manifest
+import results
+
 ################################################################
 # print for stderr:
 
@@ -659,22 +666,36 @@ class ProofResult:
 
         self.bucket = proof_bucket(client)
         logging.info('Scanning CBMC proof logs for {} .'.format(proof))
-        with tempfile.TemporaryDirectory() as tmpdir:
-            read_file = lambda name: cbmc_file(client, self.bucket,
-                                               proof, name, tmpdir)
-            self.log = {
-                'build': read_file('build.txt'),
-                'property': read_file('cbmc.txt'),
-                'coverage': read_file('coverage.xml'),
-                'report': read_file('report.txt')
-            }
-            self.correlation_id = correlation_id_file(client, self.bucket, proof, 'correlation_list.txt', tmpdir)
-            self.error = {
-                'build': read_file('build-err.txt'),
-                'property': read_file('cbmc-err.txt'),
-                'coverage': read_file('coverage-err.txt'),
-                'report': read_file('report-err.txt')
+        read_file = lambda name: cbmc_file(client, self.bucket,
+                                           proof, name)
+        # Read the index of the CBMC output and the traces it locates
+        # in preference to the CBMC output itself
+        self.index = cbmc_index(client, self.bucket, proof)
+        if self.index:
+            property_log = results.result_lines(self.index)
+            self.traces = {
+                name: results.read_trace(client, self.bucket,
+                                         '{}/out/{}'.format(
+                                             proof, results.CBMC_OUTPUT),
+                                         self.index, name)
+                for name in results.failing_properties(self.index)
             }
+        else:
+            property_log = read_file('cbmc.txt')
+            self.traces = {}
+        self.log = {
+            'build': read_file('build.txt'),
+            'property': property_log,
+            'coverage': read_file('coverage.xml'),
+            'report': read_file('report.txt')
+        }
+        self.correlation_id = correlation_id(client, self.bucket, proof)
+        self.error = {
+            'build': read_file('build-err.txt'),
+            'property': read_file('cbmc-err.txt'),
+            'coverage': read_file('coverage-err.txt'),
+            'report': read_file('report-err.txt')
+        }
         logging.info(' done')
         if self.log['property']:
             self.proof_status = self.log['property'][-2:]
@@ -689,6 +710,7 @@ class ProofResult:
         }
         if detail > 1:
             result['log'] = self.log
+            result['traces'] = self.traces
         if detail > 2:
             result['bucket'] = self.bucket
         return {self.proof: result}
@@ -714,18 +736,29 @@ def proof_bucket(client):
     assert len(proof_buckets) == 1
     return proof_buckets[0]
 
-def cbmc_file(client, bucket, proof, filename, tmpdir):
+def cbmc_file(client, bucket, proof, filename):
     try:
         key = '{}/out/{}'.format(proof, filename)
         logging.info("Attempting to read S3 key: " + str(key))
-        path = os.path.join(tmpdir, filename)
-        client.download_file(bucket, key, path)
-        with open(path) as data:
-            return data.read().splitlines()
+        response = client.get_object(Bucket=bucket, Key=key)
+        # Large artifacts may be written compressed
+        data = compressor.decompress(response['Body'].read(),
+                                     compressor.encoding(response.get('Metadata')))
+        return data.decode('utf-8').splitlines()
     except botocore.exceptions.ClientError:
         logging.error("Unable to read S3 bucket/key: {}/{}  ".format(str(bucket), str(key)))
         return None
 
+def cbmc_index(client, bucket, proof):
+    """The index of the CBMC output, or None for jobs run without one."""
+    try:
+        key = '{}/out/{}'.format(proof, results.RESULTS_INDEX)
+        response = client.get_object(Bucket=bucket, Key=key)
+        return results.load_index(response['Body'].read())
+    except botocore.exceptions.ClientError:
+        logging.info("No results index: {}/{}".format(str(bucket), str(key)))
+        return None
+
 
 ################################################################
 
@@ -734,16 +767,14 @@ def cbmc_file(client, bucket, proof, filename, tmpdir):
 ################################################################
 import time
 
-def correlation_id_file(client, bucket, proof, filename, tmpdir):
+def correlation_id(client, bucket, proof):
     try:
-        key = '{}/{}'.format(proof, filename)
-        logging.info("Attempting to read S3 key: " + str(key))
-        path = os.path.join(tmpdir, filename)
-        client.download_file(bucket, key, path)
-        with open(path) as data:
-            return json.loads(data.read())[0]
-    except botocore.exceptions.ClientError:
-        logging.error("Unable to read S3 bucket/key: {}/{}  ".format(str(bucket), str(key)))
+        logging.info("Attempting to read job manifest for: " + str(proof))
+        correlation_list = job_manifest.read_manifest(
+            client, bucket, proof)['correlation_list']
+        return correlation_list[0] if correlation_list else None
+    except (botocore.exceptions.ClientError, ValueError):
+        logging.error("Unable to read job manifest in S3 bucket/proof: {}/{}  ".format(str(bucket), str(proof)))
         return None
 
 MAX_QUERY_RESULTS = 10000
@@ -0,0 +1,317 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+The files a CBMC proof depends on, and the proofs affected by a change.
+
+A proof depends on the files in its directory and in the directories
+above it up to its proof group directory (its Makefile, its
+cbmc-batch.yaml, and the common Makefiles they include), on the
+Makefiles make reads, on the files (like scripts) named by the
+commands building the proof, on the source files goto-cc compiles for
+the proof, and on the headers these sources include.  The commands are
+the commands make would run to build the proof (make -n -B goto), and
+the headers are the dependencies the preprocessor finds (cpp -M) with
+the include paths and definitions of each command.  When the
+preprocessor fails, the proof depends on everything under its include
+directories instead.  A header added to or removed from an include
+directory may change the header a source includes, so the include
+directories are recorded too.
+
+A proof is affected by the change between two commits if the change
+touches a file the proof depends on at the later commit, or adds or
+removes a file in one of its include directories.  A proof whose
+dependencies cannot be found is affected by every change.
+
+The dependencies of the proofs for a commit are cached in S3.
+"""
+
+import json
+import logging
+import os
+import shlex
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+import clienterror
+import s3
+
+VERSION = 2
+CACHE_PREFIX = "dependencies"
+
+COMMAND_TIMEOUT = 300
+DEPENDENCY_THREADS = 16
+
+# Shell operators separating the commands on a line of make output
+OPERATORS = [';', '&&', '||', '|', '&']
+# The start of the database make prints after the commands
+DATABASE = '\n# Make data base'
+SOURCE_SUFFIXES = ['.c', '.cc', '.cpp']
+
+################################################################
+# Running commands
+
+def command_output(cmd, cwd=None):
+    """The output of a command, or None if the command fails."""
+
+    try:
+        result = subprocess.run(cmd, cwd=cwd, capture_output=True,
+                                timeout=COMMAND_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired) as err:
+        logging.info("Failed to run '%s': %s", ' '.join(cmd), str(err))
+        return None
+    if result.returncode:
+        logging.info("Failed to run '%s' in %s: %s", ' '.join(cmd), cwd or '.',
+                     result.stderr.decode('utf-8', 'replace').strip())
+        return None
+    return result.stdout.decode('utf-8', 'replace')
+
+def git(srcdir, *args):
+    """The output of a git command, stripped, or None if it fails."""
+
+    output = command_output(['git'] + list(args), srcdir)
+    return output.strip() if output is not None else None
+
+################################################################
+# The dependencies of a proof
+
+def build_commands(proofdir):
+    """The commands run to build a proof, as lists of arguments, and the
+    Makefiles read, or None if they cannot be found."""
+
+    # make prints the commands it would run and then its database
+    output = command_output(['make', '-p', '-n', '-B', 'goto'], proofdir)
+    if output is None:
+        return None
+    output, database = (output.split(DATABASE, 1) + [''])[:2]
+    makefiles = []
+    for line in database.splitlines():
+        if line.startswith('MAKEFILE_LIST :='):
+            makefiles = shlex.split(line.split(':=', 1)[1])
+            break
+
+    commands = []
+    for line in output.splitlines():
+        lexer = shlex.shlex(line, posix=True, punctuation_chars=True)
+        lexer.whitespace_split = True
+        try:
+            tokens = list(lexer)
+        except ValueError:
+            continue
+        command = []
+        for token in tokens + [OPERATORS[0]]:
+            if token not in OPERATORS:
+                command.append(token)
+                continue
+            if command:
+                commands.append(command)
+            command = []
+    return commands, makefiles
+
+def parse_command(args):
+    """The preprocessor flags, include directories, and sources of
+    the arguments to a goto-cc command."""
+
+    flags = []
+    includes = []
+    sources = []
+    args = iter(args)
+    for arg in args:
+        if arg in ['-I', '-D', '-U', '-include', '-isystem']:
+            value = next(args, '')
+            flags += [arg, value]
+            if arg in ['-I', '-isystem']:
+                includes.append(value)
+        elif arg.startswith(('-I', '-D', '-U')):
+            flags.append(arg)
+            if arg.startswith('-I'):
+                includes.append(arg[2:])
+        elif arg == '-o':
+            next(args, None)
+        elif os.path.splitext(arg)[1] in SOURCE_SUFFIXES:
+            sources.append(arg)
+    return flags, includes, sources
+
+def included_files(flags, source, proofdir):
+    """The files included by a source, or None if the preprocessor fails."""
+
+    output = command_output(['cpp', '-M'] + flags + [source], proofdir)
+    if output is None:
+        return None
+    # The output is a make rule "source.o: source.c header.h ..."
+    rule = output.replace('\\\n', ' ')
+    return shlex.split(rule.split(':', 1)[1]) if ':' in rule else []
+
+def relative_path(path, root, cwd):
+    """The path relative to root, or None if it is not under root."""
+
+    path = os.path.realpath(os.path.join(cwd, path))
+    root = os.path.realpath(root)
+    if path != root and not path.startswith(root + os.sep):
+        return None
+    return os.path.relpath(path, root)
+
+def directory_files(path):
+    """The files in a directory (and not its subdirectories)."""
+
+    return [os.path.join(path, name) for name in os.listdir(path)
+            if os.path.isfile(os.path.join(path, name))]
+
+def proof_directories(proofdir, root, markers):
+    """The directories from the proof directory up to its proof group
+    directory (ending with one of the markers) or the root."""
+
+    directories = []
+    path = os.path.realpath(proofdir)
+    root = os.path.realpath(root)
+    while path.startswith(root):
+        directories.append(path)
+        if path == root or any(path.endswith(os.sep + marker)
+                               for marker in markers):
+            break
+        path = os.path.dirname(path)
+    return directories
+
+def proof_dependencies(proofdir, root, markers):
+    """The dependencies of the proof in proofdir, or None if they cannot
+    be found.
+
+    The dependencies are a dict with the paths the proof depends on
+    (files, or directories meaning everything under them) under
+    'paths' and its include directories under 'directories', all
+    relative to the root of the repository.
+    """
+
+    found = build_commands(proofdir)
+    if found is None:
+        return None
+    commands, makefiles = found
+
+    paths = set(makefiles)
+    directories = set()
+    for directory in proof_directories(proofdir, root, markers):
+        paths.update(directory_files(directory))
+    for command in commands:
+        # Scripts and other files named by the commands
+        paths.update(arg for arg in command
+                     if os.path.isfile(os.path.join(proofdir, arg)))
+        if os.path.basename(command[0]) != 'goto-cc':
+            continue
+        flags, includes, sources = parse_command(command[1:])
+        directories.update(includes)
+        for source in sources:
+            paths.add(source)
+            included = included_files(flags, source, proofdir)
+            if included is None:
+                paths.update(includes)
+            else:
+                paths.update(included)
+
+    def relative(paths):
+        return sorted(set(path for path in
+                          [relative_path(path, root, proofdir)
+                           for path in paths]
+                          if path is not None))
+
+    return {'paths': relative(paths), 'directories': relative(directories)}
+
+def find_dependencies(proofdirs, root, markers):
+    """The dependencies of each proof in a list of proof directories, as
+    a dict from proof directory (relative to root) to dependencies."""
+
+    with ThreadPoolExecutor(DEPENDENCY_THREADS) as pool:
+        found = pool.map(
+            lambda proofdir: proof_dependencies(proofdir, root, markers),
+            proofdirs)
+        return {os.path.relpath(proofdir, root): dependencies
+                for proofdir, dependencies in zip(proofdirs, found)}
+
+################################################################
+# The dependencies cached for a commit
+
+def cache_key(repo_id, sha):
+    """The key for the dependencies of the proofs for a commit."""
+
+    return "{}/{}/{}.json".format(CACHE_PREFIX, repo_id, sha)
+
+def read_cache(client, bucket, repo_id, sha):
+    """The dependencies cached for a commit, or None."""
+
+    try:
+        body = s3.read_body(client.get_object(Bucket=bucket,
+                                              Key=cache_key(repo_id, sha)))
+    except ClientError as exc:
+        if clienterror.code(exc) != 'NoSuchKey':
+            raise
+        return None
+    cache = json.loads(body)
+    if cache.get('version') != VERSION:
+        return None
+    return cache['proofs']
+
+def write_cache(client, bucket, repo_id, sha, dependencies):
+    """Cache the dependencies of the proofs for a commit."""
+
+    client.put_object(Bucket=bucket, Key=cache_key(repo_id, sha),
+                      Body=json.dumps({'version': VERSION,
+                                       'proofs': dependencies}).encode('utf-8'),
+                      ContentType='application/json')
+
+def commit_dependencies(client, bucket, repo_id, sha, proofdirs, root,
+                        markers):
+    """The dependencies of the proofs for a commit, finding those not
+    cached for the commit and adding them to the cache."""
+
+    # pylint: disable=too-many-arguments
+    cached = read_cache(client, bucket, repo_id, sha) or {}
+    missing = [proofdir for proofdir in proofdirs
+               if os.path.relpath(proofdir, root) not in cached]
+    if not missing:
+        logging.info("Using dependencies cached for %s", sha)
+        return cached
+
+    dependencies = dict(cached, **find_dependencies(missing, root, markers))
+    write_cache(client, bucket, repo_id, sha, dependencies)
+    return dependencies
+
+################################################################
+# The proofs affected by a change
+
+def changes(srcdir, base):
+    """The changes from the base commit to the commit checked out, as
+    (status, path) pairs, or None if the changes cannot be found.
+
+    The status is A for a path added, D for a path deleted, and M
+    for a path modified (including a submodule changed).
+    """
+
+    output = git(srcdir, 'diff', '--name-status', '--no-renames',
+                 base, 'HEAD')
+    if output is None:
+        return None
+    return [tuple(line.split('\t', 1))
+            for line in output.splitlines() if '\t' in line]
+
+def overlaps(path, other):
+    """Whether one path is the other or is under the other."""
+
+    return (path == other or path.startswith(other + '/') or
+            other.startswith(path + '/'))
+
+def affected(dependencies, changed):
+    """Whether a proof with the dependencies is affected by the changes."""
+
+    if dependencies is None:
+        return True
+    for status, path in changed:
+        if any(overlaps(path, dependency)
+               for dependency in dependencies['paths']):
+            return True
+        if (status in ['A', 'D'] and
+                os.path.dirname(path) in dependencies['directories']):
+            return True
+    return False
+
+################################################################
@@ -0,0 +1,341 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+The proofs in a source tree, found once and reused by every stage.
+
+CBMC proofs are grouped together under proof group directories with
+names like cbmc/proofs and .cbmc-batch/jobs, and a proof is a
+directory under a proof group directory containing a cbmc-batch.yaml
+file giving the parameters for running the proof.
+
+The proof group directories are found in a single pass over the
+source tree that skips version control metadata and does not descend
+into the proof group directories, and the proofs are then found in a
+single pass over each proof group directory.  The manifest lists each
+proof with its name, its directory, its proof group directory, its
+parsed cbmc-batch.yaml, the result expected, and its memory settings.
+The manifest is written next to the tar file of the source tree as
+<tar file>.proofs.json, so the stages after prepare_source read the
+manifest instead of scanning the source tree again.
+
+Given only the tar file, the proofs are found from the manifest or the
+member index next to the tar file, if there is one, and otherwise by
+streaming the members of the tar file one at a time and matching each
+name against a single pattern for all proof group directories.
+"""
+
+import bz2
+import functools
+import gzip
+import json
+import lzma
+import os
+import re
+import tarfile
+
+import yaml
+
+import source_tarball
+
+################################################################
+
+# All proofs are under one of these directories
+PROOF_MARKERS = ['cbmc/proofs', '.cbmc-batch/jobs']
+
+# Expected name for CBMC Batch yaml
+YAML_NAME = 'cbmc-batch.yaml'
+
+# Directories never containing proofs
+SKIP_NAMES = ['.git', '.hg', '.svn', '.bzr']
+
+MANIFEST_SUFFIX = '.proofs.json'
+VERSION = 1
+
+# The first bytes of compressed tar files
+GZIP_MAGIC = b'\x1f\x8b'
+BZ2_MAGIC = b'BZh'
+XZ_MAGIC = b'\xfd7zXZ\x00'
+
+################################################################
+# Scanning the source tree
+
+def subdirectories(root, path):
+    """The subdirectories of path (relative to root), skipping version
+    control metadata and symbolic links."""
+
+    try:
+        with os.scandir(os.path.join(root, path)) as entries:
+            return [os.path.join(path, entry.name)
+                    for entry in entries
+                    if entry.is_dir(follow_symlinks=False) and
+                    entry.name not in SKIP_NAMES]
+    except OSError:
+        return []
+
+def is_group(path, markers):
+    """Whether a path (relative to the root) is a proof group directory."""
+
+    return any(path == marker or path.endswith(os.sep + marker)
+               for marker in markers)
+
+def find_groups(root, markers=None):
+    """The proof group directories under root, relative to root."""
+
+    markers = markers or PROOF_MARKERS
+    groups = []
+    stack = ['']
+    while stack:
+        for path in subdirectories(root, stack.pop()):
+            if is_group(path, markers):
+                groups.append(path)
+            else:
+                stack.append(path)
+    return sorted(groups)
+
+def find_proof_directories(root, group):
+    """The proof directories under a proof group directory, relative to
+    root."""
+
+    proofdirs = []
+    stack = [group]
+    while stack:
+        path = stack.pop()
+        if os.path.isfile(os.path.join(root, path, YAML_NAME)):
+            proofdirs.append(path)
+        stack.extend(subdirectories(root, path))
+    return sorted(proofdirs)
+
+################################################################
+# The manifest
+
+def expected_result(config):
+    """Return an expected substring for the CBMC result
+
+    The result is specified in a dict constructed from a user-provided yaml
+    """
+    return config.get("expected", "")
+
+def describe_proof(root, group, proofdir):
+    """The manifest entry for the proof in proofdir."""
+
+    proof = {
+        'name': os.path.basename(proofdir),
+        'directory': proofdir,
+        'group': group
+    }
+    try:
+        with open(os.path.join(root, proofdir, YAML_NAME)) as stream:
+            config = yaml.safe_load(stream) or {}
+        if not isinstance(config, dict):
+            raise ValueError("Expected a dictionary in " + YAML_NAME)
+    except (OSError, ValueError, yaml.YAMLError) as err:
+        # Only this proof fails, and only when it is launched
+        proof['error'] = "Can't read {} from {}: {}".format(
+            YAML_NAME, proofdir, err)
+        return proof
+    proof['config'] = config
+    proof['expected'] = expected_result(config)
+    proof['memory'] = {key: value for key, value in config.items()
+                       if key.endswith('memory')}
+    return proof
+
+def make_manifest(root, groups=None, markers=None):
+    """The manifest of the proofs under root, in the proof group
+    directories given or found under root."""
+
+    if groups is None:
+        groups = find_groups(root, markers)
+    return {
+        'version': VERSION,
+        'root': root,
+        'groups': groups,
+        'proofs': [describe_proof(root, group, proofdir)
+                   for group in groups
+                   for proofdir in find_proof_directories(root, group)]
+    }
+
+def tasks(manifest):
+    """The (proof-name, proof-directory) pairs for the proofs in a
+    manifest, with proof directories under the root."""
+
+    return [(proof['name'], os.path.join(manifest['root'],
+                                         proof['directory']))
+            for proof in manifest['proofs']]
+
+################################################################
+# The manifest in S3
+
+def manifest_key(key):
+    """The key for the manifest of the tar file with a key."""
+
+    return key + MANIFEST_SUFFIX
+
+def write_manifest(client, bucket, key, manifest):
+    """Write the manifest for the tar file with a key."""
+
+    client.put_object(Bucket=bucket, Key=manifest_key(key),
+                      Body=json.dumps(manifest, default=str).encode('utf-8'),
+                      ContentType='application/json')
+
+def read_manifest(client, bucket, key):
+    """The manifest for the tar file with a key."""
+
+    response = client.get_object(Bucket=bucket, Key=manifest_key(key))
+    manifest = json.loads(response['Body'].read())
+    if manifest.get('version', 0) > VERSION:
+        raise ValueError("Unsupported version {} of {}".format(
+            manifest['version'], manifest_key(key)))
+    return manifest
+################################################################
+# Scanning a tar file
+
+@functools.lru_cache(maxsize=None)
+def proof_pattern(markers):
+    """The pattern matching the cbmc-batch.yaml of a proof in a tar file
+    under one of a tuple of proof group directories."""
+
+    return re.compile('(.*/(?:{}))/(.*)/{}$'.format(
+        '|'.join(re.escape(marker) for marker in markers),
+        re.escape(YAML_NAME)))
+
+def scan_names(names, markers=None):
+    """The (proof-group-directory, proof-subdirectory) pairs for the
+    proofs among the names of the members of a tar file."""
+
+    match = proof_pattern(tuple(markers or PROOF_MARKERS)).match
+    proofs = []
+    for name in names:
+        found = match(name)
+        if found:
+            proofs.append(found.groups())
+    return proofs
+
+def open_stream(tarfile_name):
+    """The file object decompressing a tar file as it is read."""
+
+    with open(tarfile_name, 'rb') as fileobj:
+        magic = fileobj.read(len(XZ_MAGIC))
+    if magic.startswith(GZIP_MAGIC):
+        return gzip.open(tarfile_name)
+    if magic.startswith(BZ2_MAGIC):
+        return bz2.open(tarfile_name)
+    if magic.startswith(XZ_MAGIC):
+        return lzma.open(tarfile_name)
+    return open(tarfile_name, 'rb')
+
+def pax_path(data):
+    """The path in the records of a pax extended header, or None."""
+
+    path = None
+    pos = 0
+    while pos < len(data) and data[pos:pos+1] != tarfile.NUL:
+        space = data.index(b' ', pos)
+        length = int(data[pos:space])
+        key, _, value = data[space+1:pos+length-1].partition(b'=')
+        if key == b'path' and path is None or key == b'GNU.sparse.name':
+            path = value.decode(tarfile.ENCODING, 'surrogateescape')
+        pos += length
+    return path
+
+def checksum_valid(header):
+    """Whether the checksum of a tar header is valid."""
+
+    # The checksum is the sum of the bytes of the header with the
+    # checksum field itself taken as spaces
+    chksum = tarfile.nti(header[148:156])
+    return (chksum == sum(header) - sum(header[148:156]) + 256 or
+            chksum in tarfile.calc_chksums(header))
+
+def stream_names(tarfile_name):
+    """The names of the members of a tar file, read one header at a time.
+
+    Only the headers are parsed: the data of each member is read past
+    as it is decompressed, and nothing is kept from one member to the
+    next but a long name given by a GNU or pax extended header.
+    """
+
+    with open_stream(tarfile_name) as stream:
+        longname = None
+        while True:
+            header = stream.read(tarfile.BLOCKSIZE)
+            if len(header) < tarfile.BLOCKSIZE or not header.strip(
+                    tarfile.NUL):
+                return
+            if not checksum_valid(header):
+                raise tarfile.ReadError("Bad checksum in " + tarfile_name)
+            kind = header[156:157]
+            if kind == tarfile.GNUTYPE_SPARSE:
+                # The sparse map may continue in extension blocks
+                extended = header[482]
+                while extended:
+                    extended = stream.read(tarfile.BLOCKSIZE)[504]
+            size = tarfile.nti(header[124:136])
+            data = stream.read(-(-size // tarfile.BLOCKSIZE) *
+                               tarfile.BLOCKSIZE)[:size]
+
+            if kind == tarfile.GNUTYPE_LONGNAME:
+                longname = tarfile.nts(data, tarfile.ENCODING,
+                                       'surrogateescape')
+                continue
+            if kind == tarfile.XHDTYPE:
+                longname = pax_path(data)
+                continue
+            if kind in (tarfile.GNUTYPE_LONGLINK, tarfile.XGLTYPE,
+                        tarfile.SOLARIS_XHDTYPE):
+                continue
+
+            name = tarfile.nts(header[0:100], tarfile.ENCODING,
+                               'surrogateescape')
+            if header[257:265] == tarfile.POSIX_MAGIC and header[345]:
+                name = tarfile.nts(header[345:500], tarfile.ENCODING,
+                                   'surrogateescape') + '/' + name
+            yield (longname or name).rstrip('/')
+            longname = None
+
+def index_names(tarfile_name):
+    """The names of the members of a tar file in the index next to the
+    tar file, or None if there is no index."""
+
+    index = source_tarball.index_key(tarfile_name)
+    if not os.path.isfile(index):
+        return None
+    with open(index) as fileobj:
+        index = json.load(fileobj)
+    if index.get('version', 0) > source_tarball.INDEX_VERSION:
+        return None
+    # tar strips the leading / from the names of its members
+    return [member['name'].lstrip('/') for member in index['members']]
+
+def manifest_proofs(tarfile_name, markers=None):
+    """The (proof-group-directory, proof-subdirectory) pairs for the
+    proofs in the manifest next to a tar file, or None if there is no
+    manifest."""
+
+    manifest = manifest_key(tarfile_name)
+    if not os.path.isfile(manifest):
+        return None
+    with open(manifest) as fileobj:
+        manifest = json.load(fileobj)
+    if manifest.get('version', 0) > VERSION:
+        return None
+    return [(os.path.join(manifest['root'], proof['group']),
+             os.path.relpath(proof['directory'], proof['group']))
+            for proof in manifest['proofs']
+            if is_group(proof['group'], markers or PROOF_MARKERS)]
+
+def scan_tarfile(tarfile_name, markers=None, use_index=True):
+    """The (proof-group-directory, proof-subdirectory) pairs for the
+    proofs in a tar file, read from the manifest or index next to the
+    tar file when use_index is set and there is one."""
+
+    if use_index:
+        proofs = manifest_proofs(tarfile_name, markers)
+        if proofs is not None:
+            return proofs
+        names = index_names(tarfile_name)
+        if names is not None:
+            return scan_names(names, markers)
+    return scan_names(stream_names(tarfile_name), markers)
+
+################################################################
@@ -0,0 +1,198 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+The tar file of the source tree uploaded for the proofs.
+
+Every proof container downloads and extracts the tar file of the
+source tree, so the time to build the tar file and its size are part
+of the startup of every proof.  The tar file omits version control
+metadata (like the .git directories of the repository and its
+submodules) and the paths matching the patterns in EXCLUDE.  It is
+written by tar, compressed by pigz with a thread per core (or by gzip
+if pigz is not installed), and streamed to a multipart upload to S3
+without a temporary file.  The output is an ordinary gzipped tar file.
+
+The list of members of the tar file, with the size of each file, is
+written next to the tar file as <tar file>.index.json, so consumers
+can find a file without downloading the tar file.
+
+A slice of the source tree is a tar file of the same form with only
+some of the files in the source tree, like the files needed to build
+one proof.
+"""
+
+import fnmatch
+import json
+import logging
+import os
+import shutil
+import subprocess
+import threading
+import time
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+
+################################################################
+
+# Version control metadata omitted from the tar file
+VCS_NAMES = ['.git', '.hg', '.svn', '.bzr']
+# Patterns for other paths omitted (relative to the source tree)
+EXCLUDE = (os.environ.get('CBMC_TAR_EXCLUDE') or '').split()
+
+INDEX_SUFFIX = '.index.json'
+INDEX_VERSION = 1
+
+PIGZ = 'pigz'
+GZIP = 'gzip'
+
+# Multipart upload settings for streaming the tar file
+TRANSFER_CONFIG = TransferConfig(multipart_chunksize=16 * 1024 * 1024,
+                                 max_concurrency=10)
+
+################################################################
+# The members
+
+def excluded(path, exclude):
+    """Whether a path (relative to the source tree) is omitted."""
+
+    if os.path.basename(path) in VCS_NAMES:
+        return True
+    return any(fnmatch.fnmatch(path, pattern) for pattern in exclude)
+
+def find_members(srcdir, exclude=None):
+    """The members of the tar file of srcdir, as (name, size) pairs in
+    the order tar writes them, with a size of None for a directory.
+
+    Names are paths starting with srcdir, as in 'tar cf - srcdir'.
+    """
+
+    exclude = EXCLUDE if exclude is None else exclude
+    members = [(srcdir, None)]
+    for path, dirs, files in os.walk(srcdir):
+        relpath = os.path.relpath(path, srcdir)
+        kept = []
+        for name in sorted(dirs):
+            if excluded(os.path.normpath(os.path.join(relpath, name)),
+                        exclude):
+                continue
+            # A symbolic link to a directory is archived as a link
+            if os.path.islink(os.path.join(path, name)):
+                members.append((os.path.join(path, name), 0))
+            else:
+                kept.append(name)
+        dirs[:] = kept
+        for name in sorted(files):
+            if excluded(os.path.normpath(os.path.join(relpath, name)),
+                        exclude):
+                continue
+            members.append((os.path.join(path, name),
+                            os.lstat(os.path.join(path, name)).st_size))
+        # Directories are listed as they are visited
+        for name in kept:
+            members.append((os.path.join(path, name), None))
+    return members
+
+def slice_members(srcdir, paths):
+    """The members of the tar file of the paths (files or directories,
+    relative to srcdir) in srcdir, with the directories in the paths
+    archived with everything under them."""
+
+    members = {}
+    for path in paths:
+        name = os.path.join(srcdir, path)
+        if os.path.isdir(name) and not os.path.islink(name):
+            members.update(find_members(name, []))
+        elif os.path.lexists(name):
+            members[name] = os.lstat(name).st_size
+    # tar makes the directories leading to a member as it extracts it
+    return sorted(members.items())
+
+def make_index(members):
+    """The index of the members of a tar file."""
+
+    return {
+        'version': INDEX_VERSION,
+        'members': [{'name': name, 'size': size}
+                    if size is not None else {'name': name, 'type': 'dir'}
+                    for name, size in members]
+    }
+
+def index_key(key):
+    """The key for the index of the tar file with a key."""
+
+    return key + INDEX_SUFFIX
+
+def read_index(client, bucket, key):
+    """The index of the members of the tar file with a key."""
+
+    response = client.get_object(Bucket=bucket, Key=index_key(key))
+    index = json.loads(response['Body'].read())
+    if index.get('version', 0) > INDEX_VERSION:
+        raise ValueError("Unsupported version {} of {}".format(
+            index['version'], index_key(key)))
+    return index
+
+################################################################
+# The tar file
+
+def compressor():
+    """The command compressing the tar file."""
+
+    if shutil.which(PIGZ):
+        # pigz uses one compression thread per core by default
+        return [PIGZ, '-c']
+    return [GZIP, '-c']
+
+def upload_tarfile(srcdir, bucket, key, client=None, exclude=None,
+                   members=None):
+    """Stream the tar file of srcdir (or of the members of srcdir, if
+    given) to the key in the bucket and write its index, and return the
+    members of the tar file."""
+
+    # pylint: disable=too-many-arguments
+    client = client or boto3.client('s3')
+    if members is None:
+        members = find_members(srcdir, exclude)
+    start = time.time()
+
+    # The names of the members are given to tar on standard input,
+    # NUL-separated since a name may contain a newline
+    tar = subprocess.Popen(['tar', 'cf', '-', '--no-recursion', '--null',
+                            '-T', '-'],
+                           stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    compress = subprocess.Popen(compressor(), stdin=tar.stdout,
+                                stdout=subprocess.PIPE)
+    tar.stdout.close()
+
+    def write_names():
+        for name, _ in members:
+            tar.stdin.write(name.encode('utf-8') + b'\0')
+        tar.stdin.close()
+    writer = threading.Thread(target=write_names)
+    writer.start()
+
+    try:
+        client.upload_fileobj(compress.stdout, bucket, key,
+                              Config=TRANSFER_CONFIG)
+    finally:
+        writer.join()
+        compress.stdout.close()
+        tar.wait()
+        compress.wait()
+    if tar.returncode or compress.returncode:
+        client.delete_object(Bucket=bucket, Key=key)
+        raise subprocess.CalledProcessError(tar.returncode or
+                                            compress.returncode,
+                                            'tar' if tar.returncode
+                                            else compress.args[0])
+
+    client.put_object(Bucket=bucket, Key=index_key(key),
+                      Body=json.dumps(make_index(members)).encode('utf-8'),
+                      ContentType='application/json')
+    logging.info("Uploaded %d members of %s to s3://%s/%s in %.1fs",
+                 len(members), srcdir, bucket, key, time.time() - start)
+    return members
+
+################################################################
@@ -0,0 +1,116 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+SNAPSHOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(SNAPSHOT, '..', '..', 'bin'))
+sys.path.insert(0, SNAPSHOT)
+
+import proof_dependencies
+
+MAKEFILE = ("goto:\n"
+            "\tgoto-cc -I include -Iinclude/common -DPROOF=1 -o proof.goto "
+            "proof.c ../../source/queue.c && cp proof.goto run.goto\n")
+
+class CommandTest(unittest.TestCase):
+    """The commands make runs to build a proof, and their arguments."""
+
+    def setUp(self):
+        self.proofdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.proofdir)
+
+    def test_build_commands(self):
+        with open(os.path.join(self.proofdir, 'Makefile'), 'w') as fileobj:
+            fileobj.write(MAKEFILE)
+        commands, makefiles = proof_dependencies.build_commands(self.proofdir)
+        self.assertEqual(commands, [
+            ['goto-cc', '-I', 'include', '-Iinclude/common', '-DPROOF=1',
+             '-o', 'proof.goto', 'proof.c', '../../source/queue.c'],
+            ['cp', 'proof.goto', 'run.goto']])
+        self.assertEqual(makefiles, ['Makefile'])
+
+    def test_build_commands_without_makefile(self):
+        self.assertIsNone(proof_dependencies.build_commands(self.proofdir))
+
+    def test_parse_command(self):
+        flags, includes, sources = proof_dependencies.parse_command(
+            ['-I', 'include', '-Iinclude/common', '-DPROOF=1', '-U', 'NDEBUG',
+             '-include', 'config.h', '-isystem', 'sys', '--bounds-check',
+             '-o', 'proof.goto', 'proof.c', 'queue.cpp', 'notes.txt'])
+        self.assertEqual(flags, ['-I', 'include', '-Iinclude/common',
+                                 '-DPROOF=1', '-U', 'NDEBUG',
+                                 '-include', 'config.h', '-isystem', 'sys'])
+        self.assertEqual(includes, ['include', 'include/common', 'sys'])
+        self.assertEqual(sources, ['proof.c', 'queue.cpp'])
+
+class ChangeTest(unittest.TestCase):
+    """The proofs affected by the changes between two commits."""
+
+    DEPENDENCIES = {'paths': ['source/queue.c', 'cbmc/proofs/Queue'],
+                    'directories': ['include']}
+
+    def test_overlaps(self):
+        self.assertTrue(proof_dependencies.overlaps('a/b', 'a/b'))
+        self.assertTrue(proof_dependencies.overlaps('a/b/c', 'a/b'))
+        self.assertTrue(proof_dependencies.overlaps('a', 'a/b'))
+        self.assertFalse(proof_dependencies.overlaps('a/bc', 'a/b'))
+        self.assertFalse(proof_dependencies.overlaps('a/b', 'a/bc'))
+
+    def test_affected(self):
+        def affected(*changed):
+            return proof_dependencies.affected(self.DEPENDENCIES, changed)
+
+        self.assertTrue(affected(('M', 'source/queue.c')))
+        self.assertTrue(affected(('A', 'cbmc/proofs/Queue/stub.c')))
+        self.assertFalse(affected(('M', 'source/list.c')))
+        self.assertFalse(affected(('M', 'cbmc/proofs/QueueSend/Makefile')))
+        # A header added or removed may change the header included
+        self.assertTrue(affected(('A', 'include/queue.h')))
+        self.assertTrue(affected(('D', 'include/queue.h')))
+        self.assertFalse(affected(('M', 'include/queue.h')))
+        self.assertFalse(affected(('A', 'include/sub/queue.h')))
+        self.assertFalse(affected())
+
+    def test_affected_without_dependencies(self):
+        self.assertTrue(proof_dependencies.affected(None, []))
+
+    def test_changes(self):
+        srcdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, srcdir)
+
+        def git(*args):
+            subprocess.check_call(
+                ['git', '-c', 'user.name=test', '-c', 'user.email=test@test',
+                 '-c', 'commit.gpgsign=false'] + list(args),
+                cwd=srcdir, stdout=subprocess.DEVNULL)
+
+        def write(name, text):
+            with open(os.path.join(srcdir, name), 'w') as fileobj:
+                fileobj.write(text)
+
+        git('init', '-q')
+        write('kept.c', 'kept\n')
+        write('modified.c', 'old\n')
+        write('deleted.c', 'deleted\n')
+        git('add', '.')
+        git('commit', '-q', '-m', 'base')
+        base = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       cwd=srcdir).decode().strip()
+        write('modified.c', 'new\n')
+        write('added.c', 'added\n')
+        os.remove(os.path.join(srcdir, 'deleted.c'))
+        git('add', '-A')
+        git('commit', '-q', '-m', 'change')
+
+        self.assertEqual(sorted(proof_dependencies.changes(srcdir, base)),
+                         [('A', 'added.c'), ('D', 'deleted.c'),
+                          ('M', 'modified.c')])
+        self.assertIsNone(proof_dependencies.changes(srcdir, 'no-such-commit'))
+
+if __name__ == '__main__':
+    unittest.main()
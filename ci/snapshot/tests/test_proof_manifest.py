@@ -0,0 +1,113 @@
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import unittest
+
+SNAPSHOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(SNAPSHOT, '..', '..', 'bin'))
+sys.path.insert(0, SNAPSHOT)
+
+import proof_manifest
+
+LONG = '/'.join(['directory-{}'.format(number) for number in range(12)])
+
+NAMES = [
+    'repo/cbmc/proofs/Queue/cbmc-batch.yaml',
+    'repo/cbmc/proofs/Queue/Makefile',
+    'repo/source/queue.c',
+    # Longer than the 100 bytes of the name field
+    'repo/' + LONG + '/cbmc/proofs/Long/cbmc-batch.yaml',
+    'repo/' + LONG + '/' + 'f' * 120 + '.c',
+    'repo/source/café.c',
+]
+
+class StreamNamesTest(unittest.TestCase):
+    """The member names read from tar headers match the tarfile module."""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def make_tarfile(self, name, mode, tarformat):
+        path = os.path.join(self.root, name)
+        with tarfile.open(path, mode, format=tarformat) as tar:
+            directory = tarfile.TarInfo('repo/source')
+            directory.type = tarfile.DIRTYPE
+            tar.addfile(directory)
+            for member in NAMES:
+                if tarformat != tarfile.PAX_FORMAT and not member.isascii():
+                    continue
+                data = member.encode('utf-8') * 100
+                info = tarfile.TarInfo(member)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+            link = tarfile.TarInfo('repo/' + LONG + '/link.c')
+            link.type = tarfile.SYMTYPE
+            link.linkname = '../' + 'g' * 120 + '.c'
+            tar.addfile(link)
+            hardlink = tarfile.TarInfo('repo/hardlink.c')
+            hardlink.type = tarfile.LNKTYPE
+            hardlink.linkname = 'repo/source/queue.c'
+            tar.addfile(hardlink)
+        return path
+
+    def assert_names(self, path):
+        with tarfile.open(path) as tar:
+            expected = tar.getnames()
+        self.assertEqual(list(proof_manifest.stream_names(path)), expected)
+
+    def test_formats(self):
+        for tarformat in [tarfile.GNU_FORMAT, tarfile.PAX_FORMAT]:
+            self.assert_names(self.make_tarfile(
+                'source-{}.tar'.format(tarformat), 'w', tarformat))
+
+    def test_ustar_prefix(self):
+        # ustar splits a long name into a prefix and a name
+        path = os.path.join(self.root, 'source.tar')
+        with tarfile.open(path, 'w', format=tarfile.USTAR_FORMAT) as tar:
+            tar.addfile(tarfile.TarInfo('repo/' + LONG + '/queue.c'))
+            tar.addfile(tarfile.TarInfo('repo/queue.c'))
+        self.assert_names(path)
+
+    def test_compression(self):
+        for mode, suffix in [('w:gz', 'tar.gz'), ('w:bz2', 'tar.bz2'),
+                             ('w:xz', 'tar.xz')]:
+            self.assert_names(self.make_tarfile(
+                'source.' + suffix, mode, tarfile.PAX_FORMAT))
+
+    def test_gnu_tar(self):
+        # An archive written by GNU tar, as by the source tarball upload
+        srcdir = os.path.join(self.root, 'repo')
+        for name in NAMES:
+            path = os.path.join(self.root, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as fileobj:
+                fileobj.write(name)
+        path = os.path.join(self.root, 'source.tar.gz')
+        subprocess.check_call(['tar', 'czf', path, '-C', self.root,
+                               os.path.basename(srcdir)])
+        self.assert_names(path)
+
+    def test_bad_checksum(self):
+        path = self.make_tarfile('source.tar', 'w', tarfile.GNU_FORMAT)
+        with open(path, 'r+b') as fileobj:
+            fileobj.seek(150)
+            fileobj.write(b'77')
+        with self.assertRaises(tarfile.ReadError):
+            list(proof_manifest.stream_names(path))
+
+    def test_scan(self):
+        path = self.make_tarfile('source.tar.gz', 'w:gz', tarfile.PAX_FORMAT)
+        self.assertEqual(
+            sorted(proof_manifest.scan_tarfile(path, use_index=False)),
+            [('repo/cbmc/proofs', 'Queue'),
+             ('repo/' + LONG + '/cbmc/proofs', 'Long')])
+
+if __name__ == '__main__':
+    unittest.main()